@@ -0,0 +1,70 @@
+import errno
+import os
+import pathlib
+import shutil
+import tempfile
+import uuid
+
+
+# Every file that make_printable produces is first written (by us, or by miracle_grue) into a StagingDirectory, and then published, i.e. moved
+# into its final place with os.replace().  This has two benefits:
+#   - an output file either has its old content or its complete new content, never a partial one, so that an interrupted build can not leave
+#     behind (say) a half-written .makerbot file that make would consider to be up to date, and
+#   - provided that the staging directory is on the same filesystem as the outputs (which is why we create it alongside them, in the build
+#     directory, rather than in the system temp directory), publishing is a rename, not a copy, so that each artifact is written only once.
+# The staging directory (along with anything that we did not publish) is removed when the job finishes, whether or not it succeeded.
+class StagingDirectory:
+    # parentDirectory is the directory in which to create the staging directory, or None for the system temp directory.
+    def __init__(self, parentDirectory=None, prefix=".make_printable-"):
+        if parentDirectory is not None and not pathlib.Path(parentDirectory).is_dir():
+            parentDirectory = None
+        self.path = pathlib.Path(tempfile.mkdtemp(dir=parentDirectory, prefix=prefix)).resolve()
+
+    def getPath(self, name):
+        return self.path.joinpath(name)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.cleanup()
+
+
+# creates destinationPath (which must not already exist) having the same content as sourcePath, by making a hard link, if the filesystem
+# allows it, or else by copying.
+# Note that a hard link shares its content with the original, so neither one may subsequently be modified in place.  (We only ever
+# replace files, never modify them, so this is safe for our purposes.)
+def linkOrCopyFile(sourcePath, destinationPath):
+    try:
+        os.link(sourcePath, destinationPath)
+    except OSError:
+        shutil.copyfile(sourcePath, destinationPath)
+
+# atomically replaces (or creates) destinationPath with the file at stagedPath.
+# Ordinarily, we simply rename stagedPath to destinationPath.  If keepStagedFile is true, or if the two are on different filesystems (in
+# which case a rename is not possible), we instead link (or copy) stagedPath to a temporary file alongside destinationPath and rename that.
+def publishFile(stagedPath, destinationPath, keepStagedFile=False):
+    destinationPath = pathlib.Path(destinationPath)
+    if not keepStagedFile:
+        try:
+            os.replace(stagedPath, destinationPath)
+            return
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+    temporaryPath = destinationPath.parent.joinpath("." + destinationPath.name + "." + uuid.uuid4().hex + ".incomplete")
+    try:
+        linkOrCopyFile(stagedPath, temporaryPath)
+        os.replace(temporaryPath, destinationPath)
+        # (if destinationPath was already a link to the same file, the rename does nothing, and leaves temporaryPath in place.)
+        if os.path.lexists(temporaryPath):
+            os.remove(temporaryPath)
+    except BaseException:
+        if os.path.lexists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+    if not keepStagedFile:
+        os.remove(stagedPath)
@@ -0,0 +1,50 @@
+import argparse
+import json
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import config_annotation
+
+
+# Compares the time taken to produce the annotated hjson rendering of a miraclegrue config using a SchemaIndex against the time taken using
+# an UnindexedSchema (i.e. the way that make_printable used to do it), and checks that the two renderings are identical.
+#
+# usage (from braids/makerbot_printable_maker):
+#   python benchmarks/benchmark_config_annotation.py
+#   python benchmarks/benchmark_config_annotation.py --miraclegrue_config_file <config.json> --schema_file <schema.json> --repetitions 5
+
+thisDirectory = pathlib.Path(__file__).resolve().parent
+
+parser = argparse.ArgumentParser(description="Benchmark the annotation of a miraclegrue config with and without the schema index.")
+parser.add_argument("--miraclegrue_config_file", nargs=1, required=False, default=[str(thisDirectory.joinpath("../../../default+baseLayer=none_miraclegrue_config.json").resolve())])
+parser.add_argument("--schema_file", nargs=1, required=False, default=[str(thisDirectory.joinpath("../research/miracle_grue_5.31.0_config_schema.json").resolve())])
+parser.add_argument("--repetitions", nargs=1, type=int, required=False, default=[3])
+args=parser.parse_args()
+
+miraclegrueConfig = json.load(open(args.miraclegrue_config_file[0], 'r'))
+schema = json.load(open(args.schema_file[0], 'r'))
+
+# returns (the best time, in seconds, over the repetitions, the rendering)
+def timeAnnotation(makeSchemaIndex):
+    bestDuration = None
+    for i in range(args.repetitions[0]):
+        startTime = time.perf_counter()
+        # constructing the index is part of the cost (make_printable constructs one per config), so we include it in the timing.
+        annotatedConfig = config_annotation.dumpsAnnotatedHjsonValue(value=miraclegrueConfig, path=[], schema=makeSchemaIndex(schema))
+        duration = time.perf_counter() - startTime
+        bestDuration = (duration if bestDuration is None else min(bestDuration, duration))
+    return (bestDuration, annotatedConfig)
+
+print("config: " + args.miraclegrue_config_file[0])
+print("schema: " + args.schema_file[0])
+(unindexedDuration, unindexedAnnotatedConfig) = timeAnnotation(config_annotation.UnindexedSchema)
+print("unindexed: {:8.3f} s".format(unindexedDuration))
+(indexedDuration, indexedAnnotatedConfig) = timeAnnotation(config_annotation.SchemaIndex)
+print("indexed:   {:8.3f} s".format(indexedDuration))
+print("speedup:   {:8.1f}x".format(unindexedDuration/indexedDuration))
+if indexedAnnotatedConfig != unindexedAnnotatedConfig:
+    print("ERROR: the indexed and unindexed annotations differ.")
+    sys.exit(1)
+print("the indexed and unindexed annotations are identical (" + str(len(indexedAnnotatedConfig)) + " characters).")
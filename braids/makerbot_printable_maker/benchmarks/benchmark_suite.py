@@ -0,0 +1,226 @@
+import argparse
+import collections
+import copy
+import functools
+import gc
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import hjson
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import config_annotation
+import jsondiff_by_makerbot
+import jsontoolpath
+
+
+# Times the cpu-bound parts of make_printable that do not need MakerWare, against the checked-in build artifacts and configs, and compares
+# the results against a stored baseline (benchmarks/baseline.json), so that a slowdown fails loudly rather than going unnoticed:
+#   - jsontoolpath.generatePreviewableGcode() on the toolpaths within build/mount_plate.makerbot and build/drill_holder.makerbot,
+#   - the construction of a JSONDiff, and its pretty_str(), for several pairs of configs (the default config against the transformed one,
+#     against the config recorded in the metadata of mount_plate.makerbot, and the two research schemas against each other),
+#   - config_annotation.dumpsAnnotatedHjsonValue() of the transformed config against each of the research schemas, and
+#   - the loading (with hjson) of the default config.
+# For each benchmark we record the median time over the repetitions (running the quicker ones several times per repetition, so that each
+# repetition takes at least minimumRepetitionDuration, and reporting the time per run), the throughput (in commands/s, for those that
+# process a toolpath, and in MB/s of input), and the peak memory allocated by python while it runs (measured with tracemalloc, in a separate, untimed, run).
+# A benchmark fails if it is more than --tolerance (a fraction) slower, or uses more than --tolerance more memory, than its baseline.
+# The speed of the machine drifts (on a shared or virtual machine, by as much as half, from one run of the suite to the next), so we also time a fixed
+# calibration workload (see runCalibrationWorkload()), before and after the benchmarks, and compare each benchmark against its baseline relative
+# to the calibration time recorded with it (i.e. "vs base" is the change in the benchmark's time as a multiple of the calibration time).
+# The timings of the micro-benchmarks (those whose baseline is under microBenchmarkDuration per run) are noisier, even with many runs per
+# repetition, so they are held to the wider --micro_benchmark_tolerance instead, and no benchmark fails for being less than --absolute_tolerance
+# slower than its baseline.
+#
+# The baseline is only meaningful on the machine that recorded it; after a deliberate change in performance (or on a new reference
+# machine), record a new one with --update_baseline.
+#
+# usage (from braids/makerbot_printable_maker):
+#   python benchmarks/benchmark_suite.py
+#   python benchmarks/benchmark_suite.py --only gcode --repetitions 5
+#   python benchmarks/benchmark_suite.py --update_baseline
+
+thisDirectory = pathlib.Path(__file__).resolve().parent
+repositoryDirectory = thisDirectory.joinpath("../../..").resolve()
+minimumRepetitionDuration = 1.0
+microBenchmarkDuration = 0.01
+
+parser = argparse.ArgumentParser(description="Benchmark the toolpath, diff, annotation, and config loading code against the checked-in build artifacts, and compare against a stored baseline.")
+parser.add_argument("--baseline_file", nargs=1, required=False, default=[str(thisDirectory.joinpath("baseline.json"))])
+parser.add_argument("--update_baseline", action='store_true', required=False, help="store the results as the new baseline, rather than comparing against it.")
+parser.add_argument("--tolerance", nargs=1, type=float, required=False, default=[0.3], help="the fraction by which a benchmark may be slower (or use more memory) than its baseline before it fails.  Default: 0.3.")
+parser.add_argument("--micro_benchmark_tolerance", nargs=1, type=float, required=False, default=[0.5], help="the fraction by which a micro-benchmark (one whose baseline is under " + str(microBenchmarkDuration) + " s) may be slower than its baseline before it fails.  Default: 0.5.")
+parser.add_argument("--absolute_tolerance", nargs=1, type=float, required=False, default=[0.001], help="the time (in seconds) by which any benchmark may be slower than its baseline before it fails.  Default: 0.001.")
+parser.add_argument("--repetitions", nargs=1, type=int, required=False, default=[7])
+parser.add_argument("--only", nargs=1, required=False, help="run only the benchmarks whose names contain this string.")
+args=parser.parse_args()
+
+Benchmark = collections.namedtuple("Benchmark", ["name", "run", "commandCount", "byteCount"])
+# run is a function of no arguments that does the work being measured.
+# commandCount is the number of toolpath commands that run processes (or None), and byteCount the size of its input, in bytes.
+
+# a text file-like object that discards what is written to it (so that the benchmarks measure the generation of their output, not its storage).
+class NullWriter:
+    def write(self, text):
+        return len(text)
+
+
+# extracts the jsontoolpath from the .makerbot file at makerbotFilePath into directoryPath, and returns the path of the extracted file.
+# (the benchmarks read the toolpath from a file, as make_printable does, rather than from memory.)
+def extractJsontoolpath(makerbotFilePath, directoryPath):
+    jsontoolpathPath = pathlib.Path(directoryPath).joinpath(makerbotFilePath.stem + ".jsontoolpath")
+    with zipfile.ZipFile(makerbotFilePath) as makerbotFile:
+        jsontoolpathPath.write_bytes(makerbotFile.read("print.jsontoolpath"))
+    return jsontoolpathPath
+
+def loadTransformedConfig(miraclegrueConfig, transformFilePath):
+    isolatedGlobals = dict()
+    exec(compile(open(transformFilePath, 'r').read(), str(transformFilePath), 'exec'), isolatedGlobals)
+    return isolatedGlobals["transformMiraclegrueConfig"](copy.deepcopy(miraclegrueConfig))
+
+def generatePreviewableGcode(jsontoolpathPath):
+    with open(jsontoolpathPath, 'r') as inputJsontoolpathFile:
+        jsontoolpath.generatePreviewableGcode(inputJsontoolpathFile, NullWriter())
+
+# a fixed, pure python, workload (building a dict and round-tripping it through json), whose time we take as the measure of the speed of the machine.
+def runCalibrationWorkload():
+    x = {str(i): [i, i * 0.5, {'a': i}] for i in range(20000)}
+    json.loads(json.dumps(x))
+
+def getBenchmarks(workingDirectory):
+    benchmarks = []
+    configPath = repositoryDirectory.joinpath("default+baseLayer=none_miraclegrue_config.json")
+    configText = open(configPath, 'r').read()
+    miraclegrueConfig = json.loads(configText)
+    transformedConfig = loadTransformedConfig(miraclegrueConfig, repositoryDirectory.joinpath("miraclegrue_config_transform.py"))
+    schemaPaths = sorted(thisDirectory.joinpath("../research").resolve().glob("miracle_grue_*_config_schema.json"))
+    schemas = [(schemaPath.name.replace("_config_schema.json", ""), json.load(open(schemaPath, 'r'))) for schemaPath in schemaPaths]
+
+    for model in ["mount_plate", "drill_holder"]:
+        jsontoolpathPath = extractJsontoolpath(repositoryDirectory.joinpath("build", model + ".makerbot"), workingDirectory)
+        benchmarks.append(Benchmark(
+            name="generatePreviewableGcode " + model,
+            run=functools.partial(generatePreviewableGcode, jsontoolpathPath),
+            commandCount=jsontoolpathPath.read_bytes().count(b'"command"'),
+            byteCount=jsontoolpathPath.stat().st_size
+        ))
+
+    with zipfile.ZipFile(repositoryDirectory.joinpath("build", "mount_plate.makerbot")) as makerbotFile:
+        metadata = json.loads(makerbotFile.read("meta.json"))
+    configPairs = [
+        ("default vs transformed", miraclegrueConfig, transformedConfig),
+        ("default vs mount_plate metadata", miraclegrueConfig, metadata['miracle_config']['gaggles']['default']),
+    ]
+    if len(schemas) >= 2:
+        configPairs.append((schemas[0][0] + " vs " + schemas[-1][0] + " schema", schemas[0][1], schemas[-1][1]))
+    for (pairName, a, b) in configPairs:
+        byteCount = len(json.dumps(a)) + len(json.dumps(b))
+        benchmarks.append(Benchmark(name="JSONDiff " + pairName, run=lambda a=a, b=b: jsondiff_by_makerbot.JSONDiff(a, b), commandCount=None, byteCount=byteCount))
+        diff = jsondiff_by_makerbot.JSONDiff(a, b)
+        benchmarks.append(Benchmark(name="JSONDiff.pretty_str " + pairName, run=lambda diff=diff: diff.pretty_str(trim_size=300), commandCount=None, byteCount=byteCount))
+
+    for (schemaName, schema) in schemas:
+        benchmarks.append(Benchmark(
+            name="dumpsAnnotatedHjsonValue " + schemaName,
+            run=lambda schema=schema: config_annotation.dumpsAnnotatedHjsonValue(value=transformedConfig, path=[], schema=schema),
+            commandCount=None,
+            byteCount=len(json.dumps(transformedConfig))
+        ))
+
+    benchmarks.append(Benchmark(name="hjson load config", run=lambda: hjson.loads(configText), commandCount=None, byteCount=len(configText.encode('utf-8'))))
+    return benchmarks
+
+
+# returns a dict of the results of running benchmark.
+# As timeit does, we turn off the garbage collector while timing, so that the times do not depend on how much garbage the benchmarks that ran
+# before this one happened to leave behind.
+def runBenchmark(benchmark):
+    startTime = time.perf_counter()
+    benchmark.run()
+    runsPerRepetition = max(1, int(minimumRepetitionDuration / max(time.perf_counter() - startTime, 1e-6)))
+    durations = []
+    for i in range(args.repetitions[0]):
+        gc.collect()
+        gc.disable()
+        try:
+            startTime = time.perf_counter()
+            for j in range(runsPerRepetition):
+                benchmark.run()
+            durations.append((time.perf_counter() - startTime) / runsPerRepetition)
+        finally:
+            gc.enable()
+    medianDuration = statistics.median(durations)
+    tracemalloc.start()
+    try:
+        benchmark.run()
+        _, peakMemory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {'seconds': medianDuration, 'mb_per_s': benchmark.byteCount / 1e6 / medianDuration, 'peak_memory_mb': peakMemory / 1e6}
+    if benchmark.commandCount is not None:
+        result['commands_per_s'] = benchmark.commandCount / medianDuration
+    return result
+
+def getMachineDescription():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'processor': platform.processor() or platform.machine()}
+
+
+workingDirectory = tempfile.TemporaryDirectory()
+benchmarks = [benchmark for benchmark in getBenchmarks(workingDirectory.name) if not args.only or args.only[0] in benchmark.name]
+baseline = (json.load(open(args.baseline_file[0], 'r')) if pathlib.Path(args.baseline_file[0]).is_file() else None)
+if baseline and not args.update_baseline and baseline.get('machine') != getMachineDescription():
+    print("warning: the baseline was recorded on a different machine (" + json.dumps(baseline.get('machine')) + "), so the comparison may not be meaningful.")
+
+calibrationBenchmark = Benchmark(name="calibration", run=runCalibrationWorkload, commandCount=None, byteCount=0)
+calibrationSeconds = runBenchmark(calibrationBenchmark)['seconds']
+
+results = collections.OrderedDict()
+regressions = []
+tolerance = args.tolerance[0]
+for benchmark in benchmarks:
+    results[benchmark.name] = runBenchmark(benchmark)
+calibrationSeconds = (calibrationSeconds + runBenchmark(calibrationBenchmark)['seconds']) / 2
+print("calibration: " + format(calibrationSeconds, ".4f") + " s")
+print("{:70} {:>9} {:>12} {:>9} {:>10} {:>9}".format("benchmark", "seconds", "commands/s", "MB/s", "peak MB", "vs base"))
+for benchmark in benchmarks:
+    result = results[benchmark.name]
+    result['calibration_seconds'] = calibrationSeconds
+    baselineResult = (baseline or {}).get('benchmarks', {}).get(benchmark.name)
+    comparison = "new"
+    if baselineResult and 'calibration_seconds' not in baselineResult:
+        comparison = "no calib."
+    elif baselineResult and not args.update_baseline:
+        ratio = (result['seconds'] / calibrationSeconds) / (baselineResult['seconds'] / baselineResult['calibration_seconds'])
+        comparison = "{:+.0%}".format(ratio - 1)
+        timeTolerance = (args.micro_benchmark_tolerance[0] if baselineResult['seconds'] < microBenchmarkDuration else tolerance)
+        if ratio > 1 + timeTolerance and result['seconds'] - baselineResult['seconds'] * calibrationSeconds / baselineResult['calibration_seconds'] > args.absolute_tolerance[0]:
+            regressions.append(benchmark.name + " took " + format(result['seconds'], ".3g") + " s, against a baseline of " + format(baselineResult['seconds'], ".3g") + " s (" + comparison + ", relative to the calibration)")
+        if result['peak_memory_mb'] > baselineResult['peak_memory_mb'] * (1 + tolerance) + 1:
+            regressions.append(benchmark.name + " used " + format(result['peak_memory_mb'], ".1f") + " MB, against a baseline of " + format(baselineResult['peak_memory_mb'], ".1f") + " MB")
+    print("{:70} {:9.4f} {:>12} {:9.1f} {:10.1f} {:>9}".format(
+        benchmark.name,
+        result['seconds'],
+        ("{:.0f}".format(result['commands_per_s']) if 'commands_per_s' in result else "-"),
+        result['mb_per_s'],
+        result['peak_memory_mb'],
+        comparison
+    ))
+workingDirectory.cleanup()
+
+if args.update_baseline:
+    baseline = {'machine': getMachineDescription(), 'benchmarks': dict((baseline or {}).get('benchmarks', {}), **results)}
+    with open(args.baseline_file[0], 'w') as baselineFile:
+        json.dump(baseline, baselineFile, indent=4)
+    print("stored the results as the baseline in " + args.baseline_file[0])
+elif regressions:
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    sys.exit(1)
+elif baseline:
+    print("no regressions (tolerance " + format(tolerance, ".0%") + ", or " + format(args.micro_benchmark_tolerance[0], ".0%") + " for micro-benchmarks).")
@@ -0,0 +1,266 @@
+import collections.abc
+import json
+import mmap
+import struct
+import numpy
+import toolpath_arrays
+
+
+# A binarytoolpath file is a compact, binary sidecar to a jsontoolpath file, holding exactly the same command stream.
+# In the jsontoolpath, every move spells out its key names, its "metadata":{"relative":{...}} dict, and its list of tags,
+# so that a move costs on the order of 230 characters.  Here, a move costs 43 bytes, and the whole file is designed to be
+# mmap()-ed and used in place, without parsing.  The file consists of:
+#   - a fixed preamble: the magic bytes, the format version (uint32), and the size of the header (uint32),
+#   - the header: a small json object (padded to a multiple of 8 bytes) recording the counts, the dtype of the move records, the
+#     interned tag table, and the offset and size of each of the sections that follow, and
+#   - the sections (each starting at a multiple of 8 bytes):
+#       moves                   one fixed-width record per move (see moveRecordDtype).
+#       otherCommandIndices     int64 position, within the command stream, of each of the commands that are not moves.
+#       otherCommandStringIds   uint32 index, into the string table, of each of those commands.
+#       otherCommandKinds       uint8 for each of those commands: commentKind if the string is the text of a comment (and the
+#                               command is a plain {"function":"comment", ...} command), or jsonKind if the string is the json
+#                               serialization of the command.
+#       stringOffsets, strings  the string table: the (deduplicated) utf-8 strings, concatenated, and the uint64 offset of each
+#                               string within them (with one extra offset marking the end of the last string).
+#       layers                  one record per layer (see layerRecordDtype), as detected by ToolpathArrays.getLayers().
+# All of the numbers are little-endian.  The move coordinates are stored as float64, so that they survive the round trip exactly (see
+# toolpath_arrays.ToolpathArrays).
+
+magic = b"BTOOLPTH"
+formatVersion = 1
+preambleStruct = struct.Struct("<8sII")
+sectionAlignment = 8
+
+moveRecordDtype = numpy.dtype([
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('z', '<f8'),
+    ('a', '<f8'),
+    ('feedrate', '<f8'),
+    ('tagSetId', '<u2'),
+    ('relativeFlags', 'u1')
+])
+layerRecordDtype = numpy.dtype([
+    ('commandIndex', '<i8'),
+    ('moveIndex', '<i8'),
+    ('upperPosition', '<f8')
+])
+sectionDtypes = {
+    'moves': moveRecordDtype,
+    'otherCommandIndices': numpy.dtype('<i8'),
+    'otherCommandStringIds': numpy.dtype('<u4'),
+    'otherCommandKinds': numpy.dtype('u1'),
+    'stringOffsets': numpy.dtype('<u8'),
+    'strings': numpy.dtype('u1'),
+    'layers': layerRecordDtype
+}
+
+jsonKind = 0
+commentKind = 1
+
+
+def getPaddingSize(size):
+    return -size % sectionAlignment
+
+# returns (kind, string) for one of the non-move commands of a toolpath (see otherCommandKinds, above).
+def encodeOtherCommand(command):
+    if (
+        command and command.get('function') == 'comment' and len(command) == 4
+        and command.get('metadata') == {} and command.get('tags') == []
+        and isinstance(command.get('parameters'), dict) and list(command['parameters']) == ['comment'] and isinstance(command['parameters']['comment'], str)
+    ):
+        return (commentKind, command['parameters']['comment'])
+    return (jsonKind, json.dumps(command, separators=(',', ':')))
+
+def decodeOtherCommand(kind, string):
+    if kind == commentKind:
+        return {'function': 'comment', 'metadata': {}, 'parameters': {'comment': string}, 'tags': []}
+    return json.loads(string)
+
+
+# writes toolpathArrays (a toolpath_arrays.ToolpathArrays) to outputBinaryToolpathFile, a writable binary file-like object.
+def writeBinaryToolpath(toolpathArrays, outputBinaryToolpathFile):
+    moves = numpy.empty(toolpathArrays.moveCount, dtype=moveRecordDtype)
+    for name in ('x', 'y', 'z', 'a', 'feedrate', 'tagSetId', 'relativeFlags'):
+        moves[name] = getattr(toolpathArrays, ('tagSetIds' if name == 'tagSetId' else name))
+
+    # intern the tags, and the strings of the non-move commands (of which there are few distinct ones: a typical toolpath has thousands of
+    # comments and fan commands, but only a few hundred distinct ones).
+    tags = sorted(set(tag for tagSet in toolpathArrays.tagSets for tag in tagSet))
+    tagIds = {tag: tagId for tagId, tag in enumerate(tags)}
+    strings = []
+    stringIds = dict()
+    otherCommandStringIds = numpy.empty(len(toolpathArrays.otherCommands), dtype=sectionDtypes['otherCommandStringIds'])
+    otherCommandKinds = numpy.empty(len(toolpathArrays.otherCommands), dtype=sectionDtypes['otherCommandKinds'])
+    for i, command in enumerate(toolpathArrays.otherCommands):
+        kind, string = encodeOtherCommand(command)
+        stringId = stringIds.get(string)
+        if stringId is None:
+            stringId = stringIds[string] = len(strings)
+            strings.append(string)
+        otherCommandStringIds[i] = stringId
+        otherCommandKinds[i] = kind
+    encodedStrings = [string.encode('utf-8') for string in strings]
+    stringOffsets = numpy.zeros(len(encodedStrings) + 1, dtype=sectionDtypes['stringOffsets'])
+    numpy.cumsum([len(encodedString) for encodedString in encodedStrings], out=stringOffsets[1:])
+
+    layerStartCommandIndices, upperPositions = toolpathArrays.getLayers()
+    layers = numpy.empty(len(layerStartCommandIndices), dtype=layerRecordDtype)
+    layers['commandIndex'] = layerStartCommandIndices
+    layers['moveIndex'] = numpy.searchsorted(toolpathArrays.moveCommandIndices, layerStartCommandIndices)
+    layers['upperPosition'] = upperPositions
+
+    sectionContents = [
+        ('moves', moves.tobytes()),
+        ('otherCommandIndices', numpy.asarray(toolpathArrays.otherCommandIndices, dtype=sectionDtypes['otherCommandIndices']).tobytes()),
+        ('otherCommandStringIds', otherCommandStringIds.tobytes()),
+        ('otherCommandKinds', otherCommandKinds.tobytes()),
+        ('stringOffsets', stringOffsets.tobytes()),
+        ('strings', b"".join(encodedStrings)),
+        ('layers', layers.tobytes())
+    ]
+
+    # the size of the header depends on the section offsets, which depend on the size of the header, so we lay the
+    # sections out assuming a header of a given size, and try again with a larger one if the header turns out not to fit.
+    headerSize = 1024
+    while True:
+        sections = dict()
+        offset = preambleStruct.size + headerSize
+        for name, content in sectionContents:
+            sections[name] = [offset, len(content)]
+            offset += len(content) + getPaddingSize(len(content))
+        header = json.dumps({
+            'commandCount': toolpathArrays.commandCount,
+            'moveCount': toolpathArrays.moveCount,
+            'moveRecordFields': [[name, moveRecordDtype.fields[name][0].str] for name in moveRecordDtype.names],
+            'relativeAxes': list(toolpathArrays.relativeAxes),
+            'tags': tags,
+            'tagSets': [[tagIds[tag] for tag in tagSet] for tagSet in toolpathArrays.tagSets],
+            'sections': sections
+        }, separators=(',', ':')).encode('utf-8')
+        if len(header) <= headerSize:
+            break
+        headerSize = len(header) + getPaddingSize(len(header))
+
+    outputBinaryToolpathFile.write(preambleStruct.pack(magic, formatVersion, headerSize))
+    outputBinaryToolpathFile.write(header + b" " * (headerSize - len(header)))
+    for name, content in sectionContents:
+        outputBinaryToolpathFile.write(content)
+        outputBinaryToolpathFile.write(b"\0" * getPaddingSize(len(content)))
+
+
+# converts a jsontoolpath into a binarytoolpath.
+# inputJsontoolpathFile is a readable (text-mode) file-like object that is assumed to be a valid jsontoolpath file, and
+# outputBinaryToolpathFile is a writable binary file-like object.
+# progressReportingCallback, if given, is called with the completion ratio (a float) as the jsontoolpath is parsed.
+def convertJsontoolpathToBinaryToolpath(inputJsontoolpathFile, outputBinaryToolpathFile, progressReportingCallback=None):
+    writeBinaryToolpath(
+        toolpath_arrays.loadToolpathArrays(inputJsontoolpathFile, progressReportingCallback=progressReportingCallback),
+        outputBinaryToolpathFile
+    )
+
+
+# The non-move commands of a binarytoolpath, as a read-only sequence of command dicts (of the same form as in the jsontoolpath), each of
+# which is decoded from the string table only when it is accessed.
+class OtherCommands(collections.abc.Sequence):
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader.otherCommandKinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        return decodeOtherCommand(int(self.reader.otherCommandKinds[index]), self.reader.getString(int(self.reader.otherCommandStringIds[index])))
+
+    def __iter__(self):
+        # decode each distinct string only once.
+        decodedStrings = dict()
+        getString = self.reader.getString
+        for kind, stringId in zip(self.reader.otherCommandKinds.tolist(), self.reader.otherCommandStringIds.tolist()):
+            string = decodedStrings.get(stringId)
+            if string is None:
+                string = decodedStrings[stringId] = getString(stringId)
+            yield decodeOtherCommand(kind, string)
+
+
+# BinaryToolpathReader gives access to a binarytoolpath file by mmap()-ing it: the sections are exposed as numpy arrays that
+# refer directly to the mapped file, so opening the file costs only the parsing of its (small) header, no matter how large the toolpath.
+#   moves                   a structured array of moveRecordDtype, one record per move.
+#   otherCommandIndices, otherCommandStringIds, otherCommandKinds, layers    the sections of the same names (see above).
+#   tags, tagSets           the interned tag table, with tagSets as a list of tuples of tags (indexed by the tagSetId of a move).
+class BinaryToolpathReader:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fileMagic, fileFormatVersion, headerSize = preambleStruct.unpack_from(self.mmap, 0)
+            if fileMagic != magic:
+                raise ValueError(str(path) + " is not a binarytoolpath file.")
+            if fileFormatVersion != formatVersion:
+                raise ValueError(str(path) + " is a binarytoolpath file of format version " + str(fileFormatVersion) + ", whereas we understand only version " + str(formatVersion) + ".")
+            self.header = json.loads(self.mmap[preambleStruct.size:preambleStruct.size + headerSize])
+        except BaseException:
+            self.mmap.close()
+            raise
+        self.commandCount = self.header['commandCount']
+        self.moveCount = self.header['moveCount']
+        self.relativeAxes = tuple(self.header['relativeAxes'])
+        self.tags = self.header['tags']
+        self.tagSets = [tuple(self.tags[tagId] for tagId in tagSet) for tagSet in self.header['tagSets']]
+        self.moves = self.getSection('moves')
+        self.otherCommandIndices = self.getSection('otherCommandIndices')
+        self.otherCommandStringIds = self.getSection('otherCommandStringIds')
+        self.otherCommandKinds = self.getSection('otherCommandKinds')
+        self.stringOffsets = self.getSection('stringOffsets')
+        self.layers = self.getSection('layers')
+
+    def getSection(self, name):
+        offset, size = self.header['sections'][name]
+        if name == 'moves':
+            dtype = numpy.dtype([(fieldName, fieldType) for fieldName, fieldType in self.header['moveRecordFields']])
+        else:
+            dtype = sectionDtypes[name]
+        return numpy.frombuffer(self.mmap, dtype=dtype, count=size // dtype.itemsize, offset=offset)
+
+    def getString(self, stringId):
+        stringsOffset = self.header['sections']['strings'][0]
+        return self.mmap[stringsOffset + int(self.stringOffsets[stringId]):stringsOffset + int(self.stringOffsets[stringId + 1])].decode('utf-8')
+
+    # returns a ToolpathArrays whose move arrays are views of the mapped file (so that nothing is copied or parsed until it is used).
+    def getToolpathArrays(self):
+        moveCommandIndices = numpy.ones(self.commandCount, dtype=bool)
+        moveCommandIndices[self.otherCommandIndices] = False
+        return toolpath_arrays.ToolpathArrays(
+            x=self.moves['x'],
+            y=self.moves['y'],
+            z=self.moves['z'],
+            a=self.moves['a'],
+            feedrate=self.moves['feedrate'],
+            tagSetIds=self.moves['tagSetId'],
+            tagSets=self.tagSets,
+            relativeFlags=self.moves['relativeFlags'],
+            moveCommandIndices=numpy.flatnonzero(moveCommandIndices),
+            otherCommandIndices=self.otherCommandIndices,
+            otherCommands=OtherCommands(self),
+            layers=(self.layers['commandIndex'], self.layers['upperPosition'])
+        )
+
+    # (the file can only be unmapped once nothing else refers to our arrays, or to those of a ToolpathArrays that we returned.)
+    def close(self):
+        self.moves = self.otherCommandIndices = self.otherCommandStringIds = self.otherCommandKinds = self.stringOffsets = self.layers = None
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.close()
+
+
+# returns a ToolpathArrays for the binarytoolpath file at path.  The file remains mapped for as long as the returned
+# ToolpathArrays (or any of its arrays) is in use.
+def loadToolpathArrays(path):
+    return BinaryToolpathReader(path).getToolpathArrays()
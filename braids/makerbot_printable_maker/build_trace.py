@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+# A BuildTrace records how the wall time of a run of make_printable divides among the stages of its jobs, and what the subprocesses that it
+# runs (miracle_grue, sliceconfig) cost in cpu time and memory.
+#
+# Each stage is recorded as a span (a name, a start time, and a duration).  The spans are grouped by "process" (the job to which they
+# belong, or "make_printable" for the work that is shared among the jobs, such as loading the config) and, within a process, by "track"
+# (by default, the name of the span), so that the stages of a job that run at once appear side by side rather than on top of each other.
+# While a subprocess runs, we sample its cpu time and resident set size from /proc (on systems that have it; elsewhere the subprocess gets
+# a span but no samples).
+#
+# The trace can be written in the Chrome trace event format (see toChromeTrace()), which chrome://tracing and https://ui.perfetto.dev can
+# display, and summarized in one line (see getSummary()), which is handy for spotting regressions from one build to the next.
+
+class BuildTrace:
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.lock = threading.Lock()
+        # completed spans, as (process, track, name, startTime, duration, args) tuples.
+        self.spans = []
+        # counter samples, as (process, name, time, values) tuples.
+        self.counterSamples = []
+        # the resources used by each subprocess that we have monitored, as (process, name, cpuTime, peakRss) tuples (None where unknown).
+        self.subprocessResources = []
+
+    def getTime(self):
+        return time.perf_counter() - self.startTime
+
+    def addSpan(self, name, startTime, duration, process="make_printable", track=None, args=None):
+        with self.lock:
+            self.spans.append((process, track or name, name, startTime, duration, dict(args or {})))
+
+    # records the time taken by the body of the with statement as a span.  The with statement's target is a dict, to which the body may add
+    # arguments (e.g. sizes or cache keys) to be recorded with the span.
+    @contextlib.contextmanager
+    def span(self, name, process="make_printable", track=None, **args):
+        startTime = self.getTime()
+        try:
+            yield args
+        finally:
+            self.addSpan(name, startTime, self.getTime() - startTime, process=process, track=track, args=args)
+
+    # returns a function that calls function within a span (for handing to runInThread()).
+    def traced(self, function, name, process="make_printable", track=None):
+        @functools.wraps(function)
+        def tracedFunction(*args, **kwargs):
+            with self.span(name, process=process, track=track):
+                return function(*args, **kwargs)
+        return tracedFunction
+
+    # samples the cpu time and memory use of the subprocess having the given pid, every interval seconds, until it exits (or until the
+    # task running this coroutine is cancelled), and then records a span for it.
+    async def monitorSubprocess(self, pid, name, process="make_printable", interval=0.1):
+        startTime = self.getTime()
+        cpuTime = None
+        peakRss = None
+        previousSample = None
+        try:
+            while True:
+                sample = sampleProcessResources(pid)
+                if sample is None:
+                    break
+                sampleTime = self.getTime()
+                cpuTime = sample['cpuTime']
+                peakRss = max(peakRss or 0, sample['peakRss'] or 0, sample['rss'] or 0) or None
+                values = {'rss_mb': (sample['rss'] or 0) / 1e6}
+                if previousSample is not None and sampleTime > previousSample[0]:
+                    values['cpu_cores'] = (sample['cpuTime'] - previousSample[1]) / (sampleTime - previousSample[0])
+                with self.lock:
+                    self.counterSamples.append((process, name, sampleTime, values))
+                previousSample = (sampleTime, sample['cpuTime'])
+                await asyncio.sleep(interval)
+        finally:
+            args = {}
+            if cpuTime is not None: args['cpu_s'] = cpuTime
+            if peakRss is not None: args['peak_rss_mb'] = peakRss / 1e6
+            self.addSpan(name + " (pid " + str(pid) + ")", startTime, self.getTime() - startTime, process=process, track=name + " process", args=args)
+            with self.lock:
+                self.subprocessResources.append((process, name, cpuTime, peakRss))
+
+    # returns the trace as a dict in the Chrome trace event format (see https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKPNRY-4E).
+    def toChromeTrace(self):
+        with self.lock:
+            spans = list(self.spans)
+            counterSamples = list(self.counterSamples)
+        processIds = {}
+        threadIds = {}
+        events = []
+        def getIds(process, track):
+            if process not in processIds:
+                processIds[process] = len(processIds) + 1
+                events.append({'ph': 'M', 'name': 'process_name', 'pid': processIds[process], 'tid': 0, 'args': {'name': process}})
+            if (process, track) not in threadIds:
+                threadIds[(process, track)] = len(threadIds) + 1
+                events.append({'ph': 'M', 'name': 'thread_name', 'pid': processIds[process], 'tid': threadIds[(process, track)], 'args': {'name': track}})
+            return (processIds[process], threadIds[(process, track)])
+        for (process, track, name, startTime, duration, args) in sorted(spans, key=lambda span: span[3]):
+            pid, tid = getIds(process, track)
+            events.append({'ph': 'X', 'name': name, 'cat': 'stage', 'pid': pid, 'tid': tid, 'ts': startTime * 1e6, 'dur': duration * 1e6, 'args': args})
+        for (process, name, sampleTime, values) in counterSamples:
+            pid, tid = getIds(process, name + " process")
+            events.append({'ph': 'C', 'name': name + " resources", 'pid': pid, 'tid': tid, 'ts': sampleTime * 1e6, 'args': values})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def writeChromeTrace(self, outputTraceFile):
+        json.dump(self.toChromeTrace(), outputTraceFile)
+
+    # returns a one-line summary: the total wall time, the total time spent in each kind of stage (summed over the jobs, so, since stages run
+    # concurrently, these can add up to more than the wall time), and the cpu time and peak memory of the subprocesses.
+    def getSummary(self, maxStageCount=8):
+        with self.lock:
+            spans = list(self.spans)
+            subprocessResources = list(self.subprocessResources)
+        durationsByName = {}
+        for (process, track, name, startTime, duration, args) in spans:
+            if track.endswith(" process"):
+                continue
+            durationsByName[name] = durationsByName.get(name, 0) + duration
+        stages = sorted(durationsByName.items(), key=lambda item: -item[1])
+        summary = "build took " + format(self.getTime(), ".2f") + " s"
+        if stages:
+            summary += "; " + ", ".join(name + " " + format(duration, ".2f") + " s" for name, duration in stages[:maxStageCount])
+            if len(stages) > maxStageCount:
+                summary += ", ..."
+        resourcesByName = {}
+        for (process, name, cpuTime, peakRss) in subprocessResources:
+            totalCpuTime, maxPeakRss, count = resourcesByName.get(name, (None, None, 0))
+            if cpuTime is not None: totalCpuTime = (totalCpuTime or 0) + cpuTime
+            if peakRss is not None: maxPeakRss = max(maxPeakRss or 0, peakRss)
+            resourcesByName[name] = (totalCpuTime, maxPeakRss, count + 1)
+        for name, (totalCpuTime, maxPeakRss, count) in sorted(resourcesByName.items()):
+            if totalCpuTime is None and maxPeakRss is None:
+                continue
+            summary += "; " + name + (" x" + str(count) if count > 1 else "") + ":"
+            if totalCpuTime is not None: summary += " cpu " + format(totalCpuTime, ".2f") + " s"
+            if maxPeakRss is not None: summary += " peak rss " + format(maxPeakRss / 1e6, ".0f") + " MB"
+        return summary
+
+
+clockTicksPerSecond = (os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') and 'SC_CLK_TCK' in os.sysconf_names else 100)
+
+# returns a dict giving the cpu time (s, user plus system), resident set size (bytes), and peak resident set size (bytes, or None if
+# unknown) of the process having the given pid, read from /proc, or None if that is not possible (because the process has exited, or
+# because there is no /proc).
+def sampleProcessResources(pid):
+    try:
+        with open("/proc/" + str(pid) + "/stat", 'r') as statFile:
+            stat = statFile.read()
+        with open("/proc/" + str(pid) + "/status", 'r') as statusFile:
+            status = statusFile.read()
+    except OSError:
+        return None
+    # (the second field, the command name, is parenthesized and may itself contain spaces and parentheses.)
+    fields = stat[stat.rindex(")") + 2:].split()
+    if fields[0] == 'Z':
+        # (a zombie has no memory to report.)
+        return None
+    statusValues = {}
+    for line in status.splitlines():
+        key, _, value = line.partition(":")
+        if value.strip().endswith(" kB"):
+            statusValues[key] = int(value.split()[0]) * 1024
+    return {
+        'cpuTime': (int(fields[11]) + int(fields[12])) / clockTicksPerSecond,
+        'rss': statusValues.get('VmRSS'),
+        'peakRss': statusValues.get('VmHWM')
+    }
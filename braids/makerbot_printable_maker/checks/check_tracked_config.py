@@ -0,0 +1,149 @@
+import copy
+import json
+import pathlib
+import sys
+import hjson
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import jsondiff_by_makerbot
+import tracked_config
+
+
+# Checks that handing a transform a tracked_config.TrackedDict, rather than the config itself, changes neither what the transform does nor the
+# diff that we report: for the real transform (miraclegrue_config_transform.py, against the default config) and for a handful of transforms that
+# exercise the dict and list operations (copies, json encoding, aliasing, list insertion, in-place operators, ...), we run the transform through a MutationLog, and compare
+#   - the resulting config against that produced by running the transform on a plain deep copy of the config (or, for those transforms that
+#     share a container between two paths, which the TrackedDict deliberately does not do, against the values that we expect at a few paths), and
+#   - the diff that the MutationLog reports against a JSONDiff of a deep copy taken before the transform.
+# Exits with status 1 if any of them differ.
+#
+# usage (from braids/makerbot_printable_maker):
+#   python checks/check_tracked_config.py
+
+repositoryDirectory = pathlib.Path(__file__).resolve().parent.joinpath("../../..").resolve()
+
+
+def transformWithCopies(config):
+    shallowCopy = config.copy()
+    shallowCopy['layerHeight'] = 0.3
+    shallowCopy['extruderProfiles'][0]['extrusionProfiles']['solid']['feedrate'] = 71
+    config['jsonOfConfig'] = len(json.dumps(config))
+    config['hjsonOfConfig'] = len(hjson.dumps(config))
+    assert isinstance(config, dict) and isinstance(config['extruderProfiles'], list)
+    config['extruderProfiles'] = config['extruderProfiles'] + [config['extruderProfiles'][0].copy()]
+    config['extruderProfiles'][1]['extrusionProfiles']['solid']['feedrate'] = 72
+    return config
+
+def transformWithAliasing(config):
+    config['x'] = config['modelFillProfiles']
+    config['x']['sparse']['density'] = 0.99
+    config['modelFillProfiles']['solid']['density'] = 0.5
+    profiles = config['extruderProfiles']
+    profiles.insert(0, {'name': 'inserted'})
+    profiles[1]['extrusionProfiles']['solid']['feedrate'] = 73
+    detached = config.pop('modelShellProfiles')
+    detached['base_layer_surface']['numberOfShells'] = 5
+    config.setdefault('newSetting', []).append(1)
+    config.update({'fanLayer': 3}, doFixedShellStart=True)
+    for key, value in config.items():
+        if key == 'x':
+            value['solid']['density'] = 0.25
+    return config
+
+def transformWithRawCopies(config):
+    # (dict(), {**...} and list + list read the dict or list directly, rather than through __getitem__.)
+    dict(config)['extruderProfiles'][0]['extrusionProfiles']['solid']['feedrate'] = 74
+    {**config}['modelFillProfiles']['sparse']['density'] = 0.75
+    list(config['extruderProfiles'])[0]['extrusionProfiles']['solid']['feedrate'] += 1
+    ([] + config['extruderProfiles'])[0]['extrusionProfiles']['sparse']['feedrate'] = 76
+    return config
+
+def transformWithListOperators(config):
+    config['newList'] = [1]
+    config['newList'] += [2]
+    config['newList'] *= 2
+    config['newSum'] = [0] + config['newList'] + [3]
+    config['newProduct'] = config['newList'] * 2
+    config['modelFillProfiles']['solid']['pattern'] = [config['modelFillProfiles']['sparse']['density']] * 3
+    return config
+
+def transformWithDictOperators(config):
+    config |= {'layerHeight': 0.15}
+    config['modelFillProfiles'] |= {'extra': {'density': 0.1}}
+    merged = config['modelFillProfiles'] | {'another': {}}
+    merged['solid']['density'] = 0.35
+    config['merged'] = {'first': 1} | config['modelShellProfiles']
+    return config
+
+def transformReturningAnotherDict(config):
+    result = dict(config)
+    result['layerHeight'] = 0.1
+    return result
+
+
+def loadTransform(transformFilePath):
+    isolatedGlobals = dict()
+    exec(compile(open(transformFilePath, 'r').read(), str(transformFilePath), 'exec'), isolatedGlobals)
+    return isolatedGlobals["transformMiraclegrueConfig"]
+
+# returns a list of the problems found when running transform on config.
+# expectedValues, if given, is a dict mapping paths (tuples of keys) to the values that we expect there after the transform, in which case we do not
+# compare against the result of running the transform on a plain copy of the config.
+def checkTransform(transform, config, expectedValues=None):
+    initialConfig = copy.deepcopy(config)
+    trackedConfig = copy.deepcopy(config)
+    mutationLog = tracked_config.MutationLog(root=trackedConfig)
+    finalConfig = tracked_config.unwrap(transform(mutationLog.getTrackedRoot()))
+    problems = []
+    if expectedValues is None:
+        expectedConfig = transform(copy.deepcopy(config))
+        if json.dumps(finalConfig, sort_keys=True) != json.dumps(expectedConfig, sort_keys=True):
+            problems.append("the transformed config differs from that produced by transforming a plain copy of the config.")
+    else:
+        for path, expectedValue in expectedValues.items():
+            value = tracked_config.getAtPath(finalConfig, path)
+            if value != expectedValue:
+                problems.append(tracked_config.formatPath(path) + " is " + repr(value) + ", rather than " + repr(expectedValue) + ".")
+    if type(finalConfig) is not dict:
+        problems.append("the transformed config is a " + type(finalConfig).__name__ + ", rather than a dict.")
+    diff = mutationLog.getDiff(finalConfig).pretty_str(trim_size=300)
+    expectedDiff = jsondiff_by_makerbot.JSONDiff(initialConfig, finalConfig).pretty_str(trim_size=300)
+    if diff != expectedDiff:
+        problems.append("the diff reported by the mutation log differs from the diff against a deep copy:\n" + diff + "\n----- versus -----\n" + expectedDiff)
+    return problems
+
+
+config = json.load(open(repositoryDirectory.joinpath("default+baseLayer=none_miraclegrue_config.json"), 'r'))
+solidFeedratePath = ('extrusionProfiles', 'solid', 'feedrate')
+transforms = [
+    ("miraclegrue_config_transform.py", loadTransform(repositoryDirectory.joinpath("miraclegrue_config_transform.py")), None),
+    ("transformWithCopies", transformWithCopies, {
+        ('layerHeight',): config['layerHeight'],
+        ('extruderProfiles', 0) + solidFeedratePath: 71,
+        ('extruderProfiles', 1) + solidFeedratePath: 72,
+    }),
+    ("transformWithAliasing", transformWithAliasing, {
+        ('x', 'sparse', 'density'): 0.99,
+        ('x', 'solid', 'density'): 0.25,
+        ('modelFillProfiles', 'sparse', 'density'): config['modelFillProfiles']['sparse']['density'],
+        ('modelFillProfiles', 'solid', 'density'): 0.5,
+        ('extruderProfiles', 0, 'name'): 'inserted',
+        ('extruderProfiles', 1) + solidFeedratePath: 73,
+        ('newSetting',): [1],
+        ('fanLayer',): 3,
+    }),
+    ("transformWithRawCopies", transformWithRawCopies, None),
+    ("transformWithListOperators", transformWithListOperators, None),
+    ("transformReturningAnotherDict", transformReturningAnotherDict, None),
+]
+if sys.version_info >= (3, 9):
+    # (dicts have the | and |= operators only from python 3.9.)
+    transforms.append(("transformWithDictOperators", transformWithDictOperators, None))
+failed = False
+for (name, transform, expectedValues) in transforms:
+    problems = checkTransform(transform, config, expectedValues)
+    print(name + ": " + ("ok" if not problems else "FAILED"))
+    for problem in problems:
+        print("    " + problem)
+    failed = failed or bool(problems)
+sys.exit(1 if failed else 0)
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import paramiko
+
+
+# Checks upload_to_makerbot.py against a local sftp server (a paramiko SFTPServerInterface that serves a temporary directory, and accepts
+# any public key), by running the script, as the makefile does, to
+#   - upload two files into an empty directory,
+#   - upload a file whose first upload is cut off part way (the server fails the writes beyond a certain size), and then resume it,
+#   - upload again files whose content is already there (under other names), which must be skipped,
+#   - replace a file with other content of the same size, after which the replaced content must no longer count as uploaded, and
+#   - check that a host key that is not among the known hosts is rejected (unless --accept_unknown_host_key is given, in which case
+#     it is recorded in --known_hosts_file),
+# checking, after each, the files in the directory, the manifest, and that partial files of other content have been deleted.
+# Exits with status 1 if any of the checks fail.
+#
+# usage (from braids/makerbot_printable_maker):
+#   python checks/check_upload_to_makerbot.py
+
+uploadScriptPath = pathlib.Path(__file__).resolve().parent.parent.joinpath("upload_to_makerbot.py")
+
+
+# the server.  serverState['root'] is the directory that it serves; if serverState['maximumPartialFileSize'] is set, it fails any write that
+# would take a partial file beyond that size (having written what fits), as a dropped connection would.
+serverState = {'root': None, 'maximumPartialFileSize': None}
+
+class StubServer(paramiko.ServerInterface):
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_channel_request(self, kind, channelId):
+        return paramiko.OPEN_SUCCEEDED
+
+class StubSftpHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def write(self, offset, data):
+        maximumSize = serverState['maximumPartialFileSize']
+        if maximumSize is not None and self.filename.endswith(".partial") and offset + len(data) > maximumSize:
+            if offset < maximumSize:
+                super().write(offset, data[:maximumSize - offset])
+            return paramiko.SFTP_FAILURE
+        return super().write(offset, data)
+
+class StubSftpServer(paramiko.SFTPServerInterface):
+    def getLocalPath(self, path):
+        return os.path.join(serverState['root'], path.lstrip('/'))
+
+    def list_folder(self, path):
+        try:
+            result = []
+            for name in os.listdir(self.getLocalPath(path)):
+                attributes = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.getLocalPath(path), name)))
+                attributes.filename = name
+                result.append(attributes)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.getLocalPath(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fileDescriptor = os.open(self.getLocalPath(path), flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_RDWR:
+            mode = 'r+b'
+        elif flags & os.O_WRONLY:
+            mode = 'wb'
+        else:
+            mode = 'rb'
+        handle = StubSftpHandle(flags)
+        handle.filename = self.getLocalPath(path)
+        handle.readfile = handle.writefile = os.fdopen(fileDescriptor, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.getLocalPath(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldPath, newPath):
+        try:
+            os.replace(self.getLocalPath(oldPath), self.getLocalPath(newPath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    rename = posix_rename
+
+def serve(listeningSocket, hostKey):
+    # (the connections that we cut off, or reject, are expected, so we do not want paramiko to print their errors.)
+    logging.getLogger("paramiko").addHandler(logging.NullHandler())
+    while True:
+        connection, _ = listeningSocket.accept()
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(hostKey)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSftpServer)
+        transport.start_server(server=StubServer())
+
+
+# runs the upload script with the given arguments (in addition to those that identify the server), and returns (its exit status, its output).
+def runUpload(arguments):
+    process = subprocess.run(
+        [sys.executable, str(uploadScriptPath), "--host=127.0.0.1", "--port=" + str(port), "--username=makerbot", "--key_file=" + str(clientKeyPath),
+            "--destination_directory=/usb_storage/"] + arguments,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+    )
+    return (process.returncode, process.stdout)
+
+def getSha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+failures = []
+def check(description, condition, output=""):
+    print(description + ": " + ("ok" if condition else "FAILED"))
+    if not condition:
+        failures.append(description)
+        for line in output.splitlines():
+            print("    " + line)
+
+
+with tempfile.TemporaryDirectory() as temporaryDirectory:
+    temporaryDirectory = pathlib.Path(temporaryDirectory)
+    serverState['root'] = str(temporaryDirectory.joinpath("makerbot"))
+    destinationPath = temporaryDirectory.joinpath("makerbot/usb_storage")
+    destinationPath.mkdir(parents=True)
+    localPath = temporaryDirectory.joinpath("local")
+    localPath.mkdir()
+
+    hostKey = paramiko.RSAKey.generate(2048)
+    clientKeyPath = temporaryDirectory.joinpath("client_key")
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(clientKeyPath))
+    listeningSocket = socket.socket()
+    listeningSocket.bind(('127.0.0.1', 0))
+    listeningSocket.listen(5)
+    port = listeningSocket.getsockname()[1]
+    threading.Thread(target=serve, args=(listeningSocket, hostKey), daemon=True).start()
+    knownHosts = paramiko.HostKeys()
+    knownHosts.add("[127.0.0.1]:" + str(port), hostKey.get_name(), hostKey)
+    knownHostsPath = temporaryDirectory.joinpath("known_hosts")
+    knownHosts.save(str(knownHostsPath))
+    knownHostsArgument = "--known_hosts_file=" + str(knownHostsPath)
+
+    contents = {
+        'a.makerbot': os.urandom(3 << 20),
+        'b.makerbot': os.urandom(100000),
+        'c.makerbot': os.urandom(5 << 20),
+    }
+    for name, content in contents.items():
+        localPath.joinpath(name).write_bytes(content)
+    getInputArgument = lambda name: "--input_file=" + str(localPath.joinpath(name))
+    getManifest = lambda: json.loads(destinationPath.joinpath(".upload_manifest.json").read_text())
+    stalePartialName = "." + getSha256(b"some content that has since been rebuilt") + ".partial"
+    destinationPath.joinpath(stalePartialName).write_bytes(b"some content")
+
+    # a fresh upload.
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=1--", getInputArgument('a.makerbot'), getInputArgument('b.makerbot')])
+    check("fresh upload",
+        status == 0
+        and destinationPath.joinpath("1--a.makerbot").read_bytes() == contents['a.makerbot']
+        and destinationPath.joinpath("1--b.makerbot").read_bytes() == contents['b.makerbot']
+        and getManifest()['files'] == {
+            getSha256(contents['a.makerbot']): {'name': "1--a.makerbot", 'size': len(contents['a.makerbot'])},
+            getSha256(contents['b.makerbot']): {'name': "1--b.makerbot", 'size': len(contents['b.makerbot'])},
+        },
+        output
+    )
+    check("stale partial file deleted", not destinationPath.joinpath(stalePartialName).exists(), output)
+
+    # an upload that is cut off part way, and then resumed.
+    partialPath = destinationPath.joinpath("." + getSha256(contents['c.makerbot']) + ".partial")
+    serverState['maximumPartialFileSize'] = 2 << 20
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=2--", getInputArgument('c.makerbot')])
+    serverState['maximumPartialFileSize'] = None
+    check("interrupted upload",
+        status != 0
+        and not destinationPath.joinpath("2--c.makerbot").exists()
+        and partialPath.exists() and 0 < partialPath.stat().st_size <= (2 << 20),
+        output
+    )
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=3--", getInputArgument('c.makerbot')])
+    check("resumed upload",
+        status == 0
+        and "resuming an interrupted upload" in output
+        and destinationPath.joinpath("3--c.makerbot").read_bytes() == contents['c.makerbot']
+        and not partialPath.exists(),
+        output
+    )
+
+    # an upload of content that is already there.
+    localPath.joinpath("a copy of a.makerbot").write_bytes(contents['a.makerbot'])
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=4--", getInputArgument('a copy of a.makerbot'), getInputArgument('c.makerbot')])
+    check("dedupe skip",
+        status == 0
+        and output.count("skipping") == 2
+        and not any(name.startswith("4--") for name in os.listdir(str(destinationPath)))
+        and len(getManifest()['files']) == 3,
+        output
+    )
+
+    # replacing a file with other content of the same size.
+    otherContent = os.urandom(len(contents['b.makerbot']))
+    localPath.joinpath("b.makerbot").write_bytes(otherContent)
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=1--", getInputArgument('b.makerbot')])
+    check("replacing upload",
+        status == 0
+        and destinationPath.joinpath("1--b.makerbot").read_bytes() == otherContent
+        and getSha256(contents['b.makerbot']) not in getManifest()['files'],
+        output
+    )
+    localPath.joinpath("b.makerbot").write_bytes(contents['b.makerbot'])
+    (status, output) = runUpload([knownHostsArgument, "--name_prefix=6--", getInputArgument('b.makerbot')])
+    check("replaced content uploaded again",
+        status == 0
+        and "skipping" not in output
+        and destinationPath.joinpath("6--b.makerbot").read_bytes() == contents['b.makerbot'],
+        output
+    )
+
+    # the host key.
+    newKnownHostsPath = temporaryDirectory.joinpath("new_known_hosts")
+    (status, output) = runUpload(["--known_hosts_file=" + str(newKnownHostsPath), "--name_prefix=5--", getInputArgument('b.makerbot')])
+    check("unknown host key rejected", status != 0 and "not found in known_hosts" in output, output)
+    (status, output) = runUpload(["--known_hosts_file=" + str(newKnownHostsPath), "--accept_unknown_host_key", "--name_prefix=5--", getInputArgument('b.makerbot')])
+    check("unknown host key accepted and recorded",
+        status == 0
+        and paramiko.HostKeys(str(newKnownHostsPath)).check("[127.0.0.1]:" + str(port), hostKey),
+        output
+    )
+
+sys.exit(1 if failures else 0)
@@ -0,0 +1,231 @@
+import hjson #see https://hjson.github.io/hjson-py/
+
+
+# This module produces the "annotated" hjson rendering of a miraclegrue config, in which each entry is preceded by a block comment
+# giving the description, type, default, etc. of that entry, as declared in the config schema that miracle_grue emits
+# (miracle_grue --config-schema).
+#
+# A schema is a dict mapping type name to type spec.  The root of the config has type '__top__'.  A type spec of mode "aggregate" has
+# a list of members, each of which is a dict having (at least) 'id' and 'type'.  Otherwise, a type spec having json_type "object" maps
+# arbitrary keys to values of type value_type, and a type spec having json_type "array" has elements of type element_type.
+
+
+def makeBlockComment(x):
+    lines = str(x).splitlines()
+    return "\n".join(
+        ["/* " + lines[0]]
+        + list(
+            map(
+                lambda y: " * " + y,
+                lines[1:]
+            )
+        )
+        + [" */"]
+    )
+
+
+#returns the annotation text for a config entry whose key is memberId and whose specification (in the schema) is memberSpec.
+def formatMemberSpec(memberId, memberSpec):
+    return "\n".join(
+        [memberId]
+        + (["name: " + memberSpec.get('name')] if (memberSpec.get('name') and (memberSpec.get('name') != memberId)) else [])
+        + list(
+            map(
+                lambda k: k + ": " + hjson.dumps(memberSpec[k]),
+                filter(
+                    lambda k: k not in ['id','name'],
+                    memberSpec.keys()
+                )
+            )
+        )
+    )
+
+
+# A SchemaIndex answers the questions that dumpsAnnotatedHjsonValue() asks of the schema ("what is the type of the entry at this path?" and
+# "what is the annotation for the entry at this path?") without searching the schema.
+# The naive way to answer those questions (see UnindexedSchema, below) is to resolve the type of the parent by walking back up to
+# the root, doing a linear search of the members of each aggregate type along the way.  Since we ask for every entry in the config,
+# and the config (in particular, extruderProfiles and extrusionProfiles) is deeply nested, that costs O(depth² × members) per entry.
+# Here, instead, we build, once, a dict mapping (type name, member id) to member spec, and we memoize the resolved type name of each path prefix, so that
+# resolving the type of an entry is a dict lookup on the already-resolved type of its parent, and annotating the config is linear in the size of the config.
+# We also memoize the annotation text per (type name, member id), because the same member (of, say, an extrusion profile) recurs many times in a config.
+class SchemaIndex:
+    def __init__(self, schema):
+        self.schema = schema
+        self.memberSpecs = {}
+        self.memberIds = {}
+        for (typeName, schemedType) in schema.items():
+            if isinstance(schemedType, dict) and schemedType.get('mode') == "aggregate":
+                self.memberIds[typeName] = [memberSpec['id'] for memberSpec in schemedType['members']]
+                for memberSpec in schemedType['members']:
+                    # in the unlikely event that a member id is repeated, the first one wins (as it would in a linear search).
+                    self.memberSpecs.setdefault((typeName, memberSpec['id']), memberSpec)
+        self.schemedTypeNames = {(): '__top__'}
+        self.annotations = {}
+
+    # returns the name of the type of an entry whose key is key and whose parent has type parentTypeName.
+    def getChildTypeName(self, parentTypeName, key):
+        schemedTypeOfParent = self.schema.get(parentTypeName) if parentTypeName else None
+        if schemedTypeOfParent:
+            if schemedTypeOfParent['mode'] == "aggregate":
+                memberSpec = self.memberSpecs.get((parentTypeName, key))
+                if memberSpec:
+                    return memberSpec['type']
+            elif schemedTypeOfParent['json_type'] == "object":
+                return schemedTypeOfParent['value_type']
+            elif schemedTypeOfParent['json_type'] == "array":
+                return schemedTypeOfParent['element_type']
+        return None
+
+    # path is expected to be a list (or tuple) of keys
+    def getSchemedTypeName(self, path):
+        path = tuple(path)
+        try:
+            return self.schemedTypeNames[path]
+        except KeyError:
+            pass
+        schemedTypeName = self.getChildTypeName(self.getSchemedTypeName(path[:-1]), path[-1])
+        self.schemedTypeNames[path] = schemedTypeName
+        return schemedTypeName
+
+    def getSchemedType(self, path):
+        schemedTypeName = self.getSchemedTypeName(path)
+        if schemedTypeName:
+            return self.schema.get(schemedTypeName)
+        return None
+
+    def getMemberIds(self, path):
+        return self.memberIds.get(self.getSchemedTypeName(path))
+
+    #returns the annotation text that is to appear immediately
+    # before the entry having the specified path.
+    def getAnnotationForEntry(self, path):
+        parentTypeName = self.getSchemedTypeName(path[:-1])
+        key = path[-1]
+        memoKey = (parentTypeName, key)
+        try:
+            return self.annotations[memoKey]
+        except KeyError:
+            pass
+        schemedTypeOfParent = self.schema.get(parentTypeName) if parentTypeName else None
+        if schemedTypeOfParent and schemedTypeOfParent['mode'] == "aggregate":
+            memberSpec = self.memberSpecs.get(memoKey)
+            annotation = (formatMemberSpec(key, memberSpec) if memberSpec else "THIS ELEMENT IS NOT SPECIFIED IN THE SCHEMA.")
+        else:
+            annotation = None
+        self.annotations[memoKey] = annotation
+        return annotation
+
+
+# UnindexedSchema answers the same questions as SchemaIndex, in the same way that make_printable always used to: by walking back up
+# to the root and searching the members of each type along the way, on every call.  We keep it as a reference
+# implementation, against which to check (and benchmark) SchemaIndex.
+class UnindexedSchema:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def getSchemedTypeName(self, path):
+        if len(path) == 0:
+            return '__top__'
+        schemedTypeOfParent = self.getSchemedType(path[:-1])
+        if schemedTypeOfParent:
+            if schemedTypeOfParent['mode'] == "aggregate":
+                memberSpec = (
+                        list(
+                            filter(
+                                lambda x: x['id'] == path[-1],
+                                schemedTypeOfParent["members"]
+                            )
+                        ) or [None]
+                    )[0]
+                if memberSpec:
+                    return memberSpec['type']
+            elif schemedTypeOfParent['json_type'] == "object":
+                return schemedTypeOfParent['value_type']
+            elif schemedTypeOfParent['json_type'] == "array":
+                return schemedTypeOfParent['element_type']
+        return None
+
+    def getSchemedType(self, path):
+        schemedTypeName = self.getSchemedTypeName(path)
+        if schemedTypeName:
+            return self.schema.get(schemedTypeName)
+        return None
+
+    def getMemberIds(self, path):
+        schemedType = self.getSchemedType(path)
+        return (
+            [x['id'] for x in schemedType['members']]
+            if (schemedType and schemedType.get('mode') == "aggregate" )
+            else None
+        )
+
+    def getAnnotationForEntry(self, path):
+        schemedTypeOfParent = self.getSchemedType(path[:-1])
+        if schemedTypeOfParent and schemedTypeOfParent['mode'] == "aggregate":
+            memberSpec = (
+                    list(
+                        filter(
+                            lambda x: x['id'] == path[-1],
+                            schemedTypeOfParent["members"]
+                        )
+                    ) or [None]
+                )[0]
+            if memberSpec:
+                return formatMemberSpec(path[-1], memberSpec)
+            else:
+                return "THIS ELEMENT IS NOT SPECIFIED IN THE SCHEMA."
+        else:
+            return None
+
+
+#schema may be either a schema (i.e. a dict, as emitted by miracle_grue --config-schema), in which case we index it, or
+# an already-constructed SchemaIndex (or UnindexedSchema).
+def dumpsAnnotatedHjsonValue(value, path, schema):
+    schemaIndex = (SchemaIndex(schema) if isinstance(schema, dict) else schema)
+    output = []
+    appendAnnotatedHjsonValue(value, path, schemaIndex, indent="", firstLinePrefix="", output=output)
+    return "".join(output)
+
+# appends (to output, a list of strings) the lines of the annotated hjson rendering of value, each line prefixed by indent, and the first line
+# additionally by firstLinePrefix (e.g. 'key: ').  We pass the indent down, rather than indenting the rendering of each entry once it is
+# complete, so that each line is built once, however deeply it is nested, and the rendering takes time linear in its size.
+def appendAnnotatedHjsonValue(value, path, schemaIndex, indent, firstLinePrefix, output):
+    # print("now working on path: " + str(path))
+    schemedType = schemaIndex.getSchemedType(path)
+
+    isIterable = (
+        isinstance(value, dict)
+        or isinstance(value, list)
+        or (schemedType and schemedType.get('mode') == "aggregate" )
+        or (schemedType and schemedType.get('json_type') == "object")
+        or (schemedType and schemedType.get('json_type') == "array" )
+    )
+    if isIterable:
+        if isinstance(value, dict):
+            braces=["{","}"]
+            keysInValue=set(value.keys())
+            keysInSchema=set(schemaIndex.getMemberIds(path) or [])
+            subentryFormat="dictEntry"
+        else:
+            braces=["[","]"]
+            keysInValue=set(range(len(value)))
+            keysInSchema=set([])
+            subentryFormat="listEntry"
+        output.append(indent + firstLinePrefix + braces[0] + "\n")
+        subentryIndent = indent + "    "
+        for key in sorted(list(keysInValue.union(keysInSchema))):
+            annotation = schemaIndex.getAnnotationForEntry(path + [key])
+            if annotation:
+                output.append(subentryIndent + "\n")
+                output.extend(subentryIndent + line + "\n" for line in makeBlockComment(annotation).splitlines())
+
+            if key in keysInValue:
+                appendAnnotatedHjsonValue(value[key], path + [key], schemaIndex, subentryIndent, (key + ": "  if subentryFormat == "dictEntry" else ""), output)
+            else:
+                output.append(subentryIndent + "// VALUE NOT SPECIFIED" + "\n")
+        output.append(indent + braces[1] + "\n")
+    else:
+        lines = hjson.dumps(value).splitlines()
+        output.append(indent + firstLinePrefix + lines[0] + "\n")
+        output.extend(indent + line + "\n" for line in lines[1:])
@@ -0,0 +1,219 @@
+import collections
+import math
+import numpy
+import thing_mesh
+
+
+# A draft slicer, for looking at how a model slices without running miracle_grue (which takes minutes, and only runs where MakerWare is
+# installed).  We cut the mesh of a .thing (see thing_mesh) with horizontal planes, one through the middle of each layer (i.e. at
+# (i + 1/2) * layerHeight, for layer i), and chain the resulting segments into the contours of each layer, which can be written as SVG
+# (see writeSvg()) or as outline-only previewable gcode (see writeOutlineGcode()).  There are no insets, infill, supports, or raft, and the
+# layer heights are uniform, so a draft is a preview of the geometry of the layers, not of the toolpath.
+#
+# Everything is done with whole-array operations:
+#   - For each triangle, the planes that it spans form a contiguous range of plane indices (found by binary search of the triangle's lowest
+#     and highest z among the plane heights), so we expand the triangles into (triangle, plane) pairs, each of which is a genuine
+#     intersection, and sort the pairs by plane: a plane only ever touches the triangles that span it.
+#   - Each pair yields one segment, between the points at which the two edges that straddle the plane cross it.  (A vertex lying exactly on
+#     a plane is taken to be above it, so that no edge is counted twice.)  The point at which an edge
+#     crosses a plane is computed from the edge's endpoints in a fixed order (lower first), so that the two triangles that share the edge
+#     produce bit-for-bit the same point, and the segments can be chained by exact matching of their endpoints.
+#   - Segments are oriented by the winding of their triangles, so that, seen from above, outer contours run counterclockwise and holes
+#     clockwise.
+# Only the walk along each chain of segments, to put the points of each contour in order, is a python loop (over plain lists, not arrays).
+
+# ends of open chains (where the mesh has cracks) that are within this distance (in mm) of each other are joined.
+gapClosingDistance = 0.01
+
+DraftLayer = collections.namedtuple("DraftLayer", ["z", "contours", "openContourCount"])
+# contours is a list of (k, 2) float64 arrays of the (x, y) points of each contour, in order.  A closed contour does not repeat its first
+# point at the end.  The last openContourCount of the contours are open (the mesh was not closed there).
+
+
+# returns the heights of the slicing planes for a model whose top is at zMaximum.
+def getPlaneHeights(zMaximum, layerHeight):
+    # (allowing for rounding, so that a model whose top is at exactly a multiple of layerHeight does not get an empty layer above it.)
+    return (numpy.arange(max(0, math.ceil(zMaximum / layerHeight - 1e-9))) + 0.5) * layerHeight
+
+# returns the segments in which the triangles (an (n, 3, 3) array of vertices, in platform coordinates) cross the planes at planeHeights,
+# as (planeIndices, startPoints, endPoints), sorted by plane index, with the points as (m, 2) arrays.
+def getSegments(triangles, planeHeights):
+    z = triangles[:, :, 2]
+    firstPlaneIndices = numpy.searchsorted(planeHeights, z.min(axis=1), side='right')
+    endPlaneIndices = numpy.searchsorted(planeHeights, z.max(axis=1), side='right')
+    planeCounts = endPlaneIndices - firstPlaneIndices
+    triangleIndices = numpy.repeat(numpy.arange(len(triangles)), planeCounts)
+    planeIndices = numpy.arange(len(triangleIndices)) - numpy.repeat(numpy.cumsum(planeCounts) - planeCounts, planeCounts) + numpy.repeat(firstPlaneIndices, planeCounts)
+    order = numpy.argsort(planeIndices, kind='stable')
+    triangleIndices, planeIndices = triangleIndices[order], planeIndices[order]
+
+    vertices = triangles[triangleIndices]
+    planeZ = planeHeights[planeIndices]
+    above = vertices[:, :, 2] >= planeZ[:, None]
+    loneIsAbove = numpy.count_nonzero(above, axis=1) == 1
+    # (the lone vertex is the one on its own side of the plane.)
+    loneCorners = numpy.argmax(above == loneIsAbove[:, None], axis=1)
+    rows = numpy.arange(len(vertices))
+
+    def getCrossingPoints(otherCorners):
+        a, b = vertices[rows, loneCorners], vertices[rows, otherCorners]
+        lower = numpy.where(loneIsAbove[:, None], b, a)
+        upper = numpy.where(loneIsAbove[:, None], a, b)
+        t = (planeZ - lower[:, 2]) / (upper[:, 2] - lower[:, 2])
+        return lower[:, :2] + t[:, None] * (upper[:, :2] - lower[:, :2])
+
+    firstPoints = getCrossingPoints((loneCorners + 1) % 3)
+    secondPoints = getCrossingPoints((loneCorners + 2) % 3)
+    # (with the triangles wound counterclockwise as seen from outside, this runs outer contours counterclockwise as seen from above.)
+    startPoints = numpy.where(loneIsAbove[:, None], firstPoints, secondPoints)
+    endPoints = numpy.where(loneIsAbove[:, None], secondPoints, firstPoints)
+    # (a triangle whose top vertex lies exactly on a plane just touches it, at a point, which is no part of any contour.)
+    isSegment = numpy.any(startPoints != endPoints, axis=1)
+    return planeIndices[isSegment], startPoints[isSegment], endPoints[isSegment]
+
+# follows successors (a list giving, for each element, the index of the element that follows it, or -1 if none does; no element may
+# follow more than one other), and returns the chains that it forms, as (openChains, closedChains), each a list of lists of indices.
+def getChains(successors):
+    hasPredecessor = [False] * len(successors)
+    for successor in successors:
+        if successor >= 0:
+            hasPredecessor[successor] = True
+    visited = [False] * len(successors)
+    def walk(element):
+        chain = []
+        while element >= 0 and not visited[element]:
+            visited[element] = True
+            chain.append(element)
+            element = successors[element]
+        return chain
+    # the open chains start at elements that nothing leads into; everything left over is in closed loops.
+    openChains = [walk(element) for element in range(len(successors)) if not hasPredecessor[element]]
+    closedChains = [walk(element) for element in range(len(successors)) if not visited[element]]
+    return openChains, closedChains
+
+# returns, for each of the given ends (an (n, 2) array), the index of the nearest of starts (an (m, 2) array) that is within distance of
+# it, or -1 if there is none (or if a nearer end has claimed it).
+def getNearestStarts(ends, starts, distance):
+    if not len(ends) or not len(starts):
+        return numpy.full(len(ends), -1)
+    distances = numpy.hypot(ends[:, None, 0] - starts[None, :, 0], ends[:, None, 1] - starts[None, :, 1])
+    nearestStarts = numpy.argmin(distances, axis=1)
+    nearestDistances = distances[numpy.arange(len(ends)), nearestStarts]
+    order = numpy.argsort(nearestDistances, kind='stable')
+    _, firstClaims = numpy.unique(nearestStarts[order], return_index=True)
+    result = numpy.full(len(ends), -1)
+    claims = order[firstClaims]
+    claims = claims[nearestDistances[claims] <= distance]
+    result[claims] = nearestStarts[claims]
+    return result
+
+# returns the contours formed by the segments of one plane (startPoints[i] to endPoints[i]) as a list of point arrays (see DraftLayer),
+# along with the number of them that are open.
+def chainSegments(startPoints, endPoints):
+    segmentCount = len(startPoints)
+    if not segmentCount:
+        return [], 0
+    # number the distinct points (adding 0.0 so that -0.0 and 0.0 are the same point).
+    points = numpy.ascontiguousarray(numpy.concatenate([startPoints, endPoints]) + 0.0)
+    _, pointIds = numpy.unique(points.view(numpy.dtype((numpy.void, 16))).ravel(), return_inverse=True)
+    pointIds = pointIds.ravel()
+    segmentsByStart = numpy.full(2 * segmentCount, -1)
+    segmentsByStart[pointIds[:segmentCount]] = numpy.arange(segmentCount)
+    openChains, closedChains = getChains(segmentsByStart[pointIds[segmentCount:]].tolist())
+
+    # where the mesh has cracks, join the end of each open chain to the nearest start of an open chain (possibly its own), if it is within gapClosingDistance.
+    if openChains:
+        chainSuccessors = getNearestStarts(
+            endPoints[[chain[-1] for chain in openChains]],
+            startPoints[[chain[0] for chain in openChains]],
+            gapClosingDistance
+        )
+        openChainsOfChains, closedChainsOfChains = getChains(chainSuccessors.tolist())
+        openChains, closedChains = (
+            [sum((openChains[chain] for chain in chainOfChains), []) for chainOfChains in openChainsOfChains],
+            closedChains + [sum((openChains[chain] for chain in chainOfChains), []) for chainOfChains in closedChainsOfChains]
+        )
+    contours = [startPoints[chain] for chain in closedChains]
+    contours += [numpy.concatenate([startPoints[chain], endPoints[chain[-1:]]]) for chain in openChains]
+    return contours, len(openChains)
+
+# returns the list of DraftLayers of the .thing file at thingFilePath (all of its instances together), sliced at layerHeight (in mm).
+def sliceThing(thingFilePath, layerHeight):
+    triangles = numpy.concatenate([thing_mesh.getPlatformVertices(instance) for instance in thing_mesh.loadThing(thingFilePath)])
+    planeHeights = getPlaneHeights((triangles[:, :, 2].max() if len(triangles) else 0), layerHeight)
+    planeIndices, startPoints, endPoints = getSegments(triangles, planeHeights)
+    boundaries = numpy.searchsorted(planeIndices, numpy.arange(len(planeHeights) + 1))
+    layers = []
+    for planeIndex, z in enumerate(planeHeights.tolist()):
+        segments = slice(boundaries[planeIndex], boundaries[planeIndex + 1])
+        contours, openContourCount = chainSegments(startPoints[segments], endPoints[segments])
+        layers.append(DraftLayer(z=z, contours=contours, openContourCount=openContourCount))
+    return layers
+
+
+def getBounds(layers):
+    points = [contour for layer in layers for contour in layer.contours]
+    if not points:
+        return (0.0, 0.0, 0.0, 0.0)
+    points = numpy.concatenate(points)
+    return (float(points[:, 0].min()), float(points[:, 1].min()), float(points[:, 0].max()), float(points[:, 1].max()))
+
+# writes layers to outputSvgFile (a writable text file-like object) as an SVG drawing, with one panel per layer (in rows of columnCount,
+# from the bottom layer up), each labelled with its number (from 1, as in the previewable gcode) and its z.  Within a panel, the y axis
+# points up (as it does on the platform), closed contours are filled (with the even-odd rule, so that holes show as holes), and open
+# contours are drawn in red.
+def writeSvg(layers, outputSvgFile, columnCount=6, margin=5.0):
+    xMinimum, yMinimum, xMaximum, yMaximum = getBounds(layers)
+    panelWidth = xMaximum - xMinimum + 2 * margin
+    panelHeight = yMaximum - yMinimum + 3 * margin
+    rowCount = max(1, math.ceil(len(layers) / columnCount))
+    outputSvgFile.write(
+        '<svg xmlns="http://www.w3.org/2000/svg" width="' + format(panelWidth * min(columnCount, max(1, len(layers))), ".3f") + 'mm" height="' + format(panelHeight * rowCount, ".3f") + 'mm"'
+        + ' viewBox="0 0 ' + format(panelWidth * min(columnCount, max(1, len(layers))), ".3f") + ' ' + format(panelHeight * rowCount, ".3f") + '">\n'
+    )
+    for layerIndex, layer in enumerate(layers):
+        left = (layerIndex % columnCount) * panelWidth
+        top = (layerIndex // columnCount) * panelHeight
+        outputSvgFile.write('<g id="layer_' + str(layerIndex + 1) + '" data-z="' + format(layer.z, ".4f") + '">\n')
+        outputSvgFile.write(
+            '<text x="' + format(left + margin, ".3f") + '" y="' + format(top + 1.6 * margin, ".3f") + '" font-size="' + format(margin, ".3f") + '" font-family="sans-serif">'
+            + 'layer ' + str(layerIndex + 1) + ', z ' + format(layer.z, ".2f") + (', ' + str(layer.openContourCount) + ' open' if layer.openContourCount else '') + '</text>\n'
+        )
+        # (the transform maps platform coordinates into the panel, flipping y.)
+        outputSvgFile.write('<g transform="translate(' + format(left + margin - xMinimum, ".3f") + ',' + format(top + 2 * margin + yMaximum, ".3f") + ') scale(1,-1)">\n')
+        closedContours = layer.contours[:len(layer.contours) - layer.openContourCount]
+        openContours = layer.contours[len(layer.contours) - layer.openContourCount:]
+        if closedContours:
+            outputSvgFile.write('<path fill="#9ab" fill-rule="evenodd" stroke="#234" stroke-width="0.2" d="' + " ".join(getSvgPathData(contour) + " Z" for contour in closedContours) + '"/>\n')
+        if openContours:
+            outputSvgFile.write('<path fill="none" stroke="red" stroke-width="0.4" d="' + " ".join(getSvgPathData(contour) for contour in openContours) + '"/>\n')
+        outputSvgFile.write('</g>\n</g>\n')
+    outputSvgFile.write('</svg>\n')
+
+def getSvgPathData(contour):
+    return "M " + " L ".join(format(x, ".3f") + "," + format(y, ".3f") for x, y in contour.tolist())
+
+# writes layers to outputGcodeFile (a writable text file-like object) as gcode that traces the contours of each layer, in the form that
+# jsontoolpath.generatePreviewableGcode() produces (";LAYER:" comments, with the layers numbered from 1, ";TYPE:" comments, and an E axis
+# that advances as a 0.4 mm wide bead of the layer's height would, for 1.75 mm filament), so that a draft can be previewed in the same
+# way as the real toolpath, with the same layer numbers.
+def writeOutlineGcode(layers, outputGcodeFile, layerHeight, extrusionWidth=0.4, filamentDiameter=1.75, feedrate=1800.0, travelFeedrate=9000.0):
+    filamentPerMm = layerHeight * extrusionWidth / (math.pi * (filamentDiameter / 2) ** 2)
+    e = 0.0
+    output = []
+    for layerIndex, layer in enumerate(layers):
+        output.append(";LAYER:" + str(layerIndex + 1) + "\n")
+        z = format((layerIndex + 1) * layerHeight, ".3f")
+        for contourIndex, contour in enumerate(layer.contours):
+            isClosed = contourIndex < len(layer.contours) - layer.openContourCount
+            points = (numpy.concatenate([contour, contour[:1]]) if isClosed else contour)
+            output.append(";TYPE:WALL-OUTER\n")
+            output.append("G0 X" + format(points[0, 0], ".4f") + " Y" + format(points[0, 1], ".4f") + " Z" + z + " F" + format(travelFeedrate, ".1f") + "\n")
+            lengths = numpy.hypot(*numpy.diff(points, axis=0).T)
+            eValues = e + numpy.cumsum(lengths) * filamentPerMm
+            for (x, y), eValue in zip(points[1:].tolist(), eValues.tolist()):
+                output.append("G1 X" + format(x, ".4f") + " Y" + format(y, ".4f") + " Z" + z + " E" + format(eValue, ".5f") + " F" + format(feedrate, ".1f") + "\n")
+            if len(eValues):
+                e = eValues[-1]
+        outputGcodeFile.write("".join(output))
+        output.clear()
@@ -1,14 +1,78 @@
 import json
+import marshal
 
 """
 Represents a difference between two JSON objects, with helpers for easy printing
 and analysis.
 """
 
+
+def is_same_json(json_a, json_b):
+    """
+    True if json_a and json_b are certainly similar (in the sense of
+    JSONDiff.is_similar_value()), so that there is no need to walk them.
+
+    Identical objects are trivially similar.  Otherwise, we rely on ==
+    (which runs in C) to rule out most subtrees, but == considers 1, 1.0 and
+    True to be equal, whereas JSONDiff reports the difference between them,
+    so, for containers, we confirm by comparing their marshal serializations
+    (which record the type of every value, and which are several times
+    cheaper to produce than json.dumps()).  Version 2 of the marshal format
+    does not encode object sharing, so equal documents serialize alike
+    (unless their dicts differ in key order, in which case we merely return
+    False).  A False result only means that the caller has to look more
+    closely.
+    """
+
+    if json_a is json_b:
+        return True
+    if type(json_a) is not type(json_b) or json_a != json_b:
+        return False
+    if isinstance(json_a, (dict, list, tuple)):
+        try:
+            return marshal.dumps(json_a, 2) == marshal.dumps(json_b, 2)
+        except ValueError:
+            return False
+    return True
+
+
+def get_differing_indices(list_a, list_b, length, run_size=32):
+    """
+    The indices i < length at which list_a[i] and list_b[i] are not
+    certainly similar, in ascending order.
+
+    Rather than visiting every index, we bisect: a run of indices whose
+    slices compare the same (see is_same_json()) is skipped as a whole, so
+    that a long list (a toolpath, say) with a few differences costs a few
+    comparisons of slices rather than one Python-level comparison per
+    element.
+    """
+
+    differing_indices = []
+    pending = [(0, length)]
+    while pending:
+        start, stop = pending.pop()
+        if stop - start <= run_size:
+            differing_indices.extend(
+                i for i in range(start, stop)
+                if not is_same_json(list_a[i], list_b[i]))
+        elif not is_same_json(list_a[start:stop], list_b[start:stop]):
+            middle = (start + stop) // 2
+            # pushed in this order so that the first half is popped first.
+            pending.append((middle, stop))
+            pending.append((start, middle))
+    return differing_indices
+
+
 class JSONDiff:
     
+    __slots__ = ('json_a', 'json_b', 'type_diff', 'numeric_type_diff',
+                 'value_diff', 'dict_diff')
+
     class Missing:
         
+        __slots__ = ()
+
         def __eq__(self, other):
             if isinstance(other, JSONDiff.Missing):
                 return True
@@ -31,6 +95,40 @@ class JSONDiff:
 
     def __init__(self, json_a, json_b):
         
+        """
+        Only the subtrees that differ are walked (see is_same_json()), and
+        they are walked iteratively rather than recursively: each node
+        creates (but does not expand) a child for each of its entries that
+        might differ, and we expand the nodes from an explicit stack.
+        Children that turn out to be similar after all are then pruned,
+        children before parents, so that every node in the finished tree
+        represents a difference.
+        """
+
+        self.reset(json_a, json_b)
+
+        pending = [self]
+        expanded = []
+        while pending:
+            diff = pending.pop()
+            diff.expand()
+            expanded.append(diff)
+            pending.extend(diff.dict_diff.values())
+
+        for diff in reversed(expanded):
+            similar_keys = [key for key, child in diff.dict_diff.items()
+                            if child.is_similar_value()]
+            for key in similar_keys:
+                del diff.dict_diff[key]
+
+    @staticmethod
+    def make_unexpanded(json_a, json_b):
+        diff = JSONDiff.__new__(JSONDiff)
+        diff.reset(json_a, json_b)
+        return diff
+
+    def reset(self, json_a, json_b):
+
         self.json_a = json_a
         self.json_b = json_b
         
@@ -39,6 +137,11 @@ class JSONDiff:
         self.value_diff = None
         self.dict_diff = {}
 
+    def expand(self):
+
+        json_a = self.json_a
+        json_b = self.json_b
+
         if isinstance(json_a, bool):
             self.init_bool(json_a, json_b)
         elif isinstance(json_a, (int, float)):
@@ -87,14 +190,16 @@ class JSONDiff:
             for key, value_a in dict_a.items():
                 if key in json_b:
                     value_b = json_b[key]
-                    next_diff = JSONDiff(value_a, value_b)
-                    if not next_diff.is_similar_value():
-                        self.dict_diff[key] = next_diff
+                    if not is_same_json(value_a, value_b):
+                        self.dict_diff[key] = JSONDiff.make_unexpanded(
+                            value_a, value_b)
                 else:
-                    self.dict_diff[key] = JSONDiff(value_a, JSONDiff.Missing())
+                    self.dict_diff[key] = JSONDiff.make_unexpanded(
+                        value_a, JSONDiff.Missing())
             for key, value_b in json_b.items():
                 if key not in dict_a:
-                    self.dict_diff[key] = JSONDiff(JSONDiff.Missing(), value_b)
+                    self.dict_diff[key] = JSONDiff.make_unexpanded(
+                        JSONDiff.Missing(), value_b)
     
     def init_missing(self, missing_a, json_b):
         if not isinstance(json_b, JSONDiff.Missing):
@@ -109,18 +214,18 @@ class JSONDiff:
         if not isinstance(json_b, (list, tuple)):
             self.type_diff = (type(list_a), type(json_b))
         else:
-            for i, value_a in enumerate(list_a):
-                if i < len(json_b):
-                    value_b = json_b[i]
-                    next_diff = JSONDiff(value_a, value_b)
-                    if not next_diff.is_similar_value():
-                        self.dict_diff[i] = next_diff
-                else:
-                    self.dict_diff[i] = JSONDiff(value_a, JSONDiff.Missing())
-
-            if len(json_b) > len(list_a):
-                for i, value_b in enumerate(json_b, len(list_a)):
-                    self.dict_diff[i] = JSONDiff(JSONDiff.Missing(), value_b)
+            common_length = min(len(list_a), len(json_b))
+            for i in get_differing_indices(list_a, json_b, common_length):
+                self.dict_diff[i] = JSONDiff.make_unexpanded(
+                    list_a[i], json_b[i])
+
+            for i in range(common_length, len(list_a)):
+                self.dict_diff[i] = JSONDiff.make_unexpanded(
+                    list_a[i], JSONDiff.Missing())
+
+            for i in range(common_length, len(json_b)):
+                self.dict_diff[i] = JSONDiff.make_unexpanded(
+                    JSONDiff.Missing(), json_b[i])
     
     def init_unknown(self, json_a, json_b):
         if not isinstance(json_b, type(json_a)):
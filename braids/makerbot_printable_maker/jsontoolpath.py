@@ -0,0 +1,316 @@
+import json
+import os
+import re
+
+
+# A jsontoolpath file, as produced by miracle_grue, is a single (very large) json array, each element of which
+# is a dict of the form {"command": {...}}.  For a typical part, the file is tens of megabytes, and
+# json.load()-ing the whole thing holds every command dict in memory at once.
+# iterateJsontoolpathItems() parses the array incrementally, reading the file in chunks of chunkSize characters and yielding
+# one element at a time, so that the memory required is bounded by the size of the largest single element (plus the chunk size)
+# rather than by the size of the file.
+#
+# inputJsontoolpathFile is a readable (text-mode) file-like object that is assumed to be a valid jsontoolpath file.
+# If withOffsets is true, we yield tuples of the form (startOffset, endOffset, item), where startOffset and endOffset are the
+# character offsets (relative to the position of inputJsontoolpathFile at the time of the call) of the beginning and end of the
+# json text of item.  Otherwise, we yield just the items.
+# If insideArray is true, we assume that inputJsontoolpathFile is positioned somewhere within the top-level array (for instance,
+# at the start of one of the elements, as would be the case after seeking to an offset that we reported previously), rather than
+# at the opening bracket of the array.
+def iterateJsontoolpathItems(inputJsontoolpathFile, chunkSize=1<<20, withOffsets=False, insideArray=False):
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r"
+    buffer = ""
+    # bufferOffset is the offset, within the file, of buffer[0]
+    bufferOffset = 0
+    position = 0
+    endOfFile = False
+    state = ("expectingElement" if insideArray else "expectingArray")
+
+    def readMore():
+        nonlocal buffer, bufferOffset, position, endOfFile
+        # discard the part of the buffer that we have already consumed.
+        bufferOffset += position
+        buffer = buffer[position:]
+        position = 0
+        chunk = inputJsontoolpathFile.read(chunkSize)
+        if chunk:
+            buffer += chunk
+        else:
+            endOfFile = True
+
+    while True:
+        while position < len(buffer) and buffer[position] in whitespace:
+            position += 1
+        if position >= len(buffer):
+            if endOfFile:
+                if state != "done":
+                    raise ValueError("the jsontoolpath ended unexpectedly (before the closing bracket of the top-level array).")
+                return
+            readMore()
+            continue
+
+        if state == "expectingArray":
+            if buffer[position] != "[":
+                raise ValueError("expected the jsontoolpath to begin with '[', but found " + repr(buffer[position]) + ".")
+            position += 1
+            state = "expectingFirstElement"
+        elif state in ("expectingFirstElement", "expectingElement"):
+            if buffer[position] == "]" and state == "expectingFirstElement":
+                position += 1
+                state = "done"
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.decoder.JSONDecodeError:
+                # the element is (probably) split across the end of the buffer, so we read some more and try again.
+                # If we are already at the end of the file, then the element really is malformed.
+                if endOfFile:
+                    raise
+                readMore()
+                continue
+            if end == len(buffer) and not endOfFile:
+                # a scalar (a number, for instance) that abuts the end of the buffer might be truncated.
+                # Elements of a jsontoolpath are always dicts, so this does not really happen, but we
+                # play it safe anyway.
+                if not isinstance(item, (dict, list)):
+                    readMore()
+                    continue
+            startOffset = bufferOffset + position
+            position = end
+            state = "expectingSeparator"
+            if withOffsets:
+                yield (startOffset, bufferOffset + end, item)
+            else:
+                yield item
+        elif state == "expectingSeparator":
+            if buffer[position] == ",":
+                position += 1
+                state = "expectingElement"
+            elif buffer[position] == "]":
+                position += 1
+                state = "done"
+            else:
+                raise ValueError("expected ',' or ']' at offset " + str(bufferOffset + position) + " in the jsontoolpath, but found " + repr(buffer[position]) + ".")
+        else: # state == "done"
+            # we tolerate trailing whitespace only.
+            raise ValueError("unexpected content after the end of the top-level array, at offset " + str(bufferOffset + position) + " in the jsontoolpath.")
+
+
+# TailingFileReader is a readable, text-mode file-like object over a file that another process (i.e. miracle_grue) is still in the process of writing.
+# Where a regular file would report end-of-file (by returning "" from read()), we instead wait for the writer to append more, until writerFinished
+# (a threading.Event) is set, after which end-of-file is real.  This lets us consume the jsontoolpath (with iterateJsontoolpathItems()) while miracle_grue is
+# still producing it.  We assume that the writer only ever appends to the file (which is what miracle_grue does).
+# We deliberately do not expose fileno(), so that getFileSize() does not mistake the current size of the (still growing) file for its final size.
+class TailingFileReader:
+    def __init__(self, path, writerFinished, pollInterval=0.05):
+        self.file = open(path, 'r')
+        self.writerFinished = writerFinished
+        self.pollInterval = pollInterval
+
+    def read(self, size=-1):
+        while True:
+            data = self.file.read(size)
+            if data:
+                return data
+            if self.writerFinished.is_set():
+                # the writer might have appended some more between our read and its finishing.
+                return self.file.read(size)
+            self.writerFinished.wait(self.pollInterval)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.close()
+
+
+# returns the size of the file underlying the file-like object, if it can be determined, or else None.
+def getFileSize(file):
+    try:
+        return os.fstat(file.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+# Returns the noodleType (in the sense of generatePreviewableGcode(), i.e. one of cura's ";TYPE:..." categories)
+# corresponding to the given set of tags (the tags of a "move" command), or else None if the tags do not imply any
+# particular noodleType (in which case the noodleType is assumed not to have changed).
+def getNoodleTypeForTags(tags):
+    # tags encountered in a typical jsontoolpath:
+    #   BeadMode External
+    #   BeadMode Internal
+    #   BeadMode Internal Thick
+    #   BeadMode User3
+    #   Connection
+    #   Infill
+    #   Inset
+    #   Invalid Move
+    #   Leaky Travel Move
+    #   Long Restart
+    #   Restart
+    #   Retract
+    #   Support
+    #   Trailing Extrusion Move
+    #   Travel Move
+
+    # we need to map these (or, more accurately, combinations of these tags) to
+    # one of the following values for noodleType:
+    # The travel and retract moves are detected implicitly by the cura gcode previewer, so they
+    # don't have an explicit noodleType (which is one of the reasons I chose the name "noodleType":
+    # these categroies only apply to moves that produce a noodle.
+    #
+    #    WALL-INNER
+    #    WALL-OUTER
+    #    SKIN
+    #    SKIRT
+    #    SUPPORT
+    #    FILL
+    #    SUPPORT-INTERFACE
+    #    PRIME-TOWER
+
+    if "Support" in tags:
+        return "SUPPORT"
+    elif "Infill" in tags:
+        return "FILL"
+    elif "Inset" in tags:
+        #there are two possible senses for the words inner/internal and outer/external.  On the one hand, we might be
+        #  trying to distinguish between faces of holes vs. "outer" faces.  On the other hand, we might be
+        #  referring to the outermost shell vs. inner shells.
+        # I am not entirely sure if Cura's concept of WALL-OUTER vs. WALL-INNER is the same as MAkerbot's concept of BeadMode External
+
+        tagsContainingExternal = (tag for tag in tags if "External" in tag)
+        tagsContainingInternal = (tag for tag in tags if "Internal" in tag)
+        # print("\n" + str(len(list(tagsContainingExternal)))  + "\t" + str(len(list(tagsContainingInternal))) + "\n")
+        if tagsContainingExternal:
+            return "WALL-OUTER"
+        elif tagsContainingInternal:
+            return "WALL-INNER"
+        else:
+            print(
+                "strangely, we have encountered a \"move\" "
+                + "command having the \"Inset\" tag where none of the tags contains the word \"External\" "
+                + "and none of the tags contains the word \"Internal\"."
+            )
+            #we'll blindly assume that we are dealing with "WALL-OUTER"
+            return "WALL-OUTER"
+    #As far as I can tell, there is no good way to detect which moves in the jsontoolpath correspond to Cura's concepts of SKIN, SKIRT, SUPPORT-INTERFACE, and PRIME-TOWER.
+    return None
+
+
+upperPositionPrefix = "Upper Position"
+
+# if comment looks like "Upper Position  0.05", returns the position (as a float), else returns None.
+def parseUpperPosition(comment):
+    if comment.startswith(upperPositionPrefix):
+        return float(
+            re.search( pattern='[0123456789\\.\\+\\-]+',  string=comment[len(upperPositionPrefix):]   ).group(0)
+        )
+    return None
+
+
+# The state that the conversion to previewable gcode carries from one command to the next.
+# noodleType is the noodleType of the most recent ";TYPE:..." line, and layerNumber and lastUpperPosition are the number of the
+# current layer (i.e. of the most recent ";LAYER:..." line) and the value of the most recent "Upper Position ..." comment.
+# A converter that starts partway through the toolpath (see parallel_previewable_gcode) does not know the noodleType in effect at
+# its starting point, and so starts with noodleType set to unknownNoodleType, in which case we record, in firstNoodleTypeChangeIndex,
+# the position (within the output list) of the first ";TYPE:..." line, which might or might not turn out to be redundant.
+unknownNoodleType = "(unknown)"
+
+class PreviewableGcodeState:
+    def __init__(self, noodleType=None, layerNumber=0, lastUpperPosition=None):
+        self.noodleType = noodleType
+        self.layerNumber = layerNumber
+        self.lastUpperPosition = lastUpperPosition
+        self.firstNoodleTypeChangeIndex = None
+
+# appends (to output, a list of strings) the lines of previewable gcode for command (the value of the "command" entry of an item of the jsontoolpath).
+def appendPreviewableGcode(command, state, output):
+    function = command['function']
+    if function == 'move':
+        # look at tags to figure out whether we need to emit a ";TYPE:..." line
+        thisNoodleType = getNoodleTypeForTags(set(command['tags']))
+        if thisNoodleType is None:
+            #the default is to assume that noodleType has not changed.
+            thisNoodleType = state.noodleType
+
+        if thisNoodleType != state.noodleType:
+            if state.noodleType is unknownNoodleType and state.firstNoodleTypeChangeIndex is None:
+                state.firstNoodleTypeChangeIndex = len(output)
+            state.noodleType = thisNoodleType
+            output.append(";TYPE:" + str(thisNoodleType) + "\n")
+
+        parameters = command['parameters']
+        output.append(
+            "G1 X{} Y{} Z{} E{} F{}\n".format(
+                parameters['x'],
+                parameters['y'],
+                parameters['z'],
+                parameters['a'],
+                parameters['feedrate'] * 60
+            )
+        )
+    elif function == 'comment':
+        comment: str = command['parameters']['comment']
+        output.append("; " + comment + "\n")
+
+        #watch for a comment that looks like "Upper Position  0.05", and, upon change,
+        # increment layer number and emit a ";LAYER:" comment.
+        thisUpperPosition = parseUpperPosition(comment)
+        if thisUpperPosition is not None:
+            if thisUpperPosition != state.lastUpperPosition:
+                state.layerNumber += 1
+                output.append(";LAYER:" + str(state.layerNumber) + "\n")
+                state.lastUpperPosition = thisUpperPosition
+            else:
+                # if we get here, then we must have encountered an  "Upper Position" comment
+                # with the same value as the last "Upper Position" comment.
+                pass
+
+    elif function == 'set_toolhead_temperature':
+        pass
+    elif function == 'toggle_fan':
+        pass
+    elif function == 'fan_duty':
+        pass
+    else:
+        pass
+
+
+#inputFile is a readable file-like object that is assumed to be a valid jsontoolpath file
+#outputGcodeFile is a writeable file-like object that is assumed to be the destination where we want to dump the gcode
+#progressReportingCallback, if given, is expected to be a function that will be passed a single argument:
+# a float representing the completion ratio.
+# The jsontoolpath is parsed incrementally (see iterateJsontoolpathItems()), so memory usage does not grow with the size of the toolpath.
+# The output is accumulated and written (and the progress reported) once per outputBatchSize lines, rather than once per command.
+# The completion ratio is computed from the number of characters consumed, relative to the size of inputJsontoolpathFile.
+# (see parallel_previewable_gcode for a version that splits the work among several processes.)
+def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressReportingCallback = None, outputBatchSize = 4096):
+    inputSize = getFileSize(inputJsontoolpathFile)
+    state = PreviewableGcodeState()
+    output = []
+
+    for (startOffset, endOffset, item) in iterateJsontoolpathItems(inputJsontoolpathFile, withOffsets=True):
+        command = item.get('command')
+        if command:
+            appendPreviewableGcode(command, state, output)
+        if len(output) >= outputBatchSize:
+            outputGcodeFile.write("".join(output))
+            output.clear()
+            if progressReportingCallback and inputSize: progressReportingCallback(min(1, endOffset/inputSize))
+    outputGcodeFile.write("".join(output))
+    if progressReportingCallback and inputSize: progressReportingCallback(1)
+
+    # add a comment like ";LAYER:-6" at the beginning of each layer
+
+    # add comments like:
+    #    ";TYPE:FILL"
+    #    ";TYPE:SKIN"
+    #    ";TYPE:SUPPORT"
+    #    ";TYPE:SUPPORT-INTERFACE"
+    #    ";TYPE:WALL-INNER"
+    #    ";TYPE:WALL-OUTER"
+    #
@@ -0,0 +1,177 @@
+import collections
+import io
+import json
+import os
+import pathlib
+import jsontoolpath
+
+
+# A LayerIndex records, for each layer of a jsontoolpath, where that layer lies within the file, so that we can read
+# just the layers that we are interested in (seeking straight to them) rather than parsing the whole toolpath.
+# Layers are detected the same way that jsontoolpath.generatePreviewableGcode() detects them: a new layer begins at each
+# "Upper Position ..." comment whose value differs from that of the previous "Upper Position ..." comment, and the layers are
+# numbered from 1, as in the ";LAYER:..." lines of the previewable gcode.  The commands that precede the first layer (if any) form
+# layer 0, whose upperPosition is None.
+#
+# The index is stored as a small json file alongside the jsontoolpath (see getLayerIndexPath()).  It records the size and
+# modification time of the jsontoolpath that it describes, so that an index that has gone stale (because the toolpath has been
+# re-sliced) is detected, and rebuilt, rather than used.
+
+Layer = collections.namedtuple("Layer", ["layerNumber", "upperPosition", "startCommandIndex", "endCommandIndex", "startOffset", "endOffset"])
+# layerNumber is 0 for the commands that precede the first layer, or else the (1-based) number of the layer.
+# upperPosition is the z height (the value of the "Upper Position ..." comment) of the layer, or None for layer 0.
+# startCommandIndex and endCommandIndex are the position, within the command stream, of the first command of the layer and of the
+# first command after the layer (so the layer has endCommandIndex - startCommandIndex commands).
+# startOffset and endOffset are the byte offsets, within the jsontoolpath file, of the beginning of the json text of the first
+# command of the layer and of the end of the json text of the last.
+
+layerIndexFormatVersion = 1
+
+
+class LayerIndex:
+    def __init__(self, layers, commandCount, jsontoolpathSize, jsontoolpathModificationTime):
+        self.layers = layers
+        self.commandCount = commandCount
+        self.jsontoolpathSize = jsontoolpathSize
+        self.jsontoolpathModificationTime = jsontoolpathModificationTime
+        self.layersByNumber = {layer.layerNumber: layer for layer in layers}
+
+    @property
+    def layerCount(self):
+        return sum(1 for layer in self.layers if layer.layerNumber > 0)
+
+    # returns the Layer having the given layerNumber (raising a KeyError if there is no such layer).
+    def getLayer(self, layerNumber):
+        try:
+            return self.layersByNumber[layerNumber]
+        except KeyError:
+            raise KeyError("the toolpath has no layer " + str(layerNumber) + " (it has layers 1 through " + str(self.layerCount) + ").") from None
+
+    # returns the Layer containing the command at position commandIndex within the command stream.
+    def getLayerOfCommand(self, commandIndex):
+        for layer in self.layers:
+            if layer.startCommandIndex <= commandIndex < layer.endCommandIndex:
+                return layer
+        raise IndexError("command index " + str(commandIndex) + " is out of range.")
+
+    # returns the (last) Layer whose upperPosition is z, or the nearest one below it, or None if z is below the first layer.
+    def getLayerAtHeight(self, z):
+        result = None
+        for layer in self.layers:
+            if layer.upperPosition is not None and layer.upperPosition <= z:
+                result = layer
+        return result
+
+    # returns true if the index describes the jsontoolpath file at jsontoolpathPath, as it is now.
+    def isCurrentFor(self, jsontoolpathPath):
+        stat = os.stat(jsontoolpathPath)
+        return stat.st_size == self.jsontoolpathSize and stat.st_mtime_ns == self.jsontoolpathModificationTime
+
+    def toJson(self):
+        return {
+            'formatVersion': layerIndexFormatVersion,
+            'jsontoolpath': {'size': self.jsontoolpathSize, 'mtime_ns': self.jsontoolpathModificationTime},
+            'commandCount': self.commandCount,
+            'layerFields': list(Layer._fields),
+            'layers': [list(layer) for layer in self.layers]
+        }
+
+    @classmethod
+    def fromJson(cls, x):
+        if x.get('formatVersion') != layerIndexFormatVersion or x.get('layerFields') != list(Layer._fields):
+            raise ValueError("unsupported layer index format.")
+        return cls(
+            layers=[Layer(*layer) for layer in x['layers']],
+            commandCount=x['commandCount'],
+            jsontoolpathSize=x['jsontoolpath']['size'],
+            jsontoolpathModificationTime=x['jsontoolpath']['mtime_ns']
+        )
+
+
+# returns the path of the layer index file that goes with the jsontoolpath at jsontoolpathPath (e.g. build/foo.jsontoolpath.layerindex.json).
+def getLayerIndexPath(jsontoolpathPath):
+    jsontoolpathPath = pathlib.Path(jsontoolpathPath)
+    return jsontoolpathPath.with_name(jsontoolpathPath.name + ".layerindex.json")
+
+# opens the jsontoolpath file such that character offsets (as reported by jsontoolpath.iterateJsontoolpathItems()) are byte offsets:
+# latin-1 maps each byte to one character, and newline='' turns off the translation of line endings.  (Any non-ascii text within the
+# toolpath is garbled by this, but the only text we look at while indexing is the "Upper Position ..." comments.)
+def openForIndexing(jsontoolpathPath):
+    return open(jsontoolpathPath, 'r', encoding='latin-1', newline='')
+
+
+# builds a LayerIndex for the jsontoolpath file at jsontoolpathPath.  This parses the whole toolpath (once).
+# progressReportingCallback, if given, is called with the completion ratio (a float) as the jsontoolpath is parsed.
+def buildLayerIndex(jsontoolpathPath, progressReportingCallback=None):
+    stat = os.stat(jsontoolpathPath)
+    layers = []
+    layerNumber = 0
+    lastUpperPosition = None
+    layerStart = None # (upperPosition, startCommandIndex, startOffset) of the layer in progress
+    commandIndex = -1
+    lastEndOffset = 0
+    with openForIndexing(jsontoolpathPath) as inputJsontoolpathFile:
+        for (startOffset, endOffset, item) in jsontoolpath.iterateJsontoolpathItems(inputJsontoolpathFile, withOffsets=True):
+            commandIndex += 1
+            command = item.get('command')
+            if command and command['function'] == 'comment':
+                thisUpperPosition = jsontoolpath.parseUpperPosition(command['parameters']['comment'])
+                if thisUpperPosition is not None and thisUpperPosition != lastUpperPosition:
+                    if layerStart is not None:
+                        layers.append(Layer(layerNumber, layerStart[0], layerStart[1], commandIndex, layerStart[2], lastEndOffset))
+                    layerNumber += 1
+                    lastUpperPosition = thisUpperPosition
+                    layerStart = (thisUpperPosition, commandIndex, startOffset)
+            if layerStart is None:
+                layerStart = (None, commandIndex, startOffset)
+            lastEndOffset = endOffset
+            if progressReportingCallback and stat.st_size: progressReportingCallback(min(1, endOffset/stat.st_size))
+    if layerStart is not None:
+        layers.append(Layer(layerNumber, layerStart[0], layerStart[1], commandIndex + 1, layerStart[2], lastEndOffset))
+    return LayerIndex(layers=layers, commandCount=commandIndex + 1, jsontoolpathSize=stat.st_size, jsontoolpathModificationTime=stat.st_mtime_ns)
+
+def writeLayerIndex(layerIndex, outputLayerIndexFile):
+    json.dump(layerIndex.toJson(), outputLayerIndexFile, separators=(',', ':'))
+
+# returns the LayerIndex for the jsontoolpath file at jsontoolpathPath, reading it from layerIndexPath (by default, the path given by
+# getLayerIndexPath()) if there is a current index there, or else building it (and, if writeIfBuilt is true, writing it to layerIndexPath
+# for next time).
+def loadLayerIndex(jsontoolpathPath, layerIndexPath=None, writeIfBuilt=True):
+    layerIndexPath = (layerIndexPath or getLayerIndexPath(jsontoolpathPath))
+    try:
+        layerIndex = LayerIndex.fromJson(json.load(open(layerIndexPath, 'r')))
+        if layerIndex.isCurrentFor(jsontoolpathPath):
+            return layerIndex
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    layerIndex = buildLayerIndex(jsontoolpathPath)
+    if writeIfBuilt:
+        try:
+            with open(layerIndexPath, 'w') as outputLayerIndexFile:
+                writeLayerIndex(layerIndex, outputLayerIndexFile)
+        except OSError:
+            # (the index is only an optimization, so failing to save it is not an error.)
+            pass
+    return layerIndex
+
+
+# yields the command dicts (i.e. the values of the "command" entries of the items of the jsontoolpath) of the given layer, reading only
+# that layer's part of the jsontoolpath file.
+# inputJsontoolpathFile is a readable, seekable binary file-like object (e.g. open(path, 'rb')).
+def iterateLayerCommands(inputJsontoolpathFile, layer):
+    inputJsontoolpathFile.seek(layer.startOffset)
+    text = inputJsontoolpathFile.read(layer.endOffset - layer.startOffset).decode('utf-8')
+    # the closing bracket makes the text look like the tail of the top-level array.
+    for item in jsontoolpath.iterateJsontoolpathItems(io.StringIO(text + "]"), insideArray=True):
+        yield item.get('command')
+
+# returns a dict mapping each of layerNumbers to the list of the command dicts of that layer, reading only those layers' parts of the
+# jsontoolpath file at jsontoolpathPath.  layerIndex defaults to the one given by loadLayerIndex().
+def readLayers(jsontoolpathPath, layerNumbers, layerIndex=None):
+    if layerIndex is None:
+        layerIndex = loadLayerIndex(jsontoolpathPath)
+    with open(jsontoolpathPath, 'rb') as inputJsontoolpathFile:
+        return {
+            layerNumber: list(iterateLayerCommands(inputJsontoolpathFile, layerIndex.getLayer(layerNumber)))
+            for layerNumber in layerNumbers
+        }
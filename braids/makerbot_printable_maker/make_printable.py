@@ -1,22 +1,39 @@
 import argparse
 import os
-import re
 import json
 import pathlib
 import sys
 import math
-import copy
 # import numpy
-import subprocess
 import hjson #see https://hjson.github.io/hjson-py/
-import tempfile
 import datetime
 import progress
 import progress.bar
-import jsondiff
-import jsondiff_by_makerbot
+import jsontoolpath
+import toolpath_arrays
+import binary_toolpath
+import layer_index
+import parallel_previewable_gcode
+import travel_optimizer
+import toolpath_diff
+import thing_mesh
+import mesh_simplifier
+import draft_slicer
+import print_time_estimator
+import parameter_sweep
+import build_trace
+import slice_cache
+import tracked_config
+import makerbot_package
+import artifact_staging
+import schema_cache
+import config_annotation
 # import importlib.util
-import shutil
+import threading
+import asyncio
+import functools
+import io
+import time
 
 
 # This progress bar library is deficient in that it does not make any effort to output any sort of progress indicator in the case where the 
@@ -51,6 +68,89 @@ class MyProgressBar(progress.bar.Bar):
             print('\r', end='', file=self.file)
 
 
+# Several stages of a job (and, in batch mode, several jobs) run at once, each of which would otherwise create its own sequence of
+# progress bars, all fighting over the same line of the terminal.
+# JobsProgressDisplay funnels the progress of all of the stages of all of the jobs into a single MyProgressBar, whose progress is the
+# mean of the progress of the jobs, and whose suffix shows how many jobs have finished and which stages are running.
+# A job's progress is the progress of its miracle_grue stage (which is where almost all of the time goes), or 1 once the job has finished.
+class JobsProgressBar(MyProgressBar):
+    suffix='%(percent)d%% - %(elapsed_td)s/%(estimatedTotalDuration_td)s - %(jobSummary)s'
+    jobSummary = ""
+
+# Each stage that reports its progress here is also recorded as a span in buildTrace (if given; see build_trace).
+class JobsProgressDisplay:
+    def __init__(self, jobLabels, label="batch", buildTrace=None):
+        self.jobLabels = jobLabels
+        self.buildTrace = buildTrace
+        self.jobProgresses = [0.0] * len(jobLabels)
+        # runningStages[jobIndex] is a dict mapping the label of each running stage of the job to a short status string.
+        self.runningStages = [dict() for jobLabel in jobLabels]
+        self.finishedJobCount = 0
+        self.lock = threading.Lock()
+        self.progressBar = JobsProgressBar(label)
+
+    def update(self):
+        runningStages = [
+            (self.jobLabels[jobIndex] + ":" if len(self.jobLabels) > 1 else "") + status
+            for jobIndex in range(len(self.jobLabels))
+            for status in self.runningStages[jobIndex].values()
+        ]
+        self.progressBar.jobSummary = (
+            str(self.finishedJobCount) + "/" + str(len(self.jobLabels)) + " done"
+            + ("; running " + ", ".join(runningStages) if runningStages else "")
+        )
+        self.progressBar.setProgressAndUpdate(sum(self.jobProgresses)/max(1, len(self.jobProgresses)))
+
+    def setStageStatus(self, jobIndex, stage, status, progress=None):
+        with self.lock:
+            if status is None:
+                self.runningStages[jobIndex].pop(stage, None)
+            else:
+                self.runningStages[jobIndex][stage] = status
+            if progress is not None:
+                self.jobProgresses[jobIndex] = progress
+            self.update()
+
+    def finishJob(self, jobIndex, message):
+        with self.lock:
+            self.runningStages[jobIndex].clear()
+            self.jobProgresses[jobIndex] = 1.0
+            self.finishedJobCount += 1
+            print("\n" + self.jobLabels[jobIndex] + ": " + message, file=self.progressBar.file)
+            self.update()
+
+    def finish(self):
+        with self.lock:
+            self.progressBar.finish()
+
+    # returns a function that can be used, in place of MyProgressBar, as the makeProgressBar argument of makePrintable().
+    def getProgressBarFactory(self, jobIndex):
+        display = self
+        class StageProgressBar:
+            def __init__(self, label):
+                self.label = label
+                self.percent = None
+                self.startTime = (display.buildTrace.getTime() if display.buildTrace else None)
+                display.setStageStatus(jobIndex, label, label)
+            def setProgressAndUpdate(self, newValue):
+                # some stages report progress once per toolpath command, so we only bother the display when the percentage changes.
+                percent = int(newValue * 100)
+                if percent != self.percent:
+                    self.percent = percent
+                    display.setStageStatus(jobIndex, self.label, self.label + " " + str(percent) + "%", progress=(newValue if self.label == "miracle_grue" else None))
+            def finish(self):
+                display.setStageStatus(jobIndex, self.label, None)
+                if display.buildTrace:
+                    display.buildTrace.addSpan(self.label, self.startTime, display.buildTrace.getTime() - self.startTime, process=display.jobLabels[jobIndex])
+        return StageProgressBar
+
+    def getLogFunction(self, jobIndex):
+        def log(message):
+            with self.lock:
+                print("\n" + self.jobLabels[jobIndex] + ": " + str(message), file=self.progressBar.file)
+        return log
+
+
 
 
 
@@ -66,17 +166,17 @@ class MyProgressBar(progress.bar.Bar):
 
 
 parser = argparse.ArgumentParser(description="Generate a .makerbot toolpath file from a .thing file and a mircale_grue configuration file.")
-parser.add_argument("--makerware_path", action='store', nargs=1, required=True, 
+parser.add_argument("--makerware_path", action='store', nargs=1, required=False, 
     help=
         "the path of the MakerWare folder, which comes with Makerbot Print.  Typically, on a " 
         + "Windows machine, the MakerWare path is " 
         + "\"" 
         + "C:\\Program Files\\MakerBot\\MakerBotPrint\\resources\\app.asar.unpacked\\node_modules\\MB-support-plugin\\mb_ir\\MakerWare"
         + "\""
-        + "."
+        + ".  Required, unless the only outputs requested are those that we produce without MakerWare (the draft slices, the mesh analysis, and the config diff)."
 )
-parser.add_argument("--input_model_file", action='store', nargs=1, required=True, help="the .thing file to be sliced.")
-parser.add_argument("--input_miraclegrue_config_file", action='store', nargs=1, required=True, help="The miraclegrue config file.  This may be either a plain old .json file, or an hjson file, which is json with more relaxed syntax, and allows comments.")
+parser.add_argument("--input_model_file", action='store', nargs=1, required=False, help="the .thing file to be sliced.  Required, unless --batch_manifest_file is given.")
+parser.add_argument("--input_miraclegrue_config_file", action='store', nargs=1, required=False, help="The miraclegrue config file.  This may be either a plain old .json file, or an hjson file, which is json with more relaxed syntax, and allows comments.  Required, unless --batch_manifest_file is given (in which case each job in the manifest must specify it, if it is not specified here).")
 # parser.add_argument("--input_miraclegrue_config_overrides_file", action='store', nargs=1, required=False, help="This is a file of the same structure as the miracle_grue_config_file.  We will construct the configuration that we pass to miracle_grue " 
 #     + " and then applying any values that may be specified in input_miraclegrue_config_overrides_file.")
 parser.add_argument("--input_miraclegrue_config_transform_file", action='store', nargs=1, required=False, 
@@ -86,40 +186,131 @@ parser.add_argument("--input_miraclegrue_config_transform_file", action='store',
 )
 parser.add_argument("--output_annotated_miraclegrue_config_file", action='store', nargs=1, required=False, help="An hjson file to be created by inserting the descriptions from the schema, as comments, interspersed within the miracle_grue_config json entries.")
 parser.add_argument("--output_miraclegrue_config_diff_file", action='store', nargs=1, required=False, help="a report showing the difference between the config after applying the transform compared with the input config file.")
+parser.add_argument("--output_mesh_analysis_file", action='store', nargs=1, required=False, help="a json file to be created, describing the mesh of the model (triangle count, bounding box, volume, surface area, and counts of degenerate and duplicate triangles and of open edges; see thing_mesh), and whether it fits the build volume of the bot named by the config's _bot.")
+parser.add_argument("--skip_build_volume_check", action='store_true', required=False, help="if given, we slice the model even if it does not fit within the build volume of the bot named by the config's _bot.  (Otherwise, such a job fails at once, before miracle_grue is run.)")
+parser.add_argument("--simplify_mesh", action='store_true', required=False, help="if given, we slice a simplified copy of the model, in which each mesh has been decimated to within --mesh_simplification_tolerance (see mesh_simplifier), rather than the model itself.  Flat faces of the model are preserved exactly.")
+parser.add_argument("--mesh_simplification_tolerance", action='store', nargs=1, type=float, required=False, default=[0.01], help="the distance (in mm) by which --simplify_mesh may move the surface of the model.  Default: 0.01.")
+parser.add_argument("--output_mesh_simplification_report_file", action='store', nargs=1, required=False, help="a json file to be created (when --simplify_mesh is given), giving the triangle counts before and after the simplification, and the time that miracle_grue took to slice the simplified model.")
+parser.add_argument("--measure_mesh_simplification_speedup", action='store_true', required=False, help="if given (along with --simplify_mesh), we also slice the original model, in order to report (in --output_mesh_simplification_report_file) how much faster the simplified model slices, and how the print time and mass in the metadata differ.")
+parser.add_argument("--output_draft_svg_file", action='store', nargs=1, required=False, help="an SVG file to be created, showing the contours of each layer of the model, as sliced by our own draft slicer (see draft_slicer), at the layerHeight of the (transformed) config.  The draft slicer takes about a second, and does not need MakerWare.")
+parser.add_argument("--output_draft_gcode_file", action='store', nargs=1, required=False, help="a gcode file to be created, tracing the contours of each layer of the model, as sliced by our own draft slicer (see --output_draft_svg_file), in the same form as --output_previewable_gcode_file.")
 parser.add_argument("--output_makerbot_file", action='store', nargs=1, required=False, help="the .makerbot file to be created.")
+parser.add_argument("--makerbot_compression_level", action='store', nargs=1, type=int, required=False, default=[6], help="the zlib compression level (0-9) with which to deflate the toolpath within the .makerbot file.  Default: 6 (which is what sliceconfig uses).")
+parser.add_argument("--package_with_sliceconfig", action='store_true', required=False, help="if given, we produce the .makerbot file by running MakerWare's sliceconfig package_makerbot (as we used to), rather than writing it ourselves.")
 parser.add_argument("--output_gcode_file", action='store', nargs=1, required=False, help="the .gcode file to be created.")
 parser.add_argument("--output_previewable_gcode_file", action='store', nargs=1, required=False, help="A gcode file that we will create by taking the gcode produced by miracle_grue and modifying it to produce a gcode file sutiable for previeiwing in the Cura slicer.")
+parser.add_argument("--generate_previewable_gcode_while_slicing", action='store_true', required=False, help="if given (along with --output_previewable_gcode_file), we generate the previewable gcode from the jsontoolpath as miracle_grue writes it, rather than waiting for miracle_grue to finish, so that the previewable gcode is ready shortly after miracle_grue exits.")
+parser.add_argument("--previewable_gcode_process_count", action='store', nargs=1, type=int, required=False, default=[os.cpu_count() or 1], help="the number of processes among which to divide the conversion of the jsontoolpath to previewable gcode (see parallel_previewable_gcode).  With 1, we convert in-process, from the binarytoolpath.  Defaults to the number of cores.  (Does not apply with --generate_previewable_gcode_while_slicing.)")
+parser.add_argument("--output_toolpath_statistics_file", action='store', nargs=1, required=False, help="a json file to be created, containing summary statistics (move counts by tag, layer count, path lengths, commanded duration, bounding box) computed from the jsontoolpath produced by miracle_grue.")
+parser.add_argument("--output_print_time_estimate_file", action='store', nargs=1, required=False, help="a json file to be created, containing an estimate of the print time that takes acceleration into account (see print_time_estimator), broken down by layer, by tag class (Inset, Infill, Support, Travel, ...), and by extrusion feedrate, along with, for each feedrate, the time that raising it would save, and the ratio of the estimate to the duration_s of the slicer's metadata.")
+parser.add_argument("--input_acceleration_profile_file", action='store', nargs=1, required=False, help="an hjson file giving the per-axis maximum accelerations and speed changes of the printer, for --output_print_time_estimate_file (see print_time_estimator.loadAccelerationProfile()).  Defaults to values calibrated against the durations that miracle_grue reports for the replicator_5.")
+parser.add_argument("--output_binary_toolpath_file", action='store', nargs=1, required=False, help="a .binarytoolpath file to be created: a compact binary equivalent of the jsontoolpath (see binary_toolpath), which can be memory-mapped and read without parsing.")
 parser.add_argument("--output_json_toolpath_file", action='store', nargs=1, required=False, help="the .jsontoolpath file to be created.")
+parser.add_argument("--output_layer_fingerprints_file", action='store', nargs=1, required=False, help="a json file to be created, giving a hash of the commands of each layer of the toolpath, with the coordinates quantized to --toolpath_diff_quantum (see toolpath_diff).  It can be given, in place of a toolpath, as the --input_reference_toolpath_file of a later build.")
+parser.add_argument("--input_reference_toolpath_file", action='store', nargs=1, required=False, help="the toolpath of an earlier build (a .makerbot, .jsontoolpath, or .binarytoolpath file, or an --output_layer_fingerprints_file) against which to compare the toolpath of this build, for --output_toolpath_diff_file.")
+parser.add_argument("--output_toolpath_diff_file", action='store', nargs=1, required=False, help="a json file to be created, listing the layers of the toolpath that differ from those of --input_reference_toolpath_file (see toolpath_diff), and, for each of them (unless the reference is just layer fingerprints), how many commands were inserted, deleted, or replaced, the change in extrusion, and the first few differing commands.")
+parser.add_argument("--toolpath_diff_quantum", action='store', nargs=1, type=float, required=False, default=[toolpath_diff.defaultQuantum], help="the quantum (in mm, or mm/s for feedrates) to which the coordinates are rounded before the layers are hashed, for --output_layer_fingerprints_file and --output_toolpath_diff_file, so that differences smaller than this do not count.  Default: " + str(toolpath_diff.defaultQuantum) + ".")
+parser.add_argument("--output_json_toolpath_layer_index", action='store_true', required=False, help="if given (along with --output_json_toolpath_file), we also write a layer index alongside the .jsontoolpath file (as <name>.jsontoolpath.layerindex.json), recording the byte offsets, command indices, and z height of each layer, so that individual layers can be read without parsing the whole toolpath (see layer_index).")
+parser.add_argument("--optimize_travel", action='store_true', required=False, help="if given, we reorder the islands within each layer of the toolpath produced by miracle_grue so as to shorten the travel moves between them (see travel_optimizer), before writing the jsontoolpath, the .makerbot file, and the other outputs derived from the toolpath.  (The .gcode file, and the print time in the metadata, are miracle_grue's own, and do not reflect the optimization.)")
+parser.add_argument("--output_travel_optimization_report_file", action='store', nargs=1, required=False, help="a json file to be created (when --optimize_travel is given), giving the travel time saved by the optimization in each layer, and in total.")
 parser.add_argument("--output_metadata_file", action='store', nargs=1, required=False, help="the .json metadata file to be created.")
 parser.add_argument("--output_miraclegrue_log_file", action='store', nargs=1, required=False, help="an output file to which to write the miraclegrue log.")
-
-
+parser.add_argument("--slice_cache_directory", action='store', nargs=1, required=False, help="a directory in which to cache the outputs of miracle_grue, keyed by the model file, the (transformed) miraclegrue config, and the miracle_grue version.  If the cache already contains the result for the given model, config, and slicer, we skip running miracle_grue.")
+parser.add_argument("--slice_cache_max_size_mb", action='store', nargs=1, type=int, required=False, default=[2048], help="the size (in megabytes) beyond which we evict the least-recently used entries from the slice cache.  Default: 2048.")
+parser.add_argument("--schema_cache_directory", action='store', nargs=1, required=False, help="a directory in which to cache the config schema reported by miracle_grue (which we need for --output_annotated_miraclegrue_config_file), keyed by the path, size, and modification time of the miracle_grue executable and its --version-json.  The cache is seeded with the schemas in the research folder, so that, for a known version of miracle_grue, we never need to run miracle_grue --config-schema.")
+parser.add_argument("--batch_manifest_file", action='store', nargs=1, required=False, 
+    help="a json or hjson file containing a list of jobs, each of which is a dict whose keys are the names of the per-model options "
+        + "of this script, without the leading \"--\" (e.g. \"input_model_file\", \"output_makerbot_file\", \"input_miraclegrue_config_file\", ...). "
+        + "Relative paths are taken to be relative to the directory containing the manifest.  Any per-model option that a job does not specify "
+        + "is taken from the command line.  Each distinct config (and transform) is loaded only once, and the jobs are run "
+        + "concurrently, with at most --batch_max_concurrent_jobs slicer processes running at a time."
+)
+parser.add_argument("--sweep_grid_file", action='store', nargs=1, required=False,
+    help="an hjson file giving, for each of several settings of the (transformed) miraclegrue config, a list of values to try (see parameter_sweep for the format).  "
+        + "If given, we slice the model once for each combination of the values (but only once for each distinct effective config), running the "
+        + "slicer processes concurrently (see --batch_max_concurrent_jobs), and write a table of the print time, mass, and bounding box of each combination "
+        + "(see --output_sweep_table_file).  Each variant's outputs (its metadata, and any of the per-model outputs given on the command line) are "
+        + "written to --sweep_output_directory, with the name of the variant inserted into their names.  Not compatible with --batch_manifest_file."
+)
+parser.add_argument("--sweep_output_directory", action='store', nargs=1, required=False, help="the directory in which to write the outputs of each variant of the sweep.  Required with --sweep_grid_file.")
+parser.add_argument("--output_sweep_table_file", action='store', nargs=1, required=False, help="the csv file to which to write the table of the results of the sweep.  Default: sweep.csv in --sweep_output_directory.")
+parser.add_argument("--output_build_trace_file", action='store', nargs=1, required=False, help="a json file to be created, in the Chrome trace event format (viewable in chrome://tracing or https://ui.perfetto.dev), recording the time taken by each stage of each job, and the cpu time and memory use of the subprocesses (see build_trace).  (A one-line summary of the trace is printed at the end of every run.)")
+parser.add_argument("--batch_max_concurrent_jobs", action='store', nargs=1, type=int, required=False, default=[os.cpu_count() or 1], help="the maximum number of slicer (miracle_grue) processes and packaging (.makerbot) stages to run at once, across all of the jobs in the batch.  Defaults to the number of cores.")
 
 
 args, unknownArgs = parser.parse_known_args()
 
+# the names of the options that specify a single job (i.e. the slicing of one model), all of which are paths.
+jobOptionNames = [
+    "input_model_file",
+    "input_miraclegrue_config_file",
+    "input_miraclegrue_config_transform_file",
+    "output_annotated_miraclegrue_config_file",
+    "output_miraclegrue_config_diff_file",
+    "output_mesh_analysis_file",
+    "output_mesh_simplification_report_file",
+    "output_draft_svg_file",
+    "output_draft_gcode_file",
+    "output_makerbot_file",
+    "output_gcode_file",
+    "output_previewable_gcode_file",
+    "output_toolpath_statistics_file",
+    "output_print_time_estimate_file",
+    "output_binary_toolpath_file",
+    "output_json_toolpath_file",
+    "output_layer_fingerprints_file",
+    "input_reference_toolpath_file",
+    "output_toolpath_diff_file",
+    "output_travel_optimization_report_file",
+    "output_metadata_file",
+    "output_miraclegrue_log_file",
+]
+
+# the job options whose outputs come from the slicer (miracle_grue), and so require us to run it.
+slicerOutputOptionNames = [
+    "output_makerbot_file",
+    "output_gcode_file",
+    "output_previewable_gcode_file",
+    "output_toolpath_statistics_file",
+    "output_print_time_estimate_file",
+    "output_binary_toolpath_file",
+    "output_json_toolpath_file",
+    "output_layer_fingerprints_file",
+    "output_toolpath_diff_file",
+    "output_travel_optimization_report_file",
+    "output_metadata_file",
+]
+
 #resolve all of the paths passed as arguments to fully qualified paths:
-input_model_file_path = pathlib.Path(args.input_model_file[0]).resolve()
-output_makerbot_file_path = (pathlib.Path(args.output_makerbot_file[0]).resolve() if args.output_makerbot_file else None)
-output_gcode_file_path = (pathlib.Path(args.output_gcode_file[0]).resolve() if args.output_gcode_file else None)
-output_previewable_gcode_file_path = (pathlib.Path(args.output_previewable_gcode_file[0]).resolve() if args.output_previewable_gcode_file else None)
-output_json_toolpath_file_path = (pathlib.Path(args.output_json_toolpath_file[0]).resolve() if args.output_json_toolpath_file else None)
-output_metadata_file_path = (pathlib.Path(args.output_metadata_file[0]).resolve() if args.output_metadata_file else None)
-# input_miraclegrue_config_overrides_file_path = (pathlib.Path(args.input_miraclegrue_config_overrides_file[0]).resolve() if args.input_miraclegrue_config_overrides_file else None)
-input_miraclegrue_config_transform_file_path = (pathlib.Path(args.input_miraclegrue_config_transform_file[0]).resolve() if args.input_miraclegrue_config_transform_file else None)
-output_miraclegrue_config_diff_file_path = (pathlib.Path(args.output_miraclegrue_config_diff_file[0]).resolve() if args.output_miraclegrue_config_diff_file else None)
-output_miraclegrue_log_file_path = (pathlib.Path(args.output_miraclegrue_log_file[0]).resolve() if args.output_miraclegrue_log_file else None)
+# returns a dict mapping each of the jobOptionNames to the corresponding fully-qualified path (or None, for options that are not specified).
+# options is a dict mapping (some of) the jobOptionNames to paths, and defaults is a dict of the same form, from which we take any
+# options that are not specified in options.  Relative paths in options are resolved relative to baseDirectory.
+# An option that is present in options, but whose value is null or empty, is taken to be explicitly unspecified (so that, for
+# instance, a job in a batch manifest can opt out of a transform that is given on the command line).
+def resolveJob(options, defaults=dict(), baseDirectory=None):
+    job = dict()
+    for name in jobOptionNames:
+        if name in options:
+            job[name] = ((pathlib.Path(baseDirectory).joinpath(options[name]) if baseDirectory else pathlib.Path(options[name])).resolve() if options[name] else None)
+        elif defaults.get(name):
+            job[name] = pathlib.Path(defaults[name]).resolve()
+        else:
+            job[name] = None
+    return job
 
+slice_cache_directory_path = (pathlib.Path(args.slice_cache_directory[0]).resolve() if args.slice_cache_directory else None)
+schema_cache_directory_path = (pathlib.Path(args.schema_cache_directory[0]).resolve() if args.schema_cache_directory else None)
 
-makerware_path = pathlib.Path(args.makerware_path[0]).resolve()
-input_miraclegrue_config_file_path = pathlib.Path(args.input_miraclegrue_config_file[0]).resolve()
+
+# (without --makerware_path, the paths within it are None, and we check, once the jobs are known, that none of them needs MakerWare.)
+makerware_path = (pathlib.Path(args.makerware_path[0]).resolve() if args.makerware_path else None)
 
 
 
 #the path of the python executable included with makerware:
-makerware_python_executable_path = makerware_path.joinpath("python3.4.exe").resolve()
-makerware_python_working_directory_path = makerware_path.joinpath("python34").resolve()
-miraclegrue_executable_path = makerware_path.joinpath("miracle_grue.exe").resolve()
+makerware_python_executable_path = (makerware_path.joinpath("python3.4.exe").resolve() if makerware_path else None)
+makerware_python_working_directory_path = (makerware_path.joinpath("python34").resolve() if makerware_path else None)
+miraclegrue_executable_path = (makerware_path.joinpath("miracle_grue.exe").resolve() if makerware_path else None)
 
 # sliceLibraryEggPath = list(makerware_path.joinpath("python").glob("slice_library*.egg"))[0]
 
@@ -139,597 +330,776 @@ miraclegrue_executable_path = makerware_path.joinpath("miracle_grue.exe").resolv
 # print("dir(slice_library.tinything_processor): " + str(dir(slice_library.tinything_processor)))		# dir(slice_library.tinything_processor)
 
 #the path of the makerware sliceconfig python script:
-makerware_sliceconfig_path = makerware_path.joinpath("sliceconfig").resolve()
-
-miraclegrueConfig = hjson.load(open(input_miraclegrue_config_file_path ,'r'))
-
-if input_miraclegrue_config_transform_file_path:
-    #modify miraclegrueConfig by applying any overrides that may be specified in input_miraclegrue_config_overrides_file
-    #miraclegrueConfigOverrides = hjson.load(open(input_miraclegrue_config_overrides_file_path ,'r'))
-    # print("miraclegrueConfigOverrides: " + str(type(miraclegrueConfigOverrides)))
-
-    # record the initia; state of miracleGrueConfig, before we allow the transform to (possibly) modify it.
-    # We do this so that we can, if the user has requested a output_miraclegrue_config_diff_file, generate
-    # a report showing the differences between miraclegrueConfig before and after the transform operates on it.
-    initialMiraclegrueConfig = copy.deepcopy(miraclegrueConfig)
-
-    #input_miraclegrue_config_overrides_file is expected to contain valid python code that defines a function
-    # named "transformMiraclegrueConfig", which is expected to take a single argument, a dict, which is the configuration
-    # that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit.
-    # Should we expect transformMiraclegrueConfig() to return a dict, that we will then take to be the new miraclegrueConfig,
-    # or, alternatively, should we expect to transformMiraclegrueConfig() to modify the dict that is passed to it?  -- I am still deciding.
-    # It seems like the return value approach would be the most flexible.
-
-    isolatedGlobals = dict()
-
-    exec(open(input_miraclegrue_config_transform_file_path, 'r').read(), isolatedGlobals)
-    #I think, although am not entirely certain, that passing the isolatedGlobals object prevents the code in input_miraclegrue_config_transform_file_path
-    # from being able to muck with, or even see, our globals here.  This mechanism does not prevent the execution of arbitrary code and so is certainly not suitable for a production application.
-    # We ought to figure out how to run transformMiraclegrueConfig in a sandbox.
-
-    # print("isolatedGlobals.keys(): " + str(isolatedGlobals.keys()))
-    # print("type(isolatedGlobals[\"transformMiraclegrueConfig\"]): " + str(type(isolatedGlobals["transformMiraclegrueConfig"])))		#     type(isolatedGlobals["transformMiraclegrueConfig"])
-
-    miraclegrueConfig = isolatedGlobals["transformMiraclegrueConfig"](miraclegrueConfig)
-    # print("miraclegrueConfig['foo']: " + str(miraclegrueConfig['foo']))		#     miracleGrueConfig['foo']
-
-
-
-    if output_miraclegrue_config_diff_file_path:
-        # diff = jsondiff.diff(initialMiraclegrueConfig, miraclegrueConfig)
-        # print("diff.keys(): " + str(diff.keys()))		#         diff.keys()
-        # open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff))
-
-        diff = jsondiff_by_makerbot.JSONDiff(initialMiraclegrueConfig, miraclegrueConfig)
-        open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff.pretty_str(trim_size=300)))
-  
-
-
-def tabbedWrite(file, content, tabLevel=0, tabString="    ", linePrefix=""):
-    file.write(
-        "\n".join(
-            map( 
-                lambda y: tabString*tabLevel + linePrefix + y,
-                str(content).splitlines()
-            )
-        ) + "\n"
+makerware_sliceconfig_path = (makerware_path.joinpath("sliceconfig").resolve() if makerware_path else None)
+
+# loads the miraclegrue config from input_miraclegrue_config_file_path and applies the transform (if any) in input_miraclegrue_config_transform_file_path.
+# returns a tuple (miraclegrueConfig, miraclegrueConfigMutationLog), where miraclegrueConfigMutationLog is a tracked_config.MutationLog recording
+# the changes that the transform made to the config (or None if there is no transform).
+# The result is memoized, so that, in batch mode, each distinct (config, transform) pair is loaded and transformed only once.
+# The caller must not modify the returned configs.
+loadedMiraclegrueConfigs = dict()
+def loadMiraclegrueConfig(input_miraclegrue_config_file_path, input_miraclegrue_config_transform_file_path=None):
+    memoKey = (input_miraclegrue_config_file_path, input_miraclegrue_config_transform_file_path)
+    if memoKey in loadedMiraclegrueConfigs:
+        return loadedMiraclegrueConfigs[memoKey]
+    with buildTrace.span("hjson load"):
+        miraclegrueConfig = hjson.load(open(input_miraclegrue_config_file_path ,'r'))
+    miraclegrueConfigMutationLog = None
+
+    if input_miraclegrue_config_transform_file_path:
+        #modify miraclegrueConfig by applying any overrides that may be specified in input_miraclegrue_config_overrides_file
+        #miraclegrueConfigOverrides = hjson.load(open(input_miraclegrue_config_overrides_file_path ,'r'))
+        # print("miraclegrueConfigOverrides: " + str(type(miraclegrueConfigOverrides)))
+
+        # record the changes that the transform makes to miracleGrueConfig (rather than deep-copying its initial state),
+        # so that we can, if the user has requested a output_miraclegrue_config_diff_file, generate
+        # a report showing the differences between miraclegrueConfig before and after the transform operates on it.
+        # The transform receives a tracked_config.TrackedDict wrapping miraclegrueConfig, rather than miraclegrueConfig itself.
+        # We compile the transform under its own file name so that the mutation log can attribute each change to a line of the transform.
+        miraclegrueConfigMutationLog = tracked_config.MutationLog(root=miraclegrueConfig, sourceFileName=str(input_miraclegrue_config_transform_file_path))
+
+        #input_miraclegrue_config_overrides_file is expected to contain valid python code that defines a function
+        # named "transformMiraclegrueConfig", which is expected to take a single argument, a dict, which is the configuration
+        # that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit.
+        # Should we expect transformMiraclegrueConfig() to return a dict, that we will then take to be the new miraclegrueConfig,
+        # or, alternatively, should we expect to transformMiraclegrueConfig() to modify the dict that is passed to it?  -- I am still deciding.
+        # It seems like the return value approach would be the most flexible.
+
+        isolatedGlobals = dict()
+
+        with buildTrace.span("transform load"):
+            exec(compile(open(input_miraclegrue_config_transform_file_path, 'r').read(), str(input_miraclegrue_config_transform_file_path), 'exec'), isolatedGlobals)
+        #I think, although am not entirely certain, that passing the isolatedGlobals object prevents the code in input_miraclegrue_config_transform_file_path
+        # from being able to muck with, or even see, our globals here.  This mechanism does not prevent the execution of arbitrary code and so is certainly not suitable for a production application.
+        # We ought to figure out how to run transformMiraclegrueConfig in a sandbox.
+
+        # print("isolatedGlobals.keys(): " + str(isolatedGlobals.keys()))
+        # print("type(isolatedGlobals[\"transformMiraclegrueConfig\"]): " + str(type(isolatedGlobals["transformMiraclegrueConfig"])))		#     type(isolatedGlobals["transformMiraclegrueConfig"])
+
+        with buildTrace.span("transform exec"):
+            miraclegrueConfig = tracked_config.unwrap(isolatedGlobals["transformMiraclegrueConfig"](miraclegrueConfigMutationLog.getTrackedRoot()))
+        # print("miraclegrueConfig['foo']: " + str(miraclegrueConfig['foo']))		#     miracleGrueConfig['foo']
+
+    loadedMiraclegrueConfigs[memoKey] = (miraclegrueConfig, miraclegrueConfigMutationLog)
+    return loadedMiraclegrueConfigs[memoKey]
+
+# writes, to output_miraclegrue_config_diff_file_path, a report showing the differences between miraclegrueConfig before and after the transform operated on it,
+# followed by the list of changes that the transform made, with the line of the transform that made each one.
+def writeMiraclegrueConfigDiff(miraclegrueConfigMutationLog, miraclegrueConfig, output_miraclegrue_config_diff_file_path):
+    # diff = jsondiff.diff(initialMiraclegrueConfig, miraclegrueConfig)
+    # print("diff.keys(): " + str(diff.keys()))		#         diff.keys()
+    # open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff))
+
+    diff = miraclegrueConfigMutationLog.getDiff(miraclegrueConfig)
+    open(output_miraclegrue_config_diff_file_path ,'w').write(
+        str(diff.pretty_str(trim_size=300))
+        + "\n\n"
+        + "changes made by the transform, in order:" + "\n"
+        + miraclegrueConfigMutationLog.getReport(trimSize=300) + "\n"
     )
 
-def prefixAllLines(x, prefix):
-    return "\n".join(
-        map( 
-            lambda y: prefix + y,
-            str(x).splitlines()
-        )
-    )
 
-def indentAllLines(x, indentString="    "):
-    return prefixAllLines(x, indentString)
-
-def makeBlockComment(x):
-    lines = str(x).splitlines()  
-    return "\n".join(
-        ["/* " + lines[0]]
-        + list(
-            map(
-                lambda y: " * " + y,
-                lines[1:]
-            )
-        )
-        + [" */"]
-    )
 
-def addParentheticalRemarkAtEndOfFirstLine(x, remark=None): 
-    lines = str(x).splitlines()
-    return "\n".join(
-        [lines[0] + (" (" + str(remark) + ")" if remark else "")]
-        + lines[1:]
+# runs an executor-bound (i.e. cpu- or disk-bound) function in the default thread pool, so that it does not block the event loop.
+# (asyncio.to_thread() would do this, but it requires python 3.9.)
+# A thread can not be interrupted, so, if we are cancelled, we wait for the function to finish before passing the cancellation on: once a
+# cancelled stage is over, nothing is still writing into its staging directory.
+async def runInThread(function, *args, **kwargs):
+    future = asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception() # (so that asyncio does not complain that the exception, if any, was never retrieved.)
+        raise
+
+# runs a subprocess (miracle_grue or sliceconfig) that reports its progress as json objects, one per line, on stdout.
+# progressKey is the key, in those json objects, of the percent-complete value.
+# While the subprocess runs, we sample its resource use into buildTrace, under the process (i.e. the job) traceProcess, as the subprocess name.
+# returns the return code of the subprocess.
+async def runSubprocessReportingProgress(subprocessArgs, progressBar, progressKey, name, traceProcess="make_printable"):
+    process = await asyncio.create_subprocess_exec(
+        *subprocessArgs,
+        cwd=makerware_python_working_directory_path,
+        stdout=asyncio.subprocess.PIPE
     )
+    monitorTask = asyncio.ensure_future(buildTrace.monitorSubprocess(process.pid, name=name, process=traceProcess))
+    while True:
+        line = await process.stdout.readline()
+        if not line:
+            break
+        #attempt to interpret line as a json expression.
+        jsonObject = None
+        try:
+            jsonObject: dict = json.loads(line)
+        except json.decoder.JSONDecodeError as error:
+            pass
+        else:
+            if isinstance(jsonObject, dict) and jsonObject.get(progressKey) is not None:
+                progressBar.setProgressAndUpdate(float(jsonObject.get(progressKey))/100)
+    await process.wait()
+    monitorTask.cancel()
+    await asyncio.gather(monitorTask, return_exceptions=True)
+    progressBar.setProgressAndUpdate(1)
+    progressBar.finish()
+    # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
+    return process.returncode
+
+schemaCache = (schema_cache.SchemaCache(directory=schema_cache_directory_path) if schema_cache_directory_path else None)
+
+# the schema (as reported by miracle_grue --config-schema, or as found in the schema cache) is fetched at most once per run.
+# (we hold on to the task, rather than the schema, so that concurrent callers all wait on the same miracle_grue process.)
+miraclegrueConfigSchemaTask = None
+async def getMiraclegrueConfigSchema():
+    global miraclegrueConfigSchemaTask
+    if miraclegrueConfigSchemaTask is None:
+        async def fetchMiraclegrueConfigSchema():
+            with buildTrace.span("schema fetch"):
+                if schemaCache:
+                    return await runInThread(schemaCache.getSchema, miraclegrue_executable_path)
+                process = await asyncio.create_subprocess_exec(
+                    str(miraclegrue_executable_path),
+                    "--config-schema",
+                    stdout=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate()
+                return json.loads(stdout)
+        miraclegrueConfigSchemaTask = asyncio.ensure_future(fetchMiraclegrueConfigSchema())
+    return await miraclegrueConfigSchemaTask
+
+accelerationProfile = (
+    print_time_estimator.loadAccelerationProfile(open(args.input_acceleration_profile_file[0], 'r'))
+    if args.input_acceleration_profile_file else print_time_estimator.defaultAccelerationProfile
+)
 
+buildTrace = build_trace.BuildTrace()
 
+sliceCache = (
+    slice_cache.SliceCache(directory=slice_cache_directory_path, maxSizeBytes=args.slice_cache_max_size_mb[0] * 1024 * 1024)
+    if slice_cache_directory_path else None
+)
 
-# path is expected to be a list (of keys)
-def getSchemedTypeName(path, schema):
-    if len(path) == 0:
-        return '__top__'
-    schemedTypeOfParent = getSchemedType(path[:-1],schema)
-    if schemedTypeOfParent:
-        if schemedTypeOfParent['mode'] == "aggregate":
-            memberSpec = (
-                    list(
-                        filter(
-                            lambda x: x['id'] == path[-1],
-                            schemedTypeOfParent["members"]
-                        )
-                    ) or [None]
-                )[0]
-            if memberSpec:
-                return memberSpec['type']
-        elif schemedTypeOfParent['json_type'] == "object":
-            return schemedTypeOfParent['value_type']
-        elif schemedTypeOfParent['json_type'] == "array":
-            return schemedTypeOfParent['element_type']
-    return None
-
-def getSchemedType(path, schema):
-    # print("getSchemedType() was called with path " + str(path))
-    schemedTypeName = getSchemedTypeName(path, schema)
-    if schemedTypeName:
-        return schema.get(schemedTypeName)
-    return None
-
-def getMemberIds(schemedType):
-    return (
-        map(
-            lambda x: x['id'],
-            schemedType['members']
-        )
-        if (schemedType and schemedType.get('mode') == "aggregate" )
-        else None
-    )
-
-
-#returns the annotation text that is to appear immediately
-# before the entry having the specified path.
-def getAnnotationForEntry(path, schema):
-    schemedTypeOfParent = getSchemedType(path[:-1],schema)
-    if schemedTypeOfParent and schemedTypeOfParent['mode'] == "aggregate":
-        memberSpec = (
-                list(
-                    filter(
-                        lambda x: x['id'] == path[-1],
-                        schemedTypeOfParent["members"]
-                    )
-                ) or [None]
-            )[0]
-        if memberSpec:
-            return "\n".join(
-                [path[-1]]
-                + (["name: " + memberSpec.get('name')] if (memberSpec.get('name') and (memberSpec.get('name') != path[-1])) else [])
-                + list(
-                    map(
-                        lambda k: k + ": " + hjson.dumps(memberSpec[k]),
-                        filter(
-                            lambda k: k not in ['id','name'],
-                            memberSpec.keys()
-                        )
-                    )
-                )   
+# runs the whole pipeline (annotation, slicing, post-processing, and packaging) for a single job.
+# job is a dict of the form returned by resolveJob().
+# makeProgressBar is a function that takes a label and returns an object having setProgressAndUpdate() and finish() methods
+# (see JobsProgressDisplay.getProgressBarFactory()), and log is a function that we call with any messages that we want to report.
+# subprocessSemaphore is an asyncio.Semaphore that bounds the number of slicer/packager subprocesses running at once (across all jobs).
+# returns a dict mapping the name of each subprocess that we ran ("miracle_grue", "sliceconfig") to its return code.
+#
+# The stages run as soon as their inputs are ready, rather than one after another:
+#   - the config diff, and the fetching of the schema and writing of the annotated config, run alongside the slicer, and
+#   - once the slicer has finished, the conversion to a binarytoolpath (followed by the previewable gcode and the statistics, which read the
+#     binarytoolpath) and the packaging all run at once (after which we publish their outputs, and the slicer's own outputs).
+# so that the job takes (roughly) as long as its critical path (slicing followed by packaging), rather than the sum of its stages.
+async def makePrintable(job, makeProgressBar, log, subprocessSemaphore):
+    # every file that we (or miracle_grue) write goes into a staging directory, which we create in the build directory (i.e. alongside the outputs,
+    # so that publishing an output is a rename rather than a copy) and remove when we are done, whether or not we succeeded.  See artifact_staging.
+    outputPaths = [job[name] for name in jobOptionNames if name.startswith("output_") and job[name]]
+    # (we check the outputs' directories up front, rather than find, once the slicer has finished, that we can not publish some output.)
+    missingDirectoryPaths = sorted(set(outputPath.parent for outputPath in outputPaths if not outputPath.parent.is_dir()))
+    if missingDirectoryPaths:
+        raise FileNotFoundError("output directory does not exist: " + ", ".join(str(path) for path in missingDirectoryPaths))
+    with artifact_staging.StagingDirectory(parentDirectory=((job["output_makerbot_file"] or outputPaths[0]).parent if outputPaths else None)) as stagingDirectory:
+        return await makePrintableUsingStagingDirectory(job, makeProgressBar, log, subprocessSemaphore, stagingDirectory)
+
+async def makePrintableUsingStagingDirectory(job, makeProgressBar, log, subprocessSemaphore, stagingDirectory):
+    returnCodes = dict()
+    input_model_file_path = job["input_model_file"]
+    output_annotated_miraclegrue_config_file_path = job["output_annotated_miraclegrue_config_file"]
+    output_miraclegrue_config_diff_file_path = job["output_miraclegrue_config_diff_file"]
+    output_mesh_analysis_file_path = job["output_mesh_analysis_file"]
+    output_mesh_simplification_report_file_path = job["output_mesh_simplification_report_file"]
+    output_draft_svg_file_path = job["output_draft_svg_file"]
+    output_draft_gcode_file_path = job["output_draft_gcode_file"]
+    output_makerbot_file_path = job["output_makerbot_file"]
+    output_gcode_file_path = job["output_gcode_file"]
+    output_previewable_gcode_file_path = job["output_previewable_gcode_file"]
+    output_toolpath_statistics_file_path = job["output_toolpath_statistics_file"]
+    output_print_time_estimate_file_path = job["output_print_time_estimate_file"]
+    output_binary_toolpath_file_path = job["output_binary_toolpath_file"]
+    output_json_toolpath_file_path = job["output_json_toolpath_file"]
+    output_travel_optimization_report_file_path = job["output_travel_optimization_report_file"]
+    output_layer_fingerprints_file_path = job["output_layer_fingerprints_file"]
+    input_reference_toolpath_file_path = job["input_reference_toolpath_file"]
+    output_toolpath_diff_file_path = job["output_toolpath_diff_file"]
+    output_metadata_file_path = job["output_metadata_file"]
+    output_miraclegrue_log_file_path = job["output_miraclegrue_log_file"]
+    jobLabel = job.get("label") or input_model_file_path.stem
+
+    miraclegrueConfig, miraclegrueConfigMutationLog = loadMiraclegrueConfig(job["input_miraclegrue_config_file"], job["input_miraclegrue_config_transform_file"])
+    if job.get("sweep_variant"):
+        # (the config diff still describes the transform alone; the variant's own settings are recorded in the sweep table.)
+        miraclegrueConfig = job["sweep_variant"].miraclegrueConfig
+
+    # the staged counterparts of the outputs that we write ourselves.
+    stagedPaths = {
+        name: stagingDirectory.getPath(name)
+        for name in ["annotated_miraclegrue_config", "miraclegrue_config_diff", "mesh_analysis", "mesh_simplification_report", "draft_svg", "draft_gcode", "previewable_gcode", "toolpath_statistics", "print_time_estimate", "binary_toolpath", "json_toolpath_layer_index", "layer_fingerprints", "toolpath_diff", "travel_optimization_report", "makerbot"]
+    }
+    stagedPaths["optimized_jsontoolpath"] = stagingDirectory.getPath("optimized.jsontoolpath")
+    # (miracle_grue tells a .thing from an STL by the extension.)
+    stagedPaths["simplified_model"] = stagingDirectory.getPath("simplified_model" + input_model_file_path.suffix)
+
+    requiresSlicing = any(job[name] for name in slicerOutputOptionNames)
+
+    # the analysis of the mesh takes milliseconds, so we do it before anything else, in order to reject a model that would not fit on the bot
+    # before we spend minutes slicing it.
+    if output_mesh_analysis_file_path or (requiresSlicing and not args.skip_build_volume_check):
+        meshAnalysis = await runInThread(buildTrace.traced(thing_mesh.analyzeThing, "mesh analysis", process=jobLabel), input_model_file_path, botType=miraclegrueConfig.get("_bot"))
+        if output_mesh_analysis_file_path:
+            with open(stagedPaths["mesh_analysis"], 'w') as outputMeshAnalysisFile:
+                json.dump(meshAnalysis, outputMeshAnalysisFile, indent=4)
+            artifact_staging.publishFile(stagedPaths["mesh_analysis"], output_mesh_analysis_file_path)
+        if not meshAnalysis['build_volume']:
+            log("the build volume of the bot " + repr(miraclegrueConfig.get("_bot")) + " is unknown, so we have not checked that the model fits.")
+        if meshAnalysis['problems'] and requiresSlicing and not args.skip_build_volume_check:
+            raise ValueError(str(input_model_file_path.name) + " can not be printed on " + str(meshAnalysis['bot_type']) + ": " + " ".join(meshAnalysis['problems']))
+
+    # with --simplify_mesh, the slicer (and the slice cache) see the simplified copy of the model, rather than the model itself.
+    slicerModelFilePath = input_model_file_path
+    meshSimplificationReport = None
+    if args.simplify_mesh and requiresSlicing:
+        def simplifyModel():
+            progressBar = makeProgressBar("simplify")
+            report = mesh_simplifier.simplifyThing(
+                inputThingFilePath=input_model_file_path,
+                outputThingFilePath=stagedPaths["simplified_model"],
+                tolerance=args.mesh_simplification_tolerance[0],
+                progressReportingCallback=progressBar.setProgressAndUpdate
             )
-        else:
-            return "THIS ELEMENT IS NOT SPECIFIED IN THE SCHEMA."
-    else:
-        return None
-
-#entryFormat shall be a streing that is either "dictEntry" or "listEntry"
-# def dumpsAnnotatedHjsonEntry(value, path, schema, entryFormat):
-#     # print("dumpsAnnotatedHjsonEntry was called with path: " + str(path))
-#     entry = (str(path[-1]) + ": "  if entryFormat == "dictEntry" else "") + dumpsAnnotatedHjsonValue(value, path, schema)
-#     annotation = getAnnotationForEntry(path, schema)
-#     return ("\n" + prefixAllLines(annotation, "// ") + "\n" if annotation else "") + entry
-
-
-def dumpsAnnotatedHjsonValue(value, path, schema):
-    # print("now working on path: " + str(path))
-    returnValue=""
-    schemedType = getSchemedType(path, schema)
-    
-    isIterable = (
-        isinstance(value, dict)
-        or isinstance(value, list)
-        or (schemedType and schemedType.get('mode') == "aggregate" )
-        or (schemedType and schemedType.get('json_type') == "object") 
-        or (schemedType and schemedType.get('json_type') == "array" )
-    )
-    if isIterable:
-        if isinstance(value, dict):
-            braces=["{","}"]
-            keysInValue=set(value.keys())
-            keysInSchema=set(getMemberIds(schemedType) or [])
-            subentryFormat="dictEntry"
-        else:
-            braces=["[","]"]
-            keysInValue=set(range(len(value)))
-            keysInSchema=set([])
-            subentryFormat="listEntry"
-        returnValue += braces[0] + "\n"
-        for key in sorted(list(keysInValue.union(keysInSchema))):
-            annotation = getAnnotationForEntry(path + [key], schema)
-            
-            if key in keysInValue:
-                subValue = value[key]
-                entry = (key + ": "  if subentryFormat == "dictEntry" else "") + dumpsAnnotatedHjsonValue(subValue, path + [key], schema)
+            progressBar.finish()
+            return report
+        meshSimplificationReport = await runInThread(simplifyModel)
+        slicerModelFilePath = stagedPaths["simplified_model"]
+        log("mesh simplification reduced " + str(meshSimplificationReport['triangle_count_before']) + " triangles to " + str(meshSimplificationReport['triangle_count_after']) + ".")
+
+    # stages that do not depend on the slicer.
+    independentStages = []
+
+    if output_miraclegrue_config_diff_file_path and miraclegrueConfigMutationLog is not None:
+        async def writeAndPublishMiraclegrueConfigDiff():
+            await runInThread(buildTrace.traced(writeMiraclegrueConfigDiff, "config diff", process=jobLabel), miraclegrueConfigMutationLog, miraclegrueConfig, stagedPaths["miraclegrue_config_diff"])
+            artifact_staging.publishFile(stagedPaths["miraclegrue_config_diff"], output_miraclegrue_config_diff_file_path)
+        independentStages.append(writeAndPublishMiraclegrueConfigDiff())
+
+    # if args.miraclegrue_config_schema_file and args.output_annotated_miraclegrue_config_file:
+    if output_annotated_miraclegrue_config_file_path:
+        # generate an annotated hjson version of the config file, by
+        # adding the descriptions in the schema as comments.
+        # schema = json.load(open(pathlib.Path(args.miraclegrue_config_schema_file[0]).resolve() ,'r'))
+        # oldSchema = json.load(open(pathlib.Path(args.old_miraclegrue_config_schema_file[0]).resolve(),'r'))
+        # oldMiraclegrueConfig = json.load(open(pathlib.Path(args.old_miraclegrue_config_file[0]).resolve(),'r'))
+        # we might consider running the config through miraclegrue and letting mircalegrue remove any invalid values.
+        async def writeAnnotatedMiraclegrueConfig():
+            schema = await getMiraclegrueConfigSchema()
+            annotatedConfig = await runInThread(buildTrace.traced(config_annotation.dumpsAnnotatedHjsonValue, "annotation", process=jobLabel), value=miraclegrueConfig, schema=schema, path=[])
+            with open(stagedPaths["annotated_miraclegrue_config"] ,'w') as annotatedConfigFile:
+                annotatedConfigFile.write(annotatedConfig)
+            artifact_staging.publishFile(stagedPaths["annotated_miraclegrue_config"], output_annotated_miraclegrue_config_file_path)
+        independentStages.append(writeAnnotatedMiraclegrueConfig())
+
+    if output_draft_svg_file_path or output_draft_gcode_file_path:
+        def writeDraft():
+            layers = draft_slicer.sliceThing(input_model_file_path, layerHeight=miraclegrueConfig["layerHeight"])
+            if output_draft_svg_file_path:
+                with open(stagedPaths["draft_svg"], 'w') as outputSvgFile:
+                    draft_slicer.writeSvg(layers, outputSvgFile)
+            if output_draft_gcode_file_path:
+                with open(stagedPaths["draft_gcode"], 'w') as outputGcodeFile:
+                    draft_slicer.writeOutlineGcode(layers, outputGcodeFile, layerHeight=miraclegrueConfig["layerHeight"])
+            return layers
+        async def writeAndPublishDraft():
+            layers = await runInThread(buildTrace.traced(writeDraft, "draft slice", process=jobLabel))
+            openContourCount = sum(layer.openContourCount for layer in layers)
+            log("draft slice: " + str(len(layers)) + " layers" + (", with " + str(openContourCount) + " open contours (the mesh has cracks)" if openContourCount else "") + ".")
+            if output_draft_svg_file_path:
+                artifact_staging.publishFile(stagedPaths["draft_svg"], output_draft_svg_file_path)
+            if output_draft_gcode_file_path:
+                artifact_staging.publishFile(stagedPaths["draft_gcode"], output_draft_gcode_file_path)
+        independentStages.append(writeAndPublishDraft())
+
+    independentStagesTask = asyncio.ensure_future(asyncio.gather(*independentStages))
+
+    previewableGcodeTask = None
+    dependentStageTasks = []
+    try:
+        # generate several temporary files, which we will use during the slicing/makerbot packaging process
+        tempFilePaths = dict()
+        for key in ["miraclegrue_config", "metadata", "jsontoolpath", "gcode", "log"]:
+            tempFilePaths[key] = stagingDirectory.getPath(key + (".jsontoolpath" if key == "jsontoolpath" else ""))
+            open(tempFilePaths[key], 'w').close()
+
+        json.dump(miraclegrueConfig, open(tempFilePaths["miraclegrue_config"],'w'), sort_keys=True, indent=4)
+
+        if requiresSlicing:
+            cachedArtifactPaths = None
+            if sliceCache:
+                with buildTrace.span("slice cache lookup", process=jobLabel) as spanArgs:
+                    sliceCacheKey = await runInThread(
+                        slice_cache.computeSliceCacheKey,
+                        modelFilePath=slicerModelFilePath,
+                        miraclegrueConfig=miraclegrueConfig,
+                        slicerVersion=await runInThread(slice_cache.getSlicerVersion, miraclegrue_executable_path)
+                    )
+                    cachedArtifactPaths = sliceCache.get(sliceCacheKey)
+                    spanArgs['hit'] = bool(cachedArtifactPaths)
+
+            if cachedArtifactPaths:
+                log("slice cache hit (" + sliceCacheKey + "); skipping miracle_grue.")
+                with buildTrace.span("slice cache copy", process=jobLabel):
+                    for key in ["jsontoolpath", "gcode", "metadata"]:
+                        # (the cache entries are never modified in place, so we can link, rather than copy, them, where the filesystem allows.)
+                        os.remove(tempFilePaths[key])
+                        artifact_staging.linkOrCopyFile(cachedArtifactPaths[key], tempFilePaths[key])
+                if output_miraclegrue_log_file_path:
+                    if "log" in cachedArtifactPaths:
+                        artifact_staging.publishFile(cachedArtifactPaths["log"], output_miraclegrue_log_file_path, keepStagedFile=True)
+                    else:
+                        open(tempFilePaths["log"], 'w').write("miracle_grue was not run, because the slice cache already contained the result (" + sliceCacheKey + ").\n")
+                        artifact_staging.publishFile(tempFilePaths["log"], output_miraclegrue_log_file_path)
             else:
-                subValue = None
-                entry = "// VALUE NOT SPECIFIED"
+                # when the slice cache is in use, we always have miracle_grue produce all of the artifacts (even the ones that
+                # have not been requested on this run), so that the cache entry can satisfy any later request.
+                subprocessArgs = [str(miraclegrue_executable_path),
+                    "--json-progress", # Display progress messages in JSON format
+                    "--config=" + str(tempFilePaths["miraclegrue_config"])
+                ]
+
+                if output_gcode_file_path or sliceCache: subprocessArgs.append("--gcode-toolpath-output=" + str(tempFilePaths["gcode"]))
+                if output_json_toolpath_file_path or output_makerbot_file_path or output_previewable_gcode_file_path or output_toolpath_statistics_file_path or output_print_time_estimate_file_path or output_binary_toolpath_file_path or output_travel_optimization_report_file_path or output_layer_fingerprints_file_path or output_toolpath_diff_file_path or sliceCache: subprocessArgs.append("--json-toolpath-output=" + str(tempFilePaths["jsontoolpath"]))
+                if output_metadata_file_path or output_makerbot_file_path or output_print_time_estimate_file_path or sliceCache: subprocessArgs.append("--metadata-output=" + str(tempFilePaths["metadata"]))
+                if output_miraclegrue_log_file_path: 
+                    subprocessArgs.append("--log-file=" + str(tempFilePaths["log"]))
+                    subprocessArgs.append("--log-level=" + "FFF")
+                    # --log-level level                     
+                    # Verbosity of the slicer output log. 
+                    # Must be one of ERROR, WARNING, INFO, 
+                    # FINE, FINER, FINEST or E, W, I, F, FF, 
+                    # FFF respectively
+                    subprocessArgs.append("--no-log-format")
             
-            returnValue += indentAllLines(
-                (
-                    "\n" + makeBlockComment(annotation) + "\n" 
-                    if annotation else ""
-                ) 
-                + entry
-            ) + "\n"
-        returnValue += braces[1] + "\n"
-    else:
-        returnValue += hjson.dumps(value) + "\n"
-    return returnValue    
-
-#inputFile is a readable file-like object that is assumed to be a valid jsontoolpath file
-#outputGcodeFile is a writeable file-like object that is assumed to be the destination where we want to dump the gcode
-#progressReportingCallback, if given, is expected to be a function that will be passed a single argument:
-# a float representing the completion ratio.
-def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressReportingCallback = None):
-    # print("generating previewable gcode")
-    # read the jsontoolpath into memory (might it be better to do this in a way that does not require us to read the entire file into memory at once?)
-    toolpath = json.load(inputJsontoolpathFile)
-    noodleType = None
-    layerNumber = 0
-    lastUpperPosition = None
-    allTags: set = set()
-    # allFunctions: set = set()
-    
-    for index in range(len(toolpath)):
-        # print("now working on item " + str(index))
-        item = toolpath[index]
-        command = item.get('command')
-        if command:
-            function = command['function']
-            # allFunctions.add(function)
-            if function == 'move':
-                # look at tags to figure out whether we need to emit a ";TYPE:..." line
-                tags = set(command['tags'])
-                allTags.update(tags)
-
-                # tags encountered in a typical jsontoolpath:
-                #   BeadMode External
-                #   BeadMode Internal
-                #   BeadMode Internal Thick
-                #   BeadMode User3
-                #   Connection
-                #   Infill
-                #   Inset
-                #   Invalid Move
-                #   Leaky Travel Move
-                #   Long Restart
-                #   Restart
-                #   Retract
-                #   Support
-                #   Trailing Extrusion Move
-                #   Travel Move
-
-                # we need to map these (or, more accurately, combinations of these tags) to 
-                # one of the following values for noodleType:
-                # The travel and retract moves are detected implicitly by the cura gcode previewer, so they 
-                # don't have an explicit noodleType (which is one of the reasons I chose the name "noodleType":
-                # these categroies only apply to moves that produce a noodle.
-                #
-                #    WALL-INNER         
-                #    WALL-OUTER         
-                #    SKIN               
-                #    SKIRT              
-                #    SUPPORT            
-                #    FILL              
-                #    SUPPORT-INTERFACE  
-                #    PRIME-TOWER        
-
-
-
-                if "Support" in tags:
-                    thisNoodleType = "SUPPORT"
-                elif "Infill" in tags:
-                    thisNoodleType = "FILL"
-                elif "Inset" in tags:
-                    #there are two possible senses for the words inner/internal and outer/external.  On the one hand, we might be
-                    #  trying to distinguish between faces of holes vs. "outer" faces.  On the other hand, we might be
-                    #  referring to the outermost shell vs. inner shells.
-                    # I am not entirely sure if Cura's concept of WALL-OUTER vs. WALL-INNER is the same as MAkerbot's concept of BeadMode External
-                    
-                    tagsContainingExternal = (tag for tag in tags if "External" in tag)
-                    tagsContainingInternal = (tag for tag in tags if "Internal" in tag)
-                    # print("\n" + str(len(list(tagsContainingExternal)))  + "\t" + str(len(list(tagsContainingInternal))) + "\n")
-                    if tagsContainingExternal:
-                        thisNoodleType = "WALL-OUTER"
-                    elif tagsContainingInternal:
-                        thisNoodleType = "WALL-INNER"
+
+                subprocessArgs.append(str(slicerModelFilePath))
+
+                async with subprocessSemaphore:
+                    # (the previewable gcode must show the optimized toolpath, so, with --optimize_travel, we can not start on it until the optimizer has finished.)
+                    if output_previewable_gcode_file_path and args.generate_previewable_gcode_while_slicing and not args.optimize_travel:
+                        # we start converting the jsontoolpath while miracle_grue is still writing it.
+                        # (jsontoolpath.TailingFileReader waits for more data, rather than reporting end-of-file, until slicerFinished is set.)
+                        slicerFinished = threading.Event()
+                        def writePreviewableGcodeWhileSlicing():
+                            with jsontoolpath.TailingFileReader(tempFilePaths["jsontoolpath"], writerFinished=slicerFinished) as inputJsontoolpathFile:
+                                jsontoolpath.generatePreviewableGcode(
+                                    inputJsontoolpathFile=inputJsontoolpathFile,
+                                    outputGcodeFile=open(stagedPaths["previewable_gcode"],'w')
+                                )
+                        previewableGcodeTask = asyncio.ensure_future(runInThread(writePreviewableGcodeWhileSlicing))
+                    slicingStartTime = time.perf_counter()
+                    try:
+                        returnCode = await runSubprocessReportingProgress(subprocessArgs, makeProgressBar("miracle_grue"), progressKey="totalPercentComplete", name="miracle_grue", traceProcess=jobLabel)
+                    finally:
+                        if previewableGcodeTask:
+                            slicerFinished.set()
+                    if meshSimplificationReport:
+                        meshSimplificationReport['slicing_s'] = time.perf_counter() - slicingStartTime
+                log("process.returncode: " + str(returnCode))
+                returnCodes["miracle_grue"] = returnCode
+
+                if meshSimplificationReport and args.measure_mesh_simplification_speedup and returnCode == 0:
+                    # slice the original model too, with the same config, for comparison.
+                    referenceArgs = [str(miraclegrue_executable_path),
+                        "--json-progress",
+                        "--config=" + str(tempFilePaths["miraclegrue_config"]),
+                        "--json-toolpath-output=" + str(stagingDirectory.getPath("reference.jsontoolpath")),
+                        "--metadata-output=" + str(stagingDirectory.getPath("reference_metadata")),
+                        str(input_model_file_path)
+                    ]
+                    async with subprocessSemaphore:
+                        slicingStartTime = time.perf_counter()
+                        referenceReturnCode = await runSubprocessReportingProgress(referenceArgs, makeProgressBar("miracle_grue (original model)"), progressKey="totalPercentComplete", name="miracle_grue (original model)", traceProcess=jobLabel)
+                        referenceSlicingDuration = time.perf_counter() - slicingStartTime
+                    if referenceReturnCode == 0:
+                        meshSimplificationReport['original_model_slicing_s'] = referenceSlicingDuration
+                        meshSimplificationReport['slicer_speedup'] = referenceSlicingDuration / meshSimplificationReport['slicing_s']
+                        if os.path.getsize(tempFilePaths["metadata"]):
+                            metadata = json.load(open(tempFilePaths["metadata"], 'r'))
+                            referenceMetadata = json.load(open(stagingDirectory.getPath("reference_metadata"), 'r'))
+                            meshSimplificationReport['metadata_changes'] = {
+                                key: {'original_model': referenceMetadata.get(key), 'simplified_model': metadata.get(key)}
+                                for key in ["duration_s", "extrusion_mass_g", "bounding_box"]
+                            }
                     else:
-                        print(
-                            "strangely, at index " + str(index) + " in the json toolpath, we have encountered a \"move\" "
-                            + "command having the \"Inset\" tag where none of the tags contains the word \"External\" "
-                            + "and none of the tags contains the word \"Internal\"."
+                        log("miracle_grue failed (returning " + str(referenceReturnCode) + ") on the original model, so we can not report the speedup from the mesh simplification.")
+
+                if sliceCache and returnCode == 0:
+                    await runInThread(
+                        buildTrace.traced(sliceCache.put, "slice cache put", process=jobLabel),
+                        sliceCacheKey,
+                        dict(
+                            [(key, tempFilePaths[key]) for key in ["jsontoolpath", "gcode", "metadata"]]
+                            + ([("log", tempFilePaths["log"])] if output_miraclegrue_log_file_path else [])
                         )
-                        #we'll blindly assume that we are dealing with "WALL-OUTER"
-                        thisNoodleType = "WALL-OUTER"
-                        pass
-                else:
-                    #the default is to assume that noodleType has not changed.
-                    thisNoodleType = noodleType
-
-                #As far as I can tell, there is no good way to detect which moves in the jsontoolpath correspond to Cura's concepts of SKIN, SKIRT, SUPPORT-INTERFACE, and PRIME-TOWER. 
-
-                if thisNoodleType != noodleType:
-                    noodleType =  thisNoodleType
-                    outputGcodeFile.write(";TYPE:" + str(noodleType) + "\n")
-
-                outputGcodeFile.write(
-                    "G1 X{} Y{} Z{} E{} F{}".format(
-                        command['parameters']['x'],
-                        command['parameters']['y'],
-                        command['parameters']['z'],
-                        command['parameters']['a'],
-                        command['parameters']['feedrate'] * 60
-                    ) + "\n"
-                )
-            elif function == 'comment':
-                comment: str = command['parameters']['comment']
-                outputGcodeFile.write("; " + comment + "\n")
-                upperPositionPrefix = "Upper Position"
-
-                #watch for a comment that looks like "Upper Position  0.05", and, upon change,
-                # increment layer number and emit a ";LAYER:" comment.
-                if comment.startswith(upperPositionPrefix):
-                    thisUpperPosition = float( 
-                        re.search( pattern='[0123456789\.\+\-]+',  string=comment[len(upperPositionPrefix):]   ).group(0)
-                    )   
-                    if thisUpperPosition != lastUpperPosition:
-                        layerNumber += 1
-                        outputGcodeFile.write(";LAYER:" + str(layerNumber) + "\n")
-                        lastUpperPosition = thisUpperPosition
+                    )
+                # we publish the log even if miracle_grue failed, since that is when it is most wanted.
+                if output_miraclegrue_log_file_path:
+                    artifact_staging.publishFile(tempFilePaths["log"], output_miraclegrue_log_file_path)
+
+            if meshSimplificationReport and output_mesh_simplification_report_file_path:
+                if cachedArtifactPaths:
+                    meshSimplificationReport['slicing_s'] = None
+                with open(stagedPaths["mesh_simplification_report"], 'w') as outputReportFile:
+                    json.dump(meshSimplificationReport, outputReportFile, indent=4)
+                artifact_staging.publishFile(stagedPaths["mesh_simplification_report"], output_mesh_simplification_report_file_path)
+
+            if returnCodes.get("miracle_grue", 0) != 0:
+                # the slicer failed, so there is nothing worth post-processing or packaging, and we publish none of its outputs (the previous
+                # outputs, if any, are left as they were).
+                if previewableGcodeTask:
+                    await asyncio.gather(previewableGcodeTask, return_exceptions=True)
+                await independentStagesTask
+                return returnCodes
+
+            # the travel optimizer rewrites the jsontoolpath before any of the stages below read it, so that they all see (and we publish) the
+            # optimized toolpath.  (The slice cache keeps the toolpath as miracle_grue produced it.)
+            if args.optimize_travel and (output_json_toolpath_file_path or output_makerbot_file_path or output_previewable_gcode_file_path or output_toolpath_statistics_file_path or output_print_time_estimate_file_path or output_binary_toolpath_file_path or output_travel_optimization_report_file_path or output_layer_fingerprints_file_path or output_toolpath_diff_file_path):
+                def optimizeTravel():
+                    progressBar = makeProgressBar("travel")
+                    with open(tempFilePaths["jsontoolpath"], 'rb') as inputJsontoolpathFile, open(stagedPaths["optimized_jsontoolpath"], 'wb') as outputJsontoolpathFile:
+                        report = travel_optimizer.optimizeTravel(
+                            inputJsontoolpathFile=inputJsontoolpathFile,
+                            outputJsontoolpathFile=outputJsontoolpathFile,
+                            progressReportingCallback=progressBar.setProgressAndUpdate
+                        )
+                    progressBar.finish()
+                    return report
+                travelOptimizationReport = await runInThread(optimizeTravel)
+                tempFilePaths["jsontoolpath"] = stagedPaths["optimized_jsontoolpath"]
+                log("travel optimization saved " + format(travelOptimizationReport['travel_s_saved'], ".1f") + " s of " + format(travelOptimizationReport['travel_s_before'], ".1f") + " s of travel.")
+                if output_travel_optimization_report_file_path:
+                    with open(stagedPaths["travel_optimization_report"], 'w') as outputReportFile:
+                        json.dump(travelOptimizationReport, outputReportFile, indent=4)
+                    artifact_staging.publishFile(stagedPaths["travel_optimization_report"], output_travel_optimization_report_file_path)
+
+            # stages that depend on the output of the slicer (but not on each other).
+            # Each stage writes its output into the staging directory, and, once all of the stages have succeeded, we publish their outputs together
+            # (so that a job one of whose stages fails publishes none of them, and leaves the previous outputs, if any, as they were).
+            dependentStages = []
+            stagedPublications = [] # (stagedPath, outputPath) of each output of the stages below
+            def publishStagedFile(stagedPath, outputPath):
+                stagedPublications.append((stagedPath, outputPath))
+            if previewableGcodeTask:
+                async def publishPreviewableGcode():
+                    await previewableGcodeTask
+                    publishStagedFile(stagedPaths["previewable_gcode"], output_previewable_gcode_file_path)
+                dependentStages.append(publishPreviewableGcode())
+
+            # the analyses of the toolpath (the previewable gcode, the statistics, and the print time estimate) do not parse the jsontoolpath themselves.  Instead, we parse it once,
+            # into a binarytoolpath (see binary_toolpath), which each of them then memory-maps.  The exception is the previewable gcode when we have several
+            # cores, in which case we divide the jsontoolpath among several processes (see parallel_previewable_gcode).
+            convertPreviewableGcodeInParallel = args.previewable_gcode_process_count[0] > 1
+            binaryToolpathTask = None
+            if output_binary_toolpath_file_path or output_toolpath_statistics_file_path or output_print_time_estimate_file_path or output_layer_fingerprints_file_path or output_toolpath_diff_file_path or (output_previewable_gcode_file_path and not previewableGcodeTask and not convertPreviewableGcodeInParallel):
+                def writeBinaryToolpath():
+                    progressBar = makeProgressBar("binarytoolpath")
+                    with open(stagedPaths["binary_toolpath"], 'wb') as outputBinaryToolpathFile:
+                        binary_toolpath.convertJsontoolpathToBinaryToolpath(
+                            inputJsontoolpathFile=open(tempFilePaths["jsontoolpath"],'r'),
+                            outputBinaryToolpathFile=outputBinaryToolpathFile,
+                            progressReportingCallback=progressBar.setProgressAndUpdate
+                        )
+                    progressBar.finish()
+                binaryToolpathTask = asyncio.ensure_future(runInThread(writeBinaryToolpath))
+                dependentStages.append(binaryToolpathTask)
+
+            if output_json_toolpath_file_path and args.output_json_toolpath_layer_index:
+                # (publishing the jsontoolpath preserves its size and modification time, by which the index recognizes it.)
+                def writeLayerIndex():
+                    progressBar = makeProgressBar("layerindex")
+                    layerIndex = layer_index.buildLayerIndex(tempFilePaths["jsontoolpath"], progressReportingCallback=progressBar.setProgressAndUpdate)
+                    with open(stagedPaths["json_toolpath_layer_index"], 'w') as outputLayerIndexFile:
+                        layer_index.writeLayerIndex(layerIndex, outputLayerIndexFile)
+                    progressBar.finish()
+                dependentStages.append(runInThread(writeLayerIndex))
+
+            if output_previewable_gcode_file_path and not previewableGcodeTask and convertPreviewableGcodeInParallel:
+                async def writePreviewableGcodeInParallel():
+                    progressBar = makeProgressBar("gcode")
+                    with open(stagedPaths["previewable_gcode"],'w') as outputGcodeFile:
+                        await parallel_previewable_gcode.generatePreviewableGcodeInParallel(
+                            jsontoolpathPath=tempFilePaths["jsontoolpath"],
+                            outputGcodeFile=outputGcodeFile,
+                            workingDirectory=stagingDirectory.path,
+                            processCount=args.previewable_gcode_process_count[0],
+                            progressReportingCallback=progressBar.setProgressAndUpdate,
+                            log=log
+                        )
+                    publishStagedFile(stagedPaths["previewable_gcode"], output_previewable_gcode_file_path)
+                    progressBar.finish()
+                dependentStages.append(writePreviewableGcodeInParallel())
+            elif output_previewable_gcode_file_path and not previewableGcodeTask:
+                def writePreviewableGcode():
+                    progressBar = makeProgressBar("gcode")
+                    with open(stagedPaths["previewable_gcode"],'w') as outputGcodeFile:
+                        toolpath_arrays.writePreviewableGcode(
+                            toolpathArrays=binary_toolpath.loadToolpathArrays(stagedPaths["binary_toolpath"]),
+                            outputGcodeFile=outputGcodeFile
+                        )
+                    publishStagedFile(stagedPaths["previewable_gcode"], output_previewable_gcode_file_path)
+                    progressBar.finish()
+                async def writePreviewableGcodeFromBinaryToolpath():
+                    await binaryToolpathTask
+                    await runInThread(writePreviewableGcode)
+                dependentStages.append(writePreviewableGcodeFromBinaryToolpath())
+            if output_toolpath_statistics_file_path:
+                def writeToolpathStatistics():
+                    progressBar = makeProgressBar("statistics")
+                    toolpathArrays = binary_toolpath.loadToolpathArrays(stagedPaths["binary_toolpath"])
+                    with open(stagedPaths["toolpath_statistics"],'w') as outputToolpathStatisticsFile:
+                        json.dump(toolpathArrays.getStatistics(), outputToolpathStatisticsFile, indent=4)
+                    publishStagedFile(stagedPaths["toolpath_statistics"], output_toolpath_statistics_file_path)
+                    progressBar.finish()
+                async def writeToolpathStatisticsFromBinaryToolpath():
+                    await binaryToolpathTask
+                    await runInThread(writeToolpathStatistics)
+                dependentStages.append(writeToolpathStatisticsFromBinaryToolpath())
+
+            if output_print_time_estimate_file_path:
+                def writePrintTimeEstimate():
+                    progressBar = makeProgressBar("print time")
+                    toolpathArrays = binary_toolpath.loadToolpathArrays(stagedPaths["binary_toolpath"])
+                    metadata = (json.load(open(tempFilePaths["metadata"], 'r')) if os.path.getsize(tempFilePaths["metadata"]) else {})
+                    estimate = print_time_estimator.estimatePrintTime(
+                        toolpathArrays,
+                        accelerationProfile=accelerationProfile,
+                        extrusionProfileNamesByFeedrate=print_time_estimator.getExtrusionProfileNamesByFeedrate(miraclegrueConfig),
+                        metadataDuration=metadata.get('duration_s')
+                    )
+                    with open(stagedPaths["print_time_estimate"],'w') as outputPrintTimeEstimateFile:
+                        json.dump(estimate, outputPrintTimeEstimateFile, indent=4)
+                    publishStagedFile(stagedPaths["print_time_estimate"], output_print_time_estimate_file_path)
+                    progressBar.finish()
+                async def writePrintTimeEstimateFromBinaryToolpath():
+                    await binaryToolpathTask
+                    await runInThread(writePrintTimeEstimate)
+                dependentStages.append(writePrintTimeEstimateFromBinaryToolpath())
+            if output_layer_fingerprints_file_path or output_toolpath_diff_file_path:
+                # (only the layers whose fingerprints differ from those of the reference are compared command by command, so this takes about as long as loading the reference.)
+                def writeToolpathDiff():
+                    progressBar = makeProgressBar("toolpath diff")
+                    toolpathArrays = binary_toolpath.loadToolpathArrays(stagedPaths["binary_toolpath"])
+                    quantum = args.toolpath_diff_quantum[0]
+                    if output_toolpath_diff_file_path:
+                        if toolpath_diff.isLayerFingerprintsFile(input_reference_toolpath_file_path):
+                            reference = toolpath_diff.readLayerFingerprints(open(input_reference_toolpath_file_path, 'r'))
+                        else:
+                            reference = toolpath_diff.loadToolpath(input_reference_toolpath_file_path)
+                        report, layerFingerprints = toolpath_diff.compareToolpaths(reference, toolpathArrays, quantum=quantum, progressReportingCallback=progressBar.setProgressAndUpdate)
+                        with open(stagedPaths["toolpath_diff"], 'w') as outputToolpathDiffFile:
+                            json.dump(report, outputToolpathDiffFile, indent=4)
+                        log("toolpath diff: " + str(len(report['changed_layers'])) + " of " + str(report['layer_count']) + " layers changed, "
+                            + str(len(report['added_layers'])) + " added, " + str(len(report['removed_layers'])) + " removed.")
+                        publishStagedFile(stagedPaths["toolpath_diff"], output_toolpath_diff_file_path)
                     else:
-                        # if we get here, then we must have encountered an  "Upper Position" comment
-                        # with the same value as the last "Upper Position" comment.
-                        pass
-                
-            elif function == 'set_toolhead_temperature':
-                pass
-            elif function == 'toggle_fan':
-                pass
-            elif function == 'fan_duty':
-                pass
-            else:
-                pass
-        if progressReportingCallback: progressReportingCallback((index + 1)/len(toolpath))
-    # print("\n") 
-    # print("encountered the following tags:\n" + indentAllLines("\n".join(sorted(allTags))) + "\n")        
-    # print("encountered the following functions:\n" + indentAllLines("\n".join(sorted(allFunctions))) + "\n")        
-
-    
-    # add a comment like ";LAYER:-6" at the beginning of each layer
-
-    # add comments like:
-    #    ";TYPE:FILL"
-    #    ";TYPE:SKIN"
-    #    ";TYPE:SUPPORT"
-    #    ";TYPE:SUPPORT-INTERFACE"
-    #    ";TYPE:WALL-INNER"
-    #    ";TYPE:WALL-OUTER"
-    #
-
-
-# if args.miraclegrue_config_schema_file and args.output_annotated_miraclegrue_config_file:
-if args.output_annotated_miraclegrue_config_file:
-    # generate an annotated hjson version of the config file, by
-    # adding the descriptions in the schema as comments.
-    # schema = json.load(open(pathlib.Path(args.miraclegrue_config_schema_file[0]).resolve() ,'r'))
-    process = subprocess.run(
-        args=[
-            str(miraclegrue_executable_path),
-            "--config-schema"   
-        ],
-        capture_output = True,
-        text=True
-    )
-    schema = json.loads(process.stdout)
-    # oldSchema = json.load(open(pathlib.Path(args.old_miraclegrue_config_schema_file[0]).resolve(),'r'))
-    # oldMiraclegrueConfig = json.load(open(pathlib.Path(args.old_miraclegrue_config_file[0]).resolve(),'r'))
-    # we might consider running the config through miraclegrue and letting mircalegrue remove any invalid values.
-
-    with open(pathlib.Path(args.output_annotated_miraclegrue_config_file[0]).resolve() ,'w') as annotatedConfigFile:
-        annotatedConfigFile.write(
-            dumpsAnnotatedHjsonValue(
-                value=miraclegrueConfig,
-                schema=schema,
-                path=[]
-            )
-        )
-
-# generate several temporary files, which we will use during the slicing/makerbot packaging process
-tempFilePaths = dict()
-for key in ["miraclegrue_config", "metadata", "jsontoolpath", "gcode"]:
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=(".jsontoolpath" if key == "jsontoolpath" else "")) as x:
-        tempFilePaths[key] = pathlib.Path(x.name).resolve()
-tempThumbnailDirectory = tempfile.TemporaryDirectory()
-
-
-json.dump(miraclegrueConfig, open(tempFilePaths["miraclegrue_config"],'w'), sort_keys=True, indent=4)
-
-if False and output_makerbot_file_path:
-    subprocessArgs = [
-        str(makerware_python_executable_path),
-        str(makerware_sliceconfig_path),
-        "--status-updates",
-        "--input=" + str(input_model_file_path) +  "",
-        "--output=" + str(output_makerbot_file_path) +  "",
-        "--machine_id=" + miraclegrueConfig['_bot'] + "",
-        "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']) + "",
-        "--material_ids=" + ",".join(miraclegrueConfig['_materials']) + "",
-        "--profile=" + str(temporary_miraclegrue_config_file_path) + "" ,
-        "slice"
-    ]
-
-    process = subprocess.Popen(
-        cwd=makerware_python_working_directory_path,
-        args=subprocessArgs,
-        # capture_output = True,
-        text=True,
-        stdout=subprocess.PIPE
+                        layerFingerprints = toolpath_diff.getLayerFingerprints(toolpathArrays, quantum=quantum)
+                    if output_layer_fingerprints_file_path:
+                        with open(stagedPaths["layer_fingerprints"], 'w') as outputLayerFingerprintsFile:
+                            toolpath_diff.writeLayerFingerprints(layerFingerprints, outputLayerFingerprintsFile)
+                        publishStagedFile(stagedPaths["layer_fingerprints"], output_layer_fingerprints_file_path)
+                    progressBar.finish()
+                async def writeToolpathDiffFromBinaryToolpath():
+                    await binaryToolpathTask
+                    await runInThread(writeToolpathDiff)
+                dependentStages.append(writeToolpathDiffFromBinaryToolpath())
+            if output_makerbot_file_path and not args.package_with_sliceconfig:
+                # we write the .makerbot file ourselves (see makerbot_package), which saves launching MakerWare's python, and re-reading the jsontoolpath, just to zip it.
+                def writeMakerbotFile():
+                    progressBar = makeProgressBar("package")
+                    metadata = makerbot_package.getMakerbotMetadata(open(tempFilePaths["metadata"], 'rb').read(), miraclegrueConfig)
+                    with open(stagedPaths["makerbot"], 'wb') as outputMakerbotFile:
+                        makerbot_package.writeMakerbotFile(
+                            outputMakerbotFile=outputMakerbotFile,
+                            inputJsontoolpathFile=open(tempFilePaths["jsontoolpath"], 'rb'),
+                            inputMetadataFile=io.BytesIO(metadata),
+                            jsontoolpathCompressionLevel=args.makerbot_compression_level[0],
+                            progressReportingCallback=progressBar.setProgressAndUpdate
+                        )
+                    publishStagedFile(stagedPaths["makerbot"], output_makerbot_file_path)
+                    progressBar.finish()
+                async def packageMakerbot():
+                    async with subprocessSemaphore:
+                        await runInThread(writeMakerbotFile)
+                dependentStages.append(packageMakerbot())
+            elif output_makerbot_file_path:
+                subprocessArgs = [
+                    str(makerware_python_executable_path),
+                    str(makerware_sliceconfig_path),
+                    "--status-updates",
+                    "--input=" + str(tempFilePaths["jsontoolpath"]),
+                    "--output=" + str(stagedPaths["makerbot"]),
+                    "--machine_id=" + miraclegrueConfig['_bot'],
+                    "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']),
+                    "--material_ids=" + ",".join(miraclegrueConfig['_materials']),
+                    "--profile=" + str(tempFilePaths["miraclegrue_config"]),
+                    "--metadata=" + str(tempFilePaths["metadata"]),
+                    # "--thumbnail-dir=" + str(stagingDirectory.getPath("thumbnails")),
+                    # having nothing in the thumbnail dir causes an error.  Therefore, we will only pass the thumbnail-dir option if we have thumbnail images.
+                    "package_makerbot"
+                ]
+                async def packageMakerbot():
+                    async with subprocessSemaphore:
+                        returnCode = await runSubprocessReportingProgress(subprocessArgs, makeProgressBar("sliceconfig"), progressKey="progress", name="sliceconfig", traceProcess=jobLabel)
+                    log("process.returncode: " + str(returnCode))
+                    returnCodes["sliceconfig"] = returnCode
+                    if returnCode == 0:
+                        publishStagedFile(stagedPaths["makerbot"], output_makerbot_file_path)
+                dependentStages.append(packageMakerbot())
+
+            dependentStageTasks.extend(asyncio.ensure_future(stage) for stage in dependentStages)
+            await asyncio.gather(*dependentStageTasks)
+
+            # the raw outputs of the slicer (and the binarytoolpath) are published last, because the stages above read them.
+            with buildTrace.span("publish", process=jobLabel):
+                for stagedPath, outputPath in stagedPublications:
+                    artifact_staging.publishFile(stagedPath, outputPath)
+                for key, outputPath in [("metadata", output_metadata_file_path), ("jsontoolpath", output_json_toolpath_file_path), ("gcode", output_gcode_file_path)]:
+                    if outputPath:
+                        artifact_staging.publishFile(tempFilePaths[key], outputPath)
+                if output_binary_toolpath_file_path:
+                    artifact_staging.publishFile(stagedPaths["binary_toolpath"], output_binary_toolpath_file_path)
+                if output_json_toolpath_file_path and args.output_json_toolpath_layer_index:
+                    artifact_staging.publishFile(stagedPaths["json_toolpath_layer_index"], layer_index.getLayerIndexPath(output_json_toolpath_file_path))
+        await independentStagesTask
+        return returnCodes
+    except BaseException:
+        # the staging directory is removed as soon as we return, so, before we pass the exception on, we stop the stages that depend on the
+        # slicer, and wait for them, and for the independent stages, to finish (as when the slicer fails, above).
+        pendingTasks = [task for task in dependentStageTasks + ([previewableGcodeTask] if previewableGcodeTask else []) if not task.done()]
+        for task in pendingTasks:
+            task.cancel()
+        await asyncio.gather(*pendingTasks, independentStagesTask, return_exceptions=True)
+        raise
+
+
+# runs the jobs concurrently, reporting the progress of all of them on a single progress bar.
+# returns true if all of the jobs succeeded.
+async def runJobs(jobs, maxConcurrentSubprocesses):
+    # load (and transform) each distinct config up front, once.
+    for job in jobs:
+        loadMiraclegrueConfig(job["input_miraclegrue_config_file"], job["input_miraclegrue_config_transform_file"])
+    progressDisplay = JobsProgressDisplay(
+        jobLabels=[job.get("label") or job["input_model_file"].stem for job in jobs],
+        label=("batch" if len(jobs) > 1 else jobs[0]["input_model_file"].stem),
+        buildTrace=buildTrace
     )
+    subprocessSemaphore = asyncio.Semaphore(max(1, maxConcurrentSubprocesses))
+    failedJobLabels = []
 
-
-    # for line in iter(process.stdout.readline, 'b'):
-    #     if line:
-    #         # sys.stdout.write(line)
-    #         print(line)
-    #     else:
-    #         break
-   
-   
-    # while True:
-    #     output = process.stdout.readline()
-    #     if output == '' and process.poll() is not None:
-    #         break
-    #     if output:
-    #         now = datetime.datetime.now()
-    #         print(now.strftime("%Y-%m-%d %H:%M:%S") + " " + str(now.microsecond) + " " + ": " + output.strip())
-    #         sys.stdout.flush()
-
-    progressBar = MyProgressBar("sliceconfig")
-    for line in iter(process.stdout.readline, 'b'):
-        if line:
-            #attempt to interpret line as a json expression.
-            jsonObject = None
-            try:
-                jsonObject: dict = json.loads(line)
-            except json.decoder.JSONDecodeError as error:
-                # sys.stdout.write(line); sys.stdout.flush()
-                # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
-                pass
-            else:
-                progressBar.setProgressAndUpdate(float(jsonObject.get("progress"))/100)
-
-        else:
-            break
-    process.wait()
-    progressBar.setProgressAndUpdate(1)
-    progressBar.finish()
-    # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-    # print("process.stdout: " + str(process.stdout))
-    # print("process.stderr: " + str(process.stderr))
-    print("process.returncode: " + str(process.returncode))
-    print("temporary_miraclegrue_config_file_path: " + str(temporary_miraclegrue_config_file_path))
-
-if output_gcode_file_path or output_json_toolpath_file_path or output_metadata_file_path or output_makerbot_file_path: 
-    subprocessArgs = [str(miraclegrue_executable_path),
-        "--json-progress", # Display progress messages in JSON format
-        "--config=" + str(tempFilePaths["miraclegrue_config"])
-    ]
-
-    if output_gcode_file_path: subprocessArgs.append("--gcode-toolpath-output=" + str(tempFilePaths["gcode"]))
-    if output_json_toolpath_file_path or output_makerbot_file_path or output_previewable_gcode_file_path: subprocessArgs.append("--json-toolpath-output=" + str(tempFilePaths["jsontoolpath"]))
-    if output_metadata_file_path or output_makerbot_file_path: subprocessArgs.append("--metadata-output=" + str(tempFilePaths["metadata"]))
-    if output_miraclegrue_log_file_path: 
-        subprocessArgs.append("--log-file=" + str(output_miraclegrue_log_file_path))
-        subprocessArgs.append("--log-level=" + "FFF")
-        # --log-level level                     
-        # Verbosity of the slicer output log. 
-        # Must be one of ERROR, WARNING, INFO, 
-        # FINE, FINER, FINEST or E, W, I, F, FF, 
-        # FFF respectively
-        subprocessArgs.append("--no-log-format")
-        
-
-    subprocessArgs.append(str(input_model_file_path))
-     
-
-    process = subprocess.Popen(
-        cwd=makerware_python_working_directory_path,
-        args=subprocessArgs,
-        # capture_output = True,
-        text=True,
-        stdout=subprocess.PIPE
-    ) 
-
-    # progressBar = MyProgressBar("miracle_grue", file=sys.stdout)
-    progressBar = MyProgressBar("miracle_grue")
-    for line in iter(process.stdout.readline, 'b'): 
-        if line:
-            #attempt to interpret line as a json expression.
-            jsonObject = None
-            try:
-                jsonObject: dict = json.loads(line)
-            except json.decoder.JSONDecodeError as error:
-                # sys.stdout.write(line); sys.stdout.flush()
-                # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
-                pass
-            else:
-                progressBar.setProgressAndUpdate(float(jsonObject.get("totalPercentComplete"))/100)
-                sys.stdout.flush()
+    async def runJob(jobIndex, job):
+        try:
+            returnCodes = await makePrintable(
+                job,
+                makeProgressBar=progressDisplay.getProgressBarFactory(jobIndex),
+                log=progressDisplay.getLogFunction(jobIndex),
+                subprocessSemaphore=subprocessSemaphore
+            )
+        except Exception as error:
+            failedJobLabels.append(progressDisplay.jobLabels[jobIndex])
+            progressDisplay.finishJob(jobIndex, "FAILED: " + repr(error))
+            if len(jobs) == 1:
+                raise
         else:
-            break
-    process.wait()
-    progressBar.setProgressAndUpdate(1)
-    progressBar.finish()
-    # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-    # print("process.stdout: " + str(process.stdout))
-    # print("process.stderr: " + str(process.stderr))
-    print("process.returncode: " + str(process.returncode))
-
-    if output_metadata_file_path: shutil.copyfile(tempFilePaths["metadata"], output_metadata_file_path)
-    if output_json_toolpath_file_path: shutil.copyfile(tempFilePaths["jsontoolpath"], output_json_toolpath_file_path)
-    if output_gcode_file_path: shutil.copyfile(tempFilePaths["gcode"], output_gcode_file_path)
-
-    if output_previewable_gcode_file_path:
-        progressBar = MyProgressBar("gcode")
-        generatePreviewableGcode(
-            inputJsontoolpathFile=open(tempFilePaths["jsontoolpath"],'r'),  
-            outputGcodeFile=open(output_previewable_gcode_file_path,'w'), 
-            progressReportingCallback=progressBar.setProgressAndUpdate
-        )
-        progressBar.finish()
-    if output_makerbot_file_path:
-        subprocessArgs = [
-            str(makerware_python_executable_path),
-            str(makerware_sliceconfig_path),
-            "--status-updates",
-            "--input=" + str(tempFilePaths["jsontoolpath"]),
-            "--output=" + str(output_makerbot_file_path),
-            "--machine_id=" + miraclegrueConfig['_bot'],
-            "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']),
-            "--material_ids=" + ",".join(miraclegrueConfig['_materials']),
-            "--profile=" + str(tempFilePaths["miraclegrue_config"]),
-            "--metadata=" + str(tempFilePaths["metadata"]),
-            # "--thumbnail-dir=" + str(pathlib.Path(tempThumbnailDirectory.name).resolve()),
-            # having nothing in the thumbnail dir causes an error.  Therefore, we will only pass the thumbnail-dir option if we have thumbnail images.
-            "package_makerbot"
-        ]
-
-        process = subprocess.Popen(
-            cwd=makerware_python_working_directory_path,
-            args=subprocessArgs,
-            # capture_output = True,
-            text=True,
-            stdout=subprocess.PIPE
-        )
-
-        progressBar = MyProgressBar("sliceconfig")
-        for line in iter(process.stdout.readline, 'b'):
-            if line:
-                #attempt to interpret line as a json expression.
-                jsonObject = None
-                try:
-                    jsonObject: dict = json.loads(line)
-                except json.decoder.JSONDecodeError as error:
-                    # sys.stdout.write(line); sys.stdout.flush()
-                    # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                    # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                    # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
-                    pass
-                else:
-                    progressBar.setProgressAndUpdate(float(jsonObject.get("progress"))/100)
+            if any(returnCodes.values()):
+                failedJobLabels.append(progressDisplay.jobLabels[jobIndex])
+                progressDisplay.finishJob(jobIndex, "FAILED: " + ", ".join(name + " returned " + str(returnCode) for name, returnCode in returnCodes.items() if returnCode))
             else:
-                break
-        process.wait()
-        progressBar.setProgressAndUpdate(1)
-        progressBar.finish()
-        # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-        print("process.returncode: " + str(process.returncode))
-
-
-
-
-
-
+                progressDisplay.finishJob(jobIndex, "done")
+
+    try:
+        await asyncio.gather(*(runJob(jobIndex, job) for jobIndex, job in enumerate(jobs)))
+    finally:
+        progressDisplay.finish()
+    if failedJobLabels and len(jobs) > 1:
+        print(str(len(failedJobLabels)) + " of " + str(len(jobs)) + " jobs failed: " + ", ".join(failedJobLabels))
+    return failedJobLabels
+
+# returns the jobs of the sweep: one per distinct effective config among variants, each of which is a copy of job with its outputs
+# redirected to sweepOutputDirectoryPath (e.g. output_makerbot_file foo.makerbot becomes foo.variant_0_1.makerbot), and with an
+# output_metadata_file, whence we take the results of the sweep.
+def getSweepJobs(job, variants, sweepOutputDirectoryPath):
+    sweepJobs = []
+    for variant in parameter_sweep.getDistinctVariants(variants).values():
+        sweepJob = dict(job)
+        for name in jobOptionNames:
+            if name.startswith("output_") and job[name]:
+                stem, _, extensions = job[name].name.partition(".")
+                sweepJob[name] = sweepOutputDirectoryPath.joinpath(stem + "." + variant.label + "." + extensions)
+        if not sweepJob["output_metadata_file"]:
+            sweepJob["output_metadata_file"] = sweepOutputDirectoryPath.joinpath(job["input_model_file"].stem + "." + variant.label + ".meta.json")
+        sweepJob["label"] = variant.label
+        sweepJob["sweep_variant"] = variant
+        sweepJobs.append(sweepJob)
+    return sweepJobs
+
+# writes the table of the results of the sweep (see parameter_sweep.writeSweepTable()) to output_sweep_table_file_path.
+def writeSweepTable(sweepParameters, variants, sweepJobs, failedJobLabels, output_sweep_table_file_path):
+    metadataByConfigDigest = {
+        sweepJob["sweep_variant"].configDigest: (json.load(open(sweepJob["output_metadata_file"], 'r')) if sweepJob["label"] not in failedJobLabels else None)
+        for sweepJob in sweepJobs
+    }
+    with artifact_staging.StagingDirectory(parentDirectory=output_sweep_table_file_path.parent) as stagingDirectory:
+        with open(stagingDirectory.getPath("sweep_table"), 'w', newline='') as outputSweepTableFile:
+            parameter_sweep.writeSweepTable(sweepParameters, variants, metadataByConfigDigest, outputSweepTableFile)
+        artifact_staging.publishFile(stagingDirectory.getPath("sweep_table"), output_sweep_table_file_path)
+
+
+commandLineJobOptions = {name: getattr(args, name)[0] for name in jobOptionNames if getattr(args, name)}
+if args.batch_manifest_file and args.sweep_grid_file:
+    parser.error("--sweep_grid_file can not be combined with --batch_manifest_file.")
+if args.batch_manifest_file:
+    batch_manifest_file_path = pathlib.Path(args.batch_manifest_file[0]).resolve()
+    jobs = [
+        resolveJob(options, defaults=commandLineJobOptions, baseDirectory=batch_manifest_file_path.parent)
+        for options in hjson.load(open(batch_manifest_file_path, 'r'))
+    ]
+    for job in jobs:
+        if not (job["input_model_file"] and job["input_miraclegrue_config_file"]):
+            parser.error("every job in the batch manifest must specify input_model_file and input_miraclegrue_config_file (either in the manifest or on the command line).")
+else:
+    if not (args.input_model_file and args.input_miraclegrue_config_file):
+        parser.error("--input_model_file and --input_miraclegrue_config_file are required (unless --batch_manifest_file is given).")
+    jobs = [resolveJob(commandLineJobOptions)]
+
+for job in jobs:
+    if job["output_toolpath_diff_file"] and not job["input_reference_toolpath_file"]:
+        parser.error("--output_toolpath_diff_file requires --input_reference_toolpath_file.")
+
+if not makerware_path:
+    for job in jobs:
+        if any(job[name] for name in slicerOutputOptionNames + ["output_annotated_miraclegrue_config_file"]):
+            parser.error("--makerware_path is required, unless the only outputs requested are the draft slices, the mesh analysis, and the config diff.")
+
+if args.sweep_grid_file:
+    if not args.sweep_output_directory:
+        parser.error("--sweep_output_directory is required with --sweep_grid_file.")
+    sweepOutputDirectoryPath = pathlib.Path(args.sweep_output_directory[0]).resolve()
+    sweepOutputDirectoryPath.mkdir(parents=True, exist_ok=True)
+    output_sweep_table_file_path = (pathlib.Path(args.output_sweep_table_file[0]).resolve() if args.output_sweep_table_file else sweepOutputDirectoryPath.joinpath("sweep.csv"))
+    sweepParameters = parameter_sweep.loadSweepParameters(open(args.sweep_grid_file[0], 'r'))
+    variants = parameter_sweep.getVariants(loadMiraclegrueConfig(jobs[0]["input_miraclegrue_config_file"], jobs[0]["input_miraclegrue_config_transform_file"])[0], sweepParameters)
+    jobs = getSweepJobs(jobs[0], variants, sweepOutputDirectoryPath)
+    print("sweeping " + str(len(variants)) + " variants, of which " + str(len(jobs)) + " have distinct configs.")
+
+failedJobLabels = asyncio.run(runJobs(jobs, maxConcurrentSubprocesses=args.batch_max_concurrent_jobs[0]))
+if args.sweep_grid_file:
+    writeSweepTable(sweepParameters, variants, jobs, failedJobLabels, output_sweep_table_file_path)
+    print("wrote the sweep table to " + str(output_sweep_table_file_path))
+print(buildTrace.getSummary())
+if args.output_build_trace_file:
+    output_build_trace_file_path = pathlib.Path(args.output_build_trace_file[0]).resolve()
+    with artifact_staging.StagingDirectory(parentDirectory=output_build_trace_file_path.parent) as stagingDirectory:
+        with open(stagingDirectory.getPath("build_trace"), 'w') as outputBuildTraceFile:
+            buildTrace.writeChromeTrace(outputBuildTraceFile)
+        artifact_staging.publishFile(stagingDirectory.getPath("build_trace"), output_build_trace_file_path)
+if failedJobLabels:
+    sys.exit(1)
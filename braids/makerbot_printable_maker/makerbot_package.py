@@ -0,0 +1,169 @@
+import datetime
+import json
+import os
+import struct
+import uuid
+import zlib
+
+
+# A .makerbot file is a zip archive containing two entries: print.jsontoolpath (the toolpath, as produced by miracle_grue) and meta.json
+# (the metadata).  writeMakerbotFile() writes such an archive directly, in place of running MakerWare's sliceconfig package_makerbot, and
+# reproduces, byte for byte, the layout of the .makerbot files that sliceconfig produces (see build/*.makerbot):
+#   - the entries are, in order, print.jsontoolpath and then meta.json, both deflated, with no extra fields, no data descriptors, and no zip64 records,
+#   - print.jsontoolpath is deflated at level 6 and meta.json at level 0 (i.e. deflate's "stored" blocks),
+#   - "version made by" is 0 (i.e. 0.0, MS-DOS) and "version needed to extract" is 2.0,
+#   - print.jsontoolpath is marked, in the central directory, as a text file (internal attributes = 1), and meta.json is not,
+#   - both entries have the same modification time, and
+#   - the archive comment is "MakerBot file".
+# The jsontoolpath is streamed into the archive a chunk at a time, so it is never held in memory all at once.  Because we do not know the size and crc of
+# the compressed entry until we have written it, we write a placeholder local header, and go back and fill it in afterward (so outputMakerbotFile must be seekable).
+
+makerbotFileComment = b"MakerBot file"
+jsontoolpathEntryName = "print.jsontoolpath"
+metadataEntryName = "meta.json"
+
+localFileHeaderStruct = struct.Struct("<4sHHHHHIIIHH")
+centralDirectoryHeaderStruct = struct.Struct("<4sBBHHHHHIIIHHHHHII")
+endOfCentralDirectoryStruct = struct.Struct("<4sHHHHIIH")
+versionNeededToExtract = 20
+deflateCompressionMethod = 8
+# the largest size or offset that we can represent without zip64 records.
+maxZipSize = 0xFFFFFFFF
+
+# returns (dosTime, dosDate) for the given datetime.datetime.
+def getDosTimeAndDate(dateTime):
+    return (
+        (dateTime.hour << 11) | (dateTime.minute << 5) | (dateTime.second // 2),
+        ((dateTime.year - 1980) << 9) | (dateTime.month << 5) | dateTime.day
+    )
+
+# writes one entry (local header and deflated data) to outputFile, reading the content from inputFile (a binary file-like object).
+# returns the central directory header for the entry.
+def writeEntry(outputFile, name, inputFile, compressionLevel, internalAttributes, dosTimeAndDate, chunkSize=1<<20, progressReportingCallback=None, inputSize=None):
+    encodedName = name.encode('ascii')
+    headerOffset = outputFile.tell()
+    outputFile.write(b"\0" * (localFileHeaderStruct.size + len(encodedName)))
+
+    compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    compressedSize = 0
+    while True:
+        chunk = inputFile.read(chunkSize)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        compressedChunk = compressor.compress(chunk)
+        outputFile.write(compressedChunk)
+        compressedSize += len(compressedChunk)
+        if progressReportingCallback and inputSize: progressReportingCallback(min(1, size/inputSize))
+    compressedChunk = compressor.flush()
+    outputFile.write(compressedChunk)
+    compressedSize += len(compressedChunk)
+    if max(size, compressedSize, headerOffset) > maxZipSize:
+        raise ValueError("the " + name + " entry is too large to be stored in a .makerbot file without zip64 extensions.")
+
+    endOffset = outputFile.tell()
+    outputFile.seek(headerOffset)
+    outputFile.write(
+        localFileHeaderStruct.pack(
+            b"PK\x03\x04",
+            versionNeededToExtract,
+            0, # flags
+            deflateCompressionMethod,
+            dosTimeAndDate[0],
+            dosTimeAndDate[1],
+            crc,
+            compressedSize,
+            size,
+            len(encodedName),
+            0 # extra field length
+        ) + encodedName
+    )
+    outputFile.seek(endOffset)
+
+    return centralDirectoryHeaderStruct.pack(
+        b"PK\x01\x02",
+        0, # version made by
+        0, # host system (MS-DOS)
+        versionNeededToExtract,
+        0, # flags
+        deflateCompressionMethod,
+        dosTimeAndDate[0],
+        dosTimeAndDate[1],
+        crc,
+        compressedSize,
+        size,
+        len(encodedName),
+        0, # extra field length
+        0, # comment length
+        0, # disk number
+        internalAttributes,
+        0, # external attributes
+        headerOffset
+    ) + encodedName
+
+# outputMakerbotFile is a writable, seekable, binary file-like object.
+# inputJsontoolpathFile and inputMetadataFile are readable binary file-like objects, whose content we copy into the print.jsontoolpath and
+# meta.json entries, respectively.
+# dateTime (a datetime.datetime) is the modification time to record for the entries.  It defaults to the current (local) time.
+# progressReportingCallback, if given, is called with the completion ratio (a float) as the jsontoolpath is written.
+def writeMakerbotFile(outputMakerbotFile, inputJsontoolpathFile, inputMetadataFile, jsontoolpathCompressionLevel=6, metadataCompressionLevel=0, dateTime=None, progressReportingCallback=None):
+    dosTimeAndDate = getDosTimeAndDate(dateTime or datetime.datetime.now())
+    try:
+        jsontoolpathSize = os.fstat(inputJsontoolpathFile.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        jsontoolpathSize = None
+
+    centralDirectoryHeaders = [
+        writeEntry(outputMakerbotFile, jsontoolpathEntryName, inputJsontoolpathFile, jsontoolpathCompressionLevel, 1, dosTimeAndDate,
+            progressReportingCallback=progressReportingCallback, inputSize=jsontoolpathSize),
+        writeEntry(outputMakerbotFile, metadataEntryName, inputMetadataFile, metadataCompressionLevel, 0, dosTimeAndDate),
+    ]
+
+    centralDirectoryOffset = outputMakerbotFile.tell()
+    for centralDirectoryHeader in centralDirectoryHeaders:
+        outputMakerbotFile.write(centralDirectoryHeader)
+    centralDirectorySize = outputMakerbotFile.tell() - centralDirectoryOffset
+    if centralDirectoryOffset + centralDirectorySize > maxZipSize:
+        raise ValueError("the .makerbot file is too large to be written without zip64 extensions.")
+    outputMakerbotFile.write(
+        endOfCentralDirectoryStruct.pack(
+            b"PK\x05\x06",
+            0, # number of this disk
+            0, # disk where the central directory starts
+            len(centralDirectoryHeaders),
+            len(centralDirectoryHeaders),
+            centralDirectorySize,
+            centralDirectoryOffset,
+            len(makerbotFileComment)
+        ) + makerbotFileComment
+    )
+    if progressReportingCallback: progressReportingCallback(1)
+
+
+# returns the content (bytes) of the meta.json entry, given the content of the metadata file written by miracle_grue and the (transformed)
+# miraclegrue config.
+# The meta.json in the .makerbot files that sliceconfig produces has, in addition to the metadata that miracle_grue reports, a "miracle_config"
+# entry (wrapping the profile that was passed to sliceconfig) and a "uuid".  We add either of these that is missing, serializing the metadata in
+# the same style as those files (sorted keys, four-space indentation, CRLF line endings).  If nothing is missing, the metadata is passed through
+# untouched.
+def getMakerbotMetadata(metadata, miraclegrueConfig):
+    metadataDict = json.loads(metadata)
+    missingEntries = dict()
+    if "miracle_config" not in metadataDict:
+        missingEntries["miracle_config"] = {
+            "_bot": miraclegrueConfig.get("_bot"),
+            "_extruders": miraclegrueConfig.get("_extruders"),
+            "_materials": miraclegrueConfig.get("_materials"),
+            "doRaft": miraclegrueConfig.get("doRaft"),
+            "version": metadataDict.get("grue_version"),
+            "gaggles": {"default": miraclegrueConfig}
+        }
+    if "uuid" not in metadataDict:
+        missingEntries["uuid"] = str(uuid.uuid4())
+    if not missingEntries:
+        return metadata
+    metadataDict.update(missingEntries)
+    return json.dumps(metadataDict, sort_keys=True, indent=4, separators=(',', ': ')).replace("\n", "\r\n").encode('utf-8')
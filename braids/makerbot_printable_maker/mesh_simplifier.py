@@ -0,0 +1,273 @@
+import collections
+import pathlib
+import struct
+import zipfile
+import numpy
+import thing_mesh
+
+
+# The meshes that we export from SolidWorks are usually tessellated far more finely than a 0.4 mm nozzle can reproduce, which costs
+# miracle_grue time and memory for no benefit.  simplifyThing() rewrites a .thing with each of its meshes simplified, to within a chordal
+# tolerance, by quadric-error edge collapse (after Garland and Heckbert, "Surface Simplification Using Quadric Error Metrics", 1997):
+#   - Each vertex carries a quadric: the sum of the squared distances from a point to the planes of the (original) triangles that have been
+#     merged into the vertex.  Collapsing the edge from vertex u into vertex v costs the value of the combined quadric of u and v at v.  We only
+#     make collapses that cost no more than the square of the tolerance, so that no vertex ends up farther than the tolerance from the plane
+#     of any of the triangles that it replaced.
+#   - We only make half-edge collapses (u is removed, and v stays where it is), so every vertex of the simplified mesh is a vertex of the
+#     original mesh, with exactly the same coordinates.
+#   - Coplanar faces are preserved exactly: wherever three or more edge-connected triangles lie in one plane (the flat faces of a part, as
+#     opposed to the facets of a tessellated curved surface, which come in pairs), a collapse is only allowed if every triangle of the plane
+#     remains in the plane.  The interior of a flat face can be simplified freely (at no cost), but the face itself never tilts or warps.
+#   - We do not collapse across the boundary of an open mesh, or at a non-manifold edge, and we reject collapses that would change the
+#     topology of the mesh (see getLinkConditionViolations()) or fold a triangle over.
+# Rather than making one collapse at a time, in order of cost (which would mean a priority queue, and a python loop over the collapses),
+# we work in rounds, with whole-array operations: in each round, every vertex finds its cheapest admissible collapse, and we make, all at
+# once, a set of those collapses whose neighborhoods do not overlap (so that none of them can invalidate another), favoring the cheapest.
+
+# a triangle that lies within this distance (in mm) of a plane is taken to lie in it.  (This only has to absorb the rounding of the single-
+# precision coordinates of the STL.)
+coplanarTolerance = 1e-4
+
+# the number of edge-connected coplanar triangles from which we take a plane to be a flat face of the part, to be preserved exactly.
+minimumPreservedFaceTriangleCount = 3
+
+# a triangle whose area (in mm^2) would be no more than this after a collapse is taken to have degenerated.
+degenerateTriangleArea = 1e-9
+
+SimplifiedMesh = collections.namedtuple("SimplifiedMesh", ["vertices", "faces", "roundCount", "preservedFaceCount"])
+# vertices is an (n, 3) float32 array, and faces an (m, 3) array of indices into vertices (with the winding of the original triangles).
+# preservedFaceCount is the number of flat faces (planes of at least minimumPreservedFaceTriangleCount coplanar triangles) that were preserved.
+
+
+# returns the index arrays (i, j) of all of the pairs of an element i of groupsA and an element j of groupsB that belong to the same group.
+def getPairsWithinGroups(groupsA, groupsB, groupCount):
+    countsB = numpy.bincount(groupsB, minlength=groupCount)
+    orderB = numpy.argsort(groupsB, kind='stable')
+    startsB = numpy.cumsum(countsB) - countsB
+    pairCounts = countsB[groupsA]
+    i = numpy.repeat(numpy.arange(len(groupsA)), pairCounts)
+    offsets = numpy.arange(len(i)) - numpy.repeat(numpy.cumsum(pairCounts) - pairCounts, pairCounts)
+    return i, orderB[startsB[groupsA[i]] + offsets]
+
+# returns the planes of the triangles (faces, indexing into positions) as an (m, 4) array of (a, b, c, d), with (a, b, c) the unit normal
+# and a*x + b*y + c*z + d = 0 (or all zeros, for a triangle having no area), and the (doubled) areas of the triangles.
+def getFacePlanes(positions, faces):
+    crossProducts = numpy.cross(positions[faces[:, 1]] - positions[faces[:, 0]], positions[faces[:, 2]] - positions[faces[:, 0]])
+    lengths = numpy.sqrt(numpy.einsum('ij,ij->i', crossProducts, crossProducts))
+    normals = crossProducts / numpy.where(lengths > 0, lengths, 1)[:, None]
+    return numpy.column_stack([normals, -numpy.einsum('ij,ij->i', normals, positions[faces[:, 0]])]), lengths
+
+# returns the signed distances of points (an (n, 3) array) from planes (an (n, 4) array).
+def getPlaneDistances(planes, points):
+    return numpy.einsum('ij,ij->i', planes[:, :3], points) + planes[:, 3]
+
+# returns a boolean array that is true for each of faces that lies in a plane shared by at least minimumPreservedFaceTriangleCount
+# edge-connected triangles.
+def getPreservedFaces(positions, faces, facePlanes):
+    edgeVertices = numpy.sort(numpy.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+    edgeFaces = numpy.tile(numpy.arange(len(faces)), 3)
+    edgeOppositeVertices = numpy.concatenate([faces[:, 2], faces[:, 0], faces[:, 1]])
+    order = numpy.lexsort([edgeVertices[:, 1], edgeVertices[:, 0]])
+    sortedEdgeVertices = edgeVertices[order]
+    # (consecutive entries having the same edge are pairs of adjacent faces; at a non-manifold edge, we only pair up consecutive faces, which is enough to connect them.)
+    adjacent = numpy.all(sortedEdgeVertices[1:] == sortedEdgeVertices[:-1], axis=1)
+    f, g = edgeFaces[order[:-1][adjacent]], edgeFaces[order[1:][adjacent]]
+    fOpposite, gOpposite = edgeOppositeVertices[order[:-1][adjacent]], edgeOppositeVertices[order[1:][adjacent]]
+    coplanar = (
+        (numpy.einsum('ij,ij->i', facePlanes[f, :3], facePlanes[g, :3]) > 0)
+        & (numpy.abs(getPlaneDistances(facePlanes[f], positions[gOpposite])) <= coplanarTolerance)
+        & (numpy.abs(getPlaneDistances(facePlanes[g], positions[fOpposite])) <= coplanarTolerance)
+    )
+    f, g = f[coplanar], g[coplanar]
+    # label the connected sets of coplanar faces, by propagating the lowest face index across each adjacency (and then along the chains
+    # of labels that that produces) until nothing changes.
+    labels = numpy.arange(len(faces))
+    while True:
+        previousLabels = labels.copy()
+        lowerLabels = numpy.minimum(labels[f], labels[g])
+        numpy.minimum.at(labels, f, lowerLabels)
+        numpy.minimum.at(labels, g, lowerLabels)
+        labels = labels[labels]
+        if numpy.array_equal(labels, previousLabels):
+            break
+    regionSizes = numpy.bincount(labels, minlength=len(faces))
+    preserved = regionSizes[labels] >= minimumPreservedFaceTriangleCount
+    return preserved, int(numpy.count_nonzero((regionSizes >= minimumPreservedFaceTriangleCount) & (labels == numpy.arange(len(faces)))))
+
+# returns a boolean array that is true for each of the collapses (from collapseSources[i] into collapseTargets[i]) that would violate the
+# link condition: an edge u-v can be collapsed without changing the topology of a (closed, manifold) mesh only if the vertices that
+# are neighbors of both u and v are exactly the two vertices opposite the edge.
+def getLinkConditionViolations(collapseSources, collapseTargets, edgeSources, edgeTargets, edgeKeys, vertexCount):
+    i, j = getPairsWithinGroups(collapseSources, edgeSources, vertexCount)
+    neighbors = edgeTargets[j]
+    keys = numpy.minimum(collapseTargets[i], neighbors) * vertexCount + numpy.maximum(collapseTargets[i], neighbors)
+    positions = numpy.minimum(numpy.searchsorted(edgeKeys, keys), len(edgeKeys) - 1)
+    isCommonNeighbor = (edgeKeys[positions] == keys) & (neighbors != collapseTargets[i])
+    return numpy.bincount(i[isCommonNeighbor], minlength=len(collapseSources)) != 2
+
+# simplifies the mesh having the given vertex positions (an (n, 3) float32 array) and faces (an (m, 3) array of indices into positions,
+# in which coincident vertices have already been identified; see thing_mesh.getVertexIds()), such that no vertex moves farther than
+# tolerance (in the units of positions) from the planes of the faces that it replaces.  Returns a SimplifiedMesh.
+# progressReportingCallback, if given, is called with the fraction of the work done, between 0 and 1.
+def simplifyMesh(positions, faces, tolerance, progressReportingCallback=None):
+    exactPositions = positions
+    positions = positions.astype(numpy.float64)
+    vertexCount = len(positions)
+    faces = numpy.asarray(faces, dtype=numpy.int64)
+    facePlanes, _ = getFacePlanes(positions, faces)
+    preservedFaces, preservedFaceCount = getPreservedFaces(positions, faces, facePlanes)
+    # (the quadric of a plane p is the outer product of p with itself, so that the squared distance of the point x from p is [x 1] Q [x 1]^T.)
+    quadrics = numpy.zeros((vertexCount, 4, 4))
+    for corner in range(3):
+        numpy.add.at(quadrics, faces[:, corner], facePlanes[:, :, None] * facePlanes[:, None, :])
+    homogeneousPositions = numpy.column_stack([positions, numpy.ones(vertexCount)])
+
+    roundCount = 0
+    removedVertexCount = 0
+    progress = 0.0
+    while len(faces):
+        roundCount += 1
+        currentFacePlanes, doubledAreas = getFacePlanes(positions, faces)
+        # the edges, each identified by (lower vertex index) * vertexCount + (higher vertex index), and the number of faces that share each.
+        edgeVertices = numpy.sort(numpy.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        edgeKeys, edgeFaceCounts = numpy.unique(edgeVertices[:, 0] * vertexCount + edgeVertices[:, 1], return_counts=True)
+        edgeSources = numpy.concatenate([edgeKeys // vertexCount, edgeKeys % vertexCount])
+        edgeTargets = numpy.concatenate([edgeKeys % vertexCount, edgeKeys // vertexCount])
+        # (we leave the vertices on boundary and non-manifold edges where they are.)
+        locked = numpy.zeros(vertexCount, dtype=bool)
+        locked[edgeSources[numpy.tile(edgeFaceCounts, 2) != 2]] = True
+
+        # the candidate collapses: each edge, in each direction, from an unlocked vertex, that costs no more than tolerance squared.
+        candidates = numpy.flatnonzero(~locked[edgeSources])
+        sources, targets = edgeSources[candidates], edgeTargets[candidates]
+        costs = numpy.einsum('ij,ijk,ik->i', homogeneousPositions[targets], quadrics[sources] + quadrics[targets], homogeneousPositions[targets])
+        affordable = costs <= tolerance ** 2
+        sources, targets, costs = sources[affordable], targets[affordable], costs[affordable]
+        if not len(sources):
+            break
+
+        inadmissible = getLinkConditionViolations(sources, targets, edgeSources, edgeTargets, edgeKeys, vertexCount)
+        # for each face around the source of each candidate, unless the collapse removes it, check that the face neither folds over
+        # nor degenerates, and, if it belongs to a flat face of the part, stays in its plane.
+        faceCornerFaces = numpy.tile(numpy.arange(len(faces)), 3)
+        faceCornerVertices = faces.T.ravel()
+        i, j = getPairsWithinGroups(sources, faceCornerVertices, vertexCount)
+        cornerFaces = faceCornerFaces[j]
+        cornerIndices = j // len(faces)
+        a = faces[cornerFaces, (cornerIndices + 1) % 3]
+        b = faces[cornerFaces, (cornerIndices + 2) % 3]
+        v = targets[i]
+        surviving = (a != v) & (b != v)
+        i, cornerFaces, a, b, v = i[surviving], cornerFaces[surviving], a[surviving], b[surviving], v[surviving]
+        newCrossProducts = numpy.cross(positions[a] - positions[v], positions[b] - positions[v])
+        newDoubledAreas = numpy.sqrt(numpy.einsum('ij,ij->i', newCrossProducts, newCrossProducts))
+        bad = (
+            (numpy.einsum('ij,ij->i', newCrossProducts, currentFacePlanes[cornerFaces, :3]) <= 0)
+            | (newDoubledAreas <= 2 * degenerateTriangleArea)
+            | (preservedFaces[cornerFaces] & (numpy.abs(getPlaneDistances(facePlanes[cornerFaces], positions[v])) > coplanarTolerance))
+        )
+        inadmissible |= numpy.bincount(i[bad], minlength=len(sources)) > 0
+        sources, targets, costs = sources[~inadmissible], targets[~inadmissible], costs[~inadmissible]
+        if not len(sources):
+            break
+
+        # each vertex's cheapest admissible collapse.
+        order = numpy.lexsort([costs, sources])
+        _, firstIndices = numpy.unique(sources[order], return_index=True)
+        chosen = order[firstIndices]
+        sources, targets, costs = sources[chosen], targets[chosen], costs[chosen]
+        # (we can not know how many collapses remain, so we report the fraction of the vertices that we have removed, or could remove now.)
+        if progressReportingCallback:
+            progress = max(progress, removedVertexCount / (removedVertexCount + len(sources)))
+            progressReportingCallback(progress)
+        # make those collapses whose closed neighborhoods (the source and its neighbors) are disjoint from those of every cheaper collapse
+        # that we make: each vertex is claimed by the cheapest of the collapses in whose neighborhood it lies, and we make the collapses
+        # that claim all of their neighborhood.  (There is always at least one: the cheapest.)
+        ranks = numpy.empty(len(sources), dtype=numpy.int64)
+        ranks[numpy.lexsort([sources, costs])] = numpy.arange(len(sources))
+        # (sources is sorted, and each of its vertices occurs once; the edges from other vertices go into an extra group of their own.)
+        edgeCollapses = numpy.minimum(numpy.searchsorted(sources, edgeSources), len(sources) - 1)
+        edgeCollapses[sources[edgeCollapses] != edgeSources] = len(sources)
+        i, j = getPairsWithinGroups(numpy.arange(len(sources)), edgeCollapses, len(sources) + 1)
+        neighborhoodCollapses = numpy.concatenate([numpy.arange(len(sources)), i])
+        neighborhoodVertices = numpy.concatenate([sources, edgeTargets[j]])
+        claims = numpy.full(vertexCount, len(sources), dtype=numpy.int64)
+        numpy.minimum.at(claims, neighborhoodVertices, ranks[neighborhoodCollapses])
+        unclaimed = claims[neighborhoodVertices] != ranks[neighborhoodCollapses]
+        selected = numpy.bincount(neighborhoodCollapses[unclaimed], minlength=len(sources)) == 0
+        sources, targets = sources[selected], targets[selected]
+
+        quadrics[targets] += quadrics[sources]
+        vertexMap = numpy.arange(vertexCount)
+        vertexMap[sources] = targets
+        faces = vertexMap[faces]
+        surviving = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+        faces, facePlanes, preservedFaces = faces[surviving], facePlanes[surviving], preservedFaces[surviving]
+        removedVertexCount += len(sources)
+
+    usedVertices, faces = numpy.unique(faces, return_inverse=True)
+    return SimplifiedMesh(vertices=exactPositions[usedVertices], faces=faces.reshape(-1, 3), roundCount=roundCount, preservedFaceCount=preservedFaceCount)
+
+# returns the bytes of a binary STL having the given header (80 bytes), with the triangles given by vertices and faces (see SimplifiedMesh).
+def getBinaryStl(header, vertices, faces):
+    triangles = numpy.zeros(len(faces), dtype=thing_mesh.stlTriangleDtype)
+    triangles['vertices'] = vertices[faces]
+    facePlanes, _ = getFacePlanes(vertices.astype(numpy.float64), faces)
+    triangles['normal'] = facePlanes[:, :3]
+    return bytes(header[:80]).ljust(80, b"\0") + struct.pack("<I", len(faces)) + triangles.tobytes()
+
+
+# returns the bytes of the STL data stlData (a bytes-like object) with its mesh simplified (see simplifyMesh()), as a binary STL, along with
+# a report (a dict) of the triangle counts before and after.
+def simplifyStl(stlData, tolerance, name="STL", progressReportingCallback=None):
+    triangles = thing_mesh.getStlTriangles(stlData, name=name)
+    vertexIds = thing_mesh.getVertexIds(triangles)
+    positions = numpy.zeros((int(vertexIds.max(initial=-1)) + 1, 3), dtype=numpy.float32)
+    positions[vertexIds.ravel()] = triangles['vertices'].reshape(-1, 3)
+    simplifiedMesh = simplifyMesh(positions, vertexIds, tolerance, progressReportingCallback=progressReportingCallback)
+    # (we keep the header of a binary STL, but not the start of an ASCII one: a binary STL whose header begins with "solid" is liable to be mistaken for an ASCII one.)
+    header = (b"" if bytes(stlData[:5]).lower() == b"solid" else bytes(stlData[:80]))
+    return getBinaryStl(header, simplifiedMesh.vertices, simplifiedMesh.faces), {
+        'triangle_count_before': len(triangles),
+        'triangle_count_after': len(simplifiedMesh.faces),
+        'preserved_flat_face_count': simplifiedMesh.preservedFaceCount,
+        'round_count': simplifiedMesh.roundCount,
+    }
+
+# writes to outputThingFilePath a copy of the .thing file at inputThingFilePath in which each mesh has been simplified (see simplifyMesh()),
+# and returns a report (a dict) of the triangle counts before and after, in total and for each mesh.
+# The other members of the archive (the manifest, and any meshes that no instance refers to) are copied as they are, and the output depends
+# only on the input (the archive entries keep their timestamps), so that the slice cache recognizes the simplified model from one build to the next.
+# (If inputThingFilePath is a bare STL file, rather than a .thing, the output is the simplified STL.)
+def simplifyThing(inputThingFilePath, outputThingFilePath, tolerance, progressReportingCallback=None):
+    report = {'tolerance_mm': tolerance, 'triangle_count_before': 0, 'triangle_count_after': 0, 'meshes': {}}
+    if not zipfile.is_zipfile(inputThingFilePath):
+        with open(inputThingFilePath, 'rb') as inputStlFile:
+            stlData, report['meshes'][pathlib.Path(inputThingFilePath).name] = simplifyStl(inputStlFile.read(), tolerance, name=str(inputThingFilePath), progressReportingCallback=progressReportingCallback)
+        with open(outputThingFilePath, 'wb') as outputStlFile:
+            outputStlFile.write(stlData)
+    else:
+        objectNames = sorted(set(instance.objectName for instance in thing_mesh.loadThing(inputThingFilePath)))
+        with zipfile.ZipFile(inputThingFilePath) as inputZipFile, zipfile.ZipFile(outputThingFilePath, 'w') as outputZipFile:
+            for info in inputZipFile.infolist():
+                data = inputZipFile.read(info.filename)
+                if info.filename in objectNames:
+                    objectIndex = objectNames.index(info.filename)
+                    data, report['meshes'][info.filename] = simplifyStl(
+                        data, tolerance, name=info.filename,
+                        progressReportingCallback=(
+                            (lambda progress: progressReportingCallback((objectIndex + progress) / len(objectNames)))
+                            if progressReportingCallback else None
+                        )
+                    )
+                outputInfo = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                outputInfo.compress_type = info.compress_type
+                outputInfo.external_attr = info.external_attr
+                outputZipFile.writestr(outputInfo, data)
+    for meshReport in report['meshes'].values():
+        report['triangle_count_before'] += meshReport['triangle_count_before']
+        report['triangle_count_after'] += meshReport['triangle_count_after']
+    report['triangle_reduction'] = (1 - report['triangle_count_after'] / report['triangle_count_before'] if report['triangle_count_before'] else 0.0)
+    if progressReportingCallback:
+        progressReportingCallback(1.0)
+    return report
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import collections
+import io
+import json
+import mmap
+import os
+import pathlib
+import shutil
+import sys
+import jsontoolpath
+import layer_index
+
+
+# Converts a jsontoolpath to previewable gcode (see jsontoolpath.generatePreviewableGcode()) using several processes at once.
+# The toolpath is split, at layer boundaries, into chunks of roughly equal size, each of which is converted by a separate worker process
+# (this very script, run as a subprocess, in the same way that make_printable runs miracle_grue), writing its gcode to a file of its own.
+# The chunk files are then concatenated, in order, into the output.
+#
+# The conversion carries two pieces of state from one command to the next (see jsontoolpath.PreviewableGcodeState):
+#   - the layer number and the last "Upper Position ..." value.  Because each chunk starts at the "Upper Position ..." comment that begins a layer,
+#     we know these in advance, from the layer boundaries, and each worker reports the values that it ended with, which we check
+#     against the values that the next chunk started with, and
+#   - the noodleType, which a worker cannot know in advance, since it is determined by the last "move" before the chunk whose tags imply one.
+#     A worker therefore starts with the noodleType unknown, and reports where, in its output, its first ";TYPE:..." line is.  When we
+#     assemble the output, we drop that line if it merely repeats the noodleType in effect at the end of the preceding chunks.
+# so that the result is identical, character for character, to the output of generatePreviewableGcode().  If anything goes wrong (the layer
+# boundaries cannot be found, a worker fails, or the chunks do not line up), we fall back to the serial conversion.
+#
+# The layer boundaries are taken from the layer index (see layer_index), if there is a current one alongside the jsontoolpath.  Otherwise, rather than
+# parsing the whole toolpath in order to build one, we find them by searching the raw bytes for the "Upper Position ..." comments (which is
+# fast, but relies on the compact formatting that miracle_grue uses).  A boundary found that way is only a guess, which the worker
+# confirms by checking that the first command of its chunk is the expected "Upper Position ..." comment.
+
+Chunk = collections.namedtuple("Chunk", ["startOffset", "endOffset", "layerNumber", "lastUpperPosition", "upperPosition"])
+# startOffset and endOffset are the byte offsets of the chunk within the jsontoolpath file (the first chunk starts at 0, with the opening bracket
+# of the top-level array, and the last chunk ends at the end of the file).
+# layerNumber and lastUpperPosition are the state (see jsontoolpath.PreviewableGcodeState) at the start of the chunk, and upperPosition is the
+# value of the "Upper Position ..." comment that is the first command of the chunk (or None for the first chunk).
+
+upperPositionCommentPattern = b'"comment":"' + jsontoolpath.upperPositionPrefix.encode('ascii')
+
+# the number of characters that we copy at a time from the chunk files to the output.
+copyBlockSize = 1 << 20
+
+
+# returns a list of (offset, upperPosition) tuples, one per layer, where offset is the byte offset, within the jsontoolpath file at
+# jsontoolpathPath, of the "Upper Position ..." comment that begins the layer, or None if the boundaries can not be determined.
+def findLayerBoundaries(jsontoolpathPath):
+    try:
+        layerIndex = layer_index.LayerIndex.fromJson(json.load(open(layer_index.getLayerIndexPath(jsontoolpathPath), 'r')))
+        if layerIndex.isCurrentFor(jsontoolpathPath):
+            return [(layer.startOffset, layer.upperPosition) for layer in layerIndex.layers if layer.layerNumber > 0]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    boundaries = []
+    lastUpperPosition = None
+    with open(jsontoolpathPath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            position = content.find(upperPositionCommentPattern)
+            while position >= 0:
+                commentStart = position + len(b'"comment":"')
+                commentEnd = content.find(b'"', commentStart)
+                try:
+                    upperPosition = jsontoolpath.parseUpperPosition(content[commentStart:commentEnd].decode('utf-8'))
+                except (AttributeError, ValueError):
+                    return None
+                if upperPosition != lastUpperPosition:
+                    # the item containing the comment begins with the brace before its "command" key.
+                    itemStart = content.rfind(b'{', 0, content.rfind(b'"command"', 0, position))
+                    if itemStart < 0:
+                        return None
+                    boundaries.append((itemStart, upperPosition))
+                    lastUpperPosition = upperPosition
+                position = content.find(upperPositionCommentPattern, commentEnd)
+    return boundaries
+
+# divides the jsontoolpath (of fileSize bytes, with the given layer boundaries) into (at most) chunkCount chunks of roughly equal size, each
+# consisting of whole layers.  Returns a list of Chunks.
+def planChunks(boundaries, fileSize, chunkCount):
+    chunks = []
+    startOffset = 0
+    layerNumber = 0
+    lastUpperPosition = None
+    upperPosition = None
+    for boundaryIndex, (offset, boundaryUpperPosition) in enumerate(boundaries):
+        if offset >= startOffset + fileSize / chunkCount and offset > startOffset:
+            chunks.append(Chunk(startOffset, offset, layerNumber, lastUpperPosition, upperPosition))
+            startOffset = offset
+            layerNumber = boundaryIndex
+            lastUpperPosition = (boundaries[boundaryIndex - 1][1] if boundaryIndex > 0 else None)
+            upperPosition = boundaryUpperPosition
+    chunks.append(Chunk(startOffset, fileSize, layerNumber, lastUpperPosition, upperPosition))
+    return chunks
+
+
+# converts one chunk of the jsontoolpath file at jsontoolpathPath, writing the gcode to outputGcodePath.
+# Returns a dict describing the result (see assembleChunks()).
+def convertChunk(jsontoolpathPath, chunk, isLastChunk, outputGcodePath):
+    with open(jsontoolpathPath, 'rb') as inputJsontoolpathFile:
+        inputJsontoolpathFile.seek(chunk.startOffset)
+        text = inputJsontoolpathFile.read(chunk.endOffset - chunk.startOffset).decode('utf-8')
+    if not isLastChunk:
+        # the chunk ends with the separator that precedes the next chunk's first item; we replace it with a closing bracket, so that the
+        # chunk looks like (the tail of) a complete top-level array.
+        text = text.rstrip()
+        if not text.endswith(","):
+            raise ValueError("the chunk at offset " + str(chunk.startOffset) + " does not end at a boundary between commands.")
+        text = text[:-1] + "]"
+    state = jsontoolpath.PreviewableGcodeState(
+        noodleType=(None if chunk.startOffset == 0 else jsontoolpath.unknownNoodleType),
+        layerNumber=chunk.layerNumber,
+        lastUpperPosition=chunk.lastUpperPosition
+    )
+    output = []
+    isFirstCommand = True
+    for item in jsontoolpath.iterateJsontoolpathItems(io.StringIO(text), insideArray=(chunk.startOffset != 0)):
+        command = item.get('command')
+        if isFirstCommand and chunk.startOffset != 0:
+            # confirm that the chunk really does start at the layer boundary that we think it does.
+            if not (command and command['function'] == 'comment' and jsontoolpath.parseUpperPosition(command['parameters']['comment']) == chunk.upperPosition):
+                raise ValueError("the chunk at offset " + str(chunk.startOffset) + " does not begin with the expected \"Upper Position\" comment.")
+        isFirstCommand = False
+        if command:
+            jsontoolpath.appendPreviewableGcode(command, state, output)
+
+    result = {
+        'layerNumber': state.layerNumber,
+        'lastUpperPosition': state.lastUpperPosition,
+        'noodleType': (None if state.noodleType is jsontoolpath.unknownNoodleType else state.noodleType),
+        'firstNoodleTypeLineOffset': None,
+        'firstNoodleTypeLineLength': None
+    }
+    # (the offset and length of the ";TYPE:..." line are in characters, as assembleChunks() reads the chunk files in text mode.)
+    if state.firstNoodleTypeChangeIndex is not None:
+        result['firstNoodleTypeLineOffset'] = sum(len(line) for line in output[:state.firstNoodleTypeChangeIndex])
+        result['firstNoodleTypeLineLength'] = len(output[state.firstNoodleTypeChangeIndex])
+        result['firstNoodleType'] = output[state.firstNoodleTypeChangeIndex][len(";TYPE:"):-1]
+    with open(outputGcodePath, 'w', encoding='utf-8', newline='') as outputGcodeFile:
+        outputGcodeFile.writelines(output)
+    return result
+
+
+# copies characterCount characters from inputFile to outputFile (text-mode file-like objects), copyBlockSize characters at a time.
+def copyCharacters(inputFile, outputFile, characterCount):
+    while characterCount > 0:
+        block = inputFile.read(min(characterCount, copyBlockSize))
+        if not block:
+            break
+        outputFile.write(block)
+        characterCount -= len(block)
+
+
+# writes the converted chunks to outputGcodeFile (a writable text-mode file-like object), in order, dropping any ";TYPE:..." line at
+# the start of a chunk that does not change the noodleType.  The chunk files are copied a block at a time, rather than read whole.
+# chunkResults is a list of (chunk, result, gcodePath) tuples.  Raises a ValueError if the layer state at the end of a chunk does not
+# match the state that the following chunk assumed (which we check before we write anything).
+def assembleChunks(chunkResults, outputGcodeFile):
+    noodleType = None
+    for index, (chunk, result, gcodePath) in enumerate(chunkResults):
+        if index + 1 < len(chunkResults):
+            nextChunk = chunkResults[index + 1][0]
+            if (result['layerNumber'], result['lastUpperPosition']) != (nextChunk.layerNumber, nextChunk.lastUpperPosition):
+                raise ValueError("the chunk at offset " + str(nextChunk.startOffset) + " does not start with the layer state with which the preceding chunk ended.")
+    for (chunk, result, gcodePath) in chunkResults:
+        with open(gcodePath, 'r', encoding='utf-8', newline='') as chunkGcodeFile:
+            lineOffset = result['firstNoodleTypeLineOffset']
+            if lineOffset is not None and result['firstNoodleType'] == noodleType:
+                copyCharacters(chunkGcodeFile, outputGcodeFile, lineOffset)
+                chunkGcodeFile.read(result['firstNoodleTypeLineLength'])
+            shutil.copyfileobj(chunkGcodeFile, outputGcodeFile, copyBlockSize)
+        if result['noodleType'] is not None:
+            noodleType = result['noodleType']
+
+
+# converts the jsontoolpath file at jsontoolpathPath to previewable gcode, writing it to outputGcodeFile (a writable text-mode file-like object),
+# using up to processCount worker processes at once (by default, one per core; with only one, we simply convert serially, in-process).  workingDirectory is a directory in which to put the chunk files (which we remove when we are done).
+# log, if given, is called with a message when we fall back to the serial conversion.
+# progressReportingCallback, if given, is called with the completion ratio (a float) as the chunks are completed.
+async def generatePreviewableGcodeInParallel(jsontoolpathPath, outputGcodeFile, workingDirectory, processCount=None, progressReportingCallback=None, log=None):
+    if processCount is None:
+        processCount = os.cpu_count() or 1
+    fileSize = os.stat(jsontoolpathPath).st_size
+    boundaries = (findLayerBoundaries(jsontoolpathPath) if processCount > 1 else None)
+    if boundaries:
+        # more chunks than processes, so that a process that finishes early can pick up another chunk.
+        chunks = planChunks(boundaries, fileSize, processCount * 2)
+    else:
+        chunks = []
+    if len(chunks) > 1:
+        semaphore = asyncio.Semaphore(processCount)
+        completedSize = 0
+        chunkDirectory = pathlib.Path(workingDirectory).joinpath("previewable_gcode_chunks")
+        chunkDirectory.mkdir(parents=True, exist_ok=True)
+
+        async def runWorker(index, chunk):
+            nonlocal completedSize
+            gcodePath = chunkDirectory.joinpath(str(index) + ".gcode")
+            async with semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, str(pathlib.Path(__file__).resolve()),
+                    "--jsontoolpath_file=" + str(jsontoolpathPath),
+                    "--output_gcode_file=" + str(gcodePath),
+                    "--chunk=" + json.dumps(list(chunk)),
+                    *(["--last_chunk"] if index == len(chunks) - 1 else []),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(
+                    "the previewable gcode worker for the chunk at offset " + str(chunk.startOffset) + " returned " + str(process.returncode)
+                    + ": " + ((stderr.decode('utf-8', errors='replace').strip().splitlines() or [""])[-1])
+                )
+            completedSize += chunk.endOffset - chunk.startOffset
+            if progressReportingCallback: progressReportingCallback(min(1, completedSize/fileSize))
+            # (the result is the last line; anything before it is incidental output of the conversion.)
+            return (chunk, json.loads(stdout.decode('utf-8').splitlines()[-1]), gcodePath)
+
+        try:
+            # (we let all of the workers finish, even if one fails, so that none is still writing when we remove the chunk files.)
+            chunkResults = await asyncio.gather(*(runWorker(index, chunk) for index, chunk in enumerate(chunks)), return_exceptions=True)
+            for chunkResult in chunkResults:
+                if isinstance(chunkResult, BaseException):
+                    raise chunkResult
+            assembleChunks(chunkResults, outputGcodeFile)
+            return
+        except (RuntimeError, ValueError, IndexError) as error:
+            if log: log("falling back to the serial conversion to previewable gcode: " + str(error))
+        finally:
+            shutil.rmtree(chunkDirectory, ignore_errors=True)
+    elif processCount > 1 and log:
+        log("falling back to the serial conversion to previewable gcode: could not divide the toolpath into layers.")
+
+    def generateSerially():
+        with open(jsontoolpathPath, 'r') as inputJsontoolpathFile:
+            jsontoolpath.generatePreviewableGcode(inputJsontoolpathFile=inputJsontoolpathFile, outputGcodeFile=outputGcodeFile, progressReportingCallback=progressReportingCallback)
+    await asyncio.get_running_loop().run_in_executor(None, generateSerially)
+
+
+# when run as a script, we are a worker: we convert one chunk, and print (as json) the result of convertChunk().
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert one chunk of a jsontoolpath to previewable gcode (a worker process for parallel_previewable_gcode).")
+    parser.add_argument("--jsontoolpath_file", action='store', nargs=1, required=True)
+    parser.add_argument("--output_gcode_file", action='store', nargs=1, required=True)
+    parser.add_argument("--chunk", action='store', nargs=1, required=True, help="the Chunk, as a json array.")
+    parser.add_argument("--last_chunk", action='store_true', required=False)
+    args = parser.parse_args()
+    print(json.dumps(convertChunk(
+        jsontoolpathPath=args.jsontoolpath_file[0],
+        chunk=Chunk(*json.loads(args.chunk[0])),
+        isLastChunk=args.last_chunk,
+        outputGcodePath=args.output_gcode_file[0]
+    )))
@@ -0,0 +1,116 @@
+import collections
+import copy
+import csv
+import hashlib
+import itertools
+import hjson
+import slice_cache
+
+
+# A parameter sweep slices one model with every combination of a set of values for some of the settings of the miraclegrue config, and
+# gathers the results (print time, mass, and bounding box, as reported in each variant's metadata) into one table.
+#
+# The sweep grid is an hjson file, a dict mapping the name of each parameter to either
+#   - a list of values, in which case the name is the (dotted) path, within the transformed config, of the setting to which the values apply,
+#     e.g.  "modelFillProfiles.sparse.density": [0.1, 0.2, 0.3]
+#   - or a dict having "paths" (a list of dotted paths) and "values" (a list of values), in which case each value applies to all of the
+#     paths at once, e.g.
+#         fullSpeedFeedrate: {
+#             paths: ["extruderProfiles.0.extrusionProfiles.insets.feedrate", "extruderProfiles.0.extrusionProfiles.solid.feedrate"]
+#             values: [70, 90]
+#         }
+# (Components of a path that are integers index into lists.)  The values are applied after the transform has run, so they override
+# whatever the transform set.
+#
+# Several variants may well produce the same effective config (e.g. a sweep over the density of sparse infill, for a model that has none,
+# or a parameter whose values include the value that the transform already sets), so we slice each distinct effective config only once.
+
+SweepParameter = collections.namedtuple("SweepParameter", ["name", "paths", "values"])
+
+Variant = collections.namedtuple("Variant", ["label", "parameterValues", "miraclegrueConfig", "configDigest"])
+# parameterValues is a dict mapping the name of each SweepParameter to the value that it has in this variant.
+# configDigest identifies the effective config (variants having the same configDigest need only be sliced once).
+
+# the columns of the table that come from the metadata of a variant (the columns that are nested within the metadata are given as dotted paths).
+resultColumns = [
+    "duration_s",
+    "extrusion_mass_g",
+    "bounding_box.x_min", "bounding_box.x_max",
+    "bounding_box.y_min", "bounding_box.y_max",
+    "bounding_box.z_min", "bounding_box.z_max",
+]
+
+
+def loadSweepParameters(inputSweepGridFile):
+    parameters = []
+    for name, specification in hjson.load(inputSweepGridFile).items():
+        if isinstance(specification, dict):
+            parameters.append(SweepParameter(name=name, paths=list(specification['paths']), values=list(specification['values'])))
+        else:
+            parameters.append(SweepParameter(name=name, paths=[name], values=list(specification)))
+        if not parameters[-1].values:
+            raise ValueError("the sweep parameter " + name + " has no values.")
+    return parameters
+
+# sets the setting at the given dotted path within config (which must already contain the dict or list in which the setting lives).
+def setConfigValue(config, path, value):
+    components = [(int(component) if component.isdigit() else component) for component in path.split(".")]
+    container = config
+    try:
+        for component in components[:-1]:
+            container = container[component]
+        if isinstance(container, list) and not (isinstance(components[-1], int) and components[-1] < len(container)):
+            raise KeyError(components[-1])
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("the config has no setting at " + path + ".") from None
+    container[components[-1]] = value
+
+def getConfigDigest(miraclegrueConfig):
+    return hashlib.sha256(slice_cache.getCanonicalConfigJson(miraclegrueConfig).encode('utf-8')).hexdigest()
+
+# returns the list of the Variants obtained by applying every combination of the values of parameters to miraclegrueConfig (which is not modified).
+def getVariants(miraclegrueConfig, parameters):
+    variants = []
+    for valueIndices in itertools.product(*(range(len(parameter.values)) for parameter in parameters)):
+        variantConfig = copy.deepcopy(miraclegrueConfig)
+        for parameter, valueIndex in zip(parameters, valueIndices):
+            for path in parameter.paths:
+                setConfigValue(variantConfig, path, parameter.values[valueIndex])
+        variants.append(Variant(
+            label="variant_" + "_".join(str(valueIndex) for valueIndex in valueIndices),
+            parameterValues={parameter.name: parameter.values[valueIndex] for parameter, valueIndex in zip(parameters, valueIndices)},
+            miraclegrueConfig=variantConfig,
+            configDigest=getConfigDigest(variantConfig)
+        ))
+    return variants
+
+# returns a dict mapping each configDigest to the first of variants (the one that we actually slice) having that configDigest.
+def getDistinctVariants(variants):
+    distinctVariants = collections.OrderedDict()
+    for variant in variants:
+        distinctVariants.setdefault(variant.configDigest, variant)
+    return distinctVariants
+
+def getMetadataValue(metadata, path):
+    value = metadata
+    for component in path.split("."):
+        if not isinstance(value, dict) or component not in value:
+            return None
+        value = value[component]
+    return value
+
+
+# writes the sweep table, as csv, to outputSweepTableFile (a writable text file-like object, opened with newline='').
+# metadataByConfigDigest maps the configDigest of each distinct variant to its metadata (a dict), or to None if slicing it failed.
+def writeSweepTable(parameters, variants, metadataByConfigDigest, outputSweepTableFile):
+    distinctVariants = getDistinctVariants(variants)
+    writer = csv.writer(outputSweepTableFile)
+    writer.writerow(["variant"] + [parameter.name for parameter in parameters] + resultColumns + ["sliced_as"])
+    for variant in variants:
+        metadata = metadataByConfigDigest.get(variant.configDigest) or {}
+        writer.writerow(
+            [variant.label]
+            + [hjson.dumpsJSON(variant.parameterValues[parameter.name]) if isinstance(variant.parameterValues[parameter.name], (dict, list)) else variant.parameterValues[parameter.name] for parameter in parameters]
+            + [getMetadataValue(metadata, column) for column in resultColumns]
+            + [distinctVariants[variant.configDigest].label]
+        )
@@ -0,0 +1,217 @@
+import collections
+import hjson
+import numpy
+
+
+# Estimates the time that the printer will take to execute a toolpath, taking acceleration into account (unlike
+# ToolpathArrays.getStatistics(), whose commanded_duration_s assumes that every move runs at its commanded feedrate from start to finish).
+#
+# We model a simple (non-lookahead-limited) motion planner of the kind found in printer firmware:
+#   - each move accelerates, cruises, and decelerates along a trapezoidal velocity profile, with the acceleration limited, per axis (x, y, z and
+#     the extruder axis a), by the AccelerationProfile,
+#   - the speed at which one move hands over to the next (the junction speed) is limited by the largest instantaneous change in the velocity
+#     of each axis that the machine tolerates (its "jerk"), and
+#   - the machine starts and finishes at rest.
+# Given the junction limits, the planner's forward pass (a move can not exit faster than it can accelerate to from its entry speed) and backward
+# pass (nor enter faster than it can decelerate from to its exit speed) are min-plus recurrences in the squared speeds, which we solve in closed form
+# with numpy.minimum.accumulate, so the whole estimate is a handful of vectorized passes over the move arrays.
+#
+# The breakdown is by layer, by tag class (see tagClasses), and by feedrate.  The jsontoolpath does not record which extrusion profile a move
+# came from, so we identify the profile by its feedrate, labeling each feedrate with the names of the config's extrusion profiles that have it.
+# Each layer is classified as limited by "acceleration" if most of its time is spent in moves that never reach their commanded feedrate,
+# or else by "feedrate".  For each feedrate, we also report how much time raising that feedrate by feedrateSensitivityFactor would save,
+# which shows whether a change to the feedrate of an extrusion profile would actually make the print faster.
+
+AccelerationProfile = collections.namedtuple("AccelerationProfile", ["maxAcceleration", "maxSpeedChange"])
+# maxAcceleration and maxSpeedChange are dicts mapping each of the axes 'x', 'y', 'z', 'a' to the largest acceleration (mm/s^2) and to the largest
+# instantaneous change of speed (mm/s) that the machine allows along that axis.
+
+axes = ('x', 'y', 'z', 'a')
+
+# (calibrated against the duration_s that miracle_grue reports in the metadata of the builds in the build directory, mount_plate and drill_holder,
+# both for the replicator_5: we kept the proportions between the axes, and scaled the accelerations and the speed changes until the estimates
+# came within 1% of those durations.  See loadAccelerationProfile() for how to override them.)
+defaultAccelerationProfile = AccelerationProfile(
+    maxAcceleration={'x': 100.0, 'y': 100.0, 'z': 15.0, 'a': 200.0},
+    maxSpeedChange={'x': 6.5, 'y': 6.5, 'z': 0.65, 'a': 6.5}
+)
+
+# the tag classes of the breakdown, in order of precedence (a move whose tags include several of them belongs to the first).
+tagClasses = collections.OrderedDict([
+    ("Travel", ("Travel Move",)),
+    ("Retract/Restart", ("Retract", "Restart", "Long Restart")),
+    ("Support", ("Support",)),
+    ("Inset", ("Inset",)),
+    ("Infill", ("Infill",)),
+])
+otherTagClass = "Other"
+
+feedrateSensitivityFactor = 1.1
+
+
+# reads an AccelerationProfile from an hjson file of the form
+#     {
+#         max_acceleration_mm_per_s2: {x: 100, y: 100, z: 15, a: 200}
+#         max_speed_change_mm_per_s:  {x: 6.5, y: 6.5, z: 0.65, a: 6.5}
+#     }
+# Any axis (or either section) that the file omits keeps the value from defaultAccelerationProfile.
+def loadAccelerationProfile(inputAccelerationProfileFile):
+    x = hjson.load(inputAccelerationProfileFile)
+    return AccelerationProfile(
+        maxAcceleration=dict(defaultAccelerationProfile.maxAcceleration, **{axis: float(value) for axis, value in x.get('max_acceleration_mm_per_s2', {}).items()}),
+        maxSpeedChange=dict(defaultAccelerationProfile.maxSpeedChange, **{axis: float(value) for axis, value in x.get('max_speed_change_mm_per_s', {}).items()})
+    )
+
+# returns a dict mapping each of the feedrates that appear in the extrusion profiles of miraclegrueConfig to the sorted list of the names of those profiles.
+def getExtrusionProfileNamesByFeedrate(miraclegrueConfig):
+    namesByFeedrate = {}
+    for extruderProfile in miraclegrueConfig.get('extruderProfiles', []):
+        for name, extrusionProfile in extruderProfile.get('extrusionProfiles', {}).items():
+            if 'feedrate' in extrusionProfile:
+                namesByFeedrate.setdefault(float(extrusionProfile['feedrate']), set()).add(name)
+    return {feedrate: sorted(names) for feedrate, names in namesByFeedrate.items()}
+
+
+# returns, for each move of toolpathArrays, its length (mm) and the unit vector (an n x 4 array, over axes) of its direction.
+# As in ToolpathArrays.getStatistics(), each move goes in a straight line from the endpoint of the previous move.  A move that moves
+# only the extruder (a retract or a restart) has the length of its extruder motion.
+def getMoveGeometry(toolpathArrays):
+    deltas = numpy.stack([numpy.diff(getattr(toolpathArrays, axis), prepend=getattr(toolpathArrays, axis)[:1]) for axis in axes], axis=1)
+    spatialLength = numpy.sqrt(numpy.sum(deltas[:, :3]**2, axis=1))
+    length = numpy.where(spatialLength > 0, spatialLength, numpy.abs(deltas[:, 3]))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        direction = numpy.where(length[:, None] > 0, deltas / length[:, None], 0)
+    return (length, direction)
+
+# returns the duration (s) of each move, and a boolean array that is true for the moves that never reach their commanded feedrate, for the
+# given feedrates (mm/s, one per move).
+def getMoveDurations(length, direction, feedrate, accelerationProfile):
+    maxAcceleration = numpy.array([accelerationProfile.maxAcceleration[axis] for axis in axes])
+    maxSpeedChange = numpy.array([accelerationProfile.maxSpeedChange[axis] for axis in axes])
+    isMotion = (length > 0) & (feedrate > 0)
+    cruiseSpeed = numpy.where(isMotion, feedrate, 0)
+    # the acceleration along the move is limited by whichever axis reaches its limit first.
+    with numpy.errstate(divide='ignore'):
+        acceleration = numpy.min(numpy.where(direction != 0, maxAcceleration / numpy.abs(direction), numpy.inf), axis=1)
+    acceleration = numpy.where(isMotion & numpy.isfinite(acceleration), acceleration, 1.0)
+
+    # the junction limit at the start of each move (junctionLimit[i] is the speed at which move i - 1 may hand over to move i, and
+    # junctionLimit[moveCount] is the speed at the end of the last move, at which the machine must be at rest).
+    # At speed v through the junction, axis k changes speed by v * |direction[i, k] - direction[i - 1, k]|.
+    previousDirection = numpy.vstack([numpy.zeros((1, len(axes))), direction[:-1]])
+    speedChangePerUnitSpeed = numpy.abs(direction - previousDirection)
+    with numpy.errstate(divide='ignore'):
+        junctionLimit = numpy.min(numpy.where(speedChangePerUnitSpeed > 0, maxSpeedChange / speedChangePerUnitSpeed, numpy.inf), axis=1)
+    previousCruiseSpeed = numpy.concatenate(([0], cruiseSpeed[:-1]))
+    junctionLimit = numpy.minimum(junctionLimit, numpy.minimum(cruiseSpeed, previousCruiseSpeed))
+    # (a move that goes nowhere has a cruise speed of 0, so the machine comes to rest there.)
+    junctionLimit = numpy.concatenate((junctionLimit, [0]))
+
+    # forward pass: u[i] (the squared speed at junction i) <= u[i - 1] + 2 * acceleration[i - 1] * length[i - 1], which, with S the prefix sums of
+    # the 2 * acceleration * length terms, is u[i] = S[i] + min over j <= i of (junctionLimit[j]^2 - S[j]).
+    gain = numpy.concatenate(([0], numpy.cumsum(2 * acceleration * numpy.where(isMotion, length, 0))))
+    limitSquared = numpy.minimum(junctionLimit, 1e9)**2
+    forward = gain + numpy.minimum.accumulate(limitSquared - gain)
+    # backward pass: the same recurrence, run from the end.
+    backward = (gain[-1] - gain) + numpy.minimum.accumulate((limitSquared - (gain[-1] - gain))[::-1])[::-1]
+    junctionSpeedSquared = numpy.maximum(numpy.minimum(forward, backward), 0)
+
+    entrySquared = junctionSpeedSquared[:-1]
+    exitSquared = junctionSpeedSquared[1:]
+    cruiseSquared = cruiseSpeed**2
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        accelerationDistance = (cruiseSquared - entrySquared) / (2 * acceleration)
+        decelerationDistance = (cruiseSquared - exitSquared) / (2 * acceleration)
+        reachesCruiseSpeed = accelerationDistance + decelerationDistance <= length
+        peakSpeed = numpy.where(reachesCruiseSpeed, cruiseSpeed, numpy.sqrt(numpy.maximum(acceleration * length + (entrySquared + exitSquared) / 2, 0)))
+        rampTime = (2 * peakSpeed - numpy.sqrt(entrySquared) - numpy.sqrt(exitSquared)) / acceleration
+        cruiseTime = numpy.where(reachesCruiseSpeed, (length - accelerationDistance - decelerationDistance) / cruiseSpeed, 0)
+        duration = numpy.where(isMotion, rampTime + cruiseTime, 0)
+    return (duration, isMotion & ~reachesCruiseSpeed)
+
+# returns the index (into list(tagClasses) + [otherTagClass]) of the tag class of each of the tag sets of toolpathArrays.
+def getTagClassIdsOfTagSets(tagSets):
+    tagClassNames = list(tagClasses)
+    return numpy.array(
+        [
+            next((tagClassNames.index(name) for name, tags in tagClasses.items() if any(tag in tagSet for tag in tags)), len(tagClassNames))
+            for tagSet in tagSets
+        ] or [len(tagClassNames)],
+        dtype=numpy.int64
+    )
+
+
+# returns the estimate for toolpathArrays, as a json-compatible dict.
+# extrusionProfileNamesByFeedrate (see getExtrusionProfileNamesByFeedrate()) is used to label the feedrates of the breakdown.
+# metadataDuration, if given, is the duration_s of the slicer's metadata, which we report alongside the estimate, with the ratio of the two.
+def estimatePrintTime(toolpathArrays, accelerationProfile=defaultAccelerationProfile, extrusionProfileNamesByFeedrate=dict(), metadataDuration=None):
+    length, direction = getMoveGeometry(toolpathArrays)
+    feedrate = numpy.asarray(toolpathArrays.feedrate, dtype=numpy.float64)
+    duration, isAccelerationLimited = getMoveDurations(length, direction, feedrate, accelerationProfile)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        commandedDuration = numpy.where((length > 0) & (feedrate > 0), length / feedrate, 0)
+    isExtruding = (direction[:, 3] > 0) & (numpy.sum(direction[:, :3]**2, axis=1) > 0)
+
+    layerNumbers = toolpathArrays.getLayerNumbersOfMoves()
+    layerStartCommandIndices, upperPositions = toolpathArrays.getLayers()
+    layerCount = len(layerStartCommandIndices) + 1
+    layerDuration = numpy.bincount(layerNumbers, weights=duration, minlength=layerCount)
+    layerCommandedDuration = numpy.bincount(layerNumbers, weights=commandedDuration, minlength=layerCount)
+    layerAccelerationLimitedDuration = numpy.bincount(layerNumbers, weights=numpy.where(isAccelerationLimited, duration, 0), minlength=layerCount)
+    layers = [
+        {
+            'layer': layerNumber,
+            'upper_position': (float(upperPositions[layerNumber - 1]) if layerNumber > 0 else None),
+            'duration_s': float(layerDuration[layerNumber]),
+            'commanded_duration_s': float(layerCommandedDuration[layerNumber]),
+            'acceleration_limited_fraction': (float(layerAccelerationLimitedDuration[layerNumber] / layerDuration[layerNumber]) if layerDuration[layerNumber] > 0 else 0.0),
+            'limited_by': ("acceleration" if layerAccelerationLimitedDuration[layerNumber] > layerDuration[layerNumber] / 2 else "feedrate")
+        }
+        for layerNumber in range(layerCount)
+        if layerNumber > 0 or numpy.any(layerNumbers == 0)
+    ]
+
+    tagClassNames = list(tagClasses) + [otherTagClass]
+    tagClassIds = getTagClassIdsOfTagSets(toolpathArrays.tagSets)[toolpathArrays.tagSetIds]
+    tagClassDuration = numpy.bincount(tagClassIds, weights=duration, minlength=len(tagClassNames))
+    tagClassCommandedDuration = numpy.bincount(tagClassIds, weights=commandedDuration, minlength=len(tagClassNames))
+    byTagClass = collections.OrderedDict(
+        (name, {'duration_s': float(tagClassDuration[i]), 'commanded_duration_s': float(tagClassCommandedDuration[i])})
+        for i, name in enumerate(tagClassNames)
+        if tagClassDuration[i] > 0 or tagClassCommandedDuration[i] > 0
+    )
+
+    # the breakdown by feedrate covers the extruding moves (the travel moves and retracts run at the machine's own rates, not at an extrusion profile's).
+    feedrates, feedrateIds = numpy.unique(numpy.where(isExtruding, feedrate, -1), return_inverse=True)
+    byFeedrate = []
+    for feedrateId, thisFeedrate in enumerate(feedrates.tolist()):
+        if thisFeedrate < 0:
+            continue
+        isThisFeedrate = (feedrateIds == feedrateId)
+        # the effect of raising this feedrate alone.
+        fasterDuration, _ = getMoveDurations(length, direction, numpy.where(isThisFeedrate, feedrate * feedrateSensitivityFactor, feedrate), accelerationProfile)
+        byFeedrate.append({
+            'feedrate_mm_per_s': thisFeedrate,
+            'extrusion_profiles': extrusionProfileNamesByFeedrate.get(thisFeedrate, []),
+            'move_count': int(numpy.count_nonzero(isThisFeedrate)),
+            'duration_s': float(numpy.sum(duration[isThisFeedrate])),
+            'commanded_duration_s': float(numpy.sum(commandedDuration[isThisFeedrate])),
+            'acceleration_limited_fraction': float(numpy.count_nonzero(isAccelerationLimited & isThisFeedrate) / numpy.count_nonzero(isThisFeedrate)),
+            'seconds_saved_by_raising_feedrate': float(numpy.sum(duration) - numpy.sum(fasterDuration))
+        })
+
+    estimate = {
+        'acceleration_profile': {'max_acceleration_mm_per_s2': accelerationProfile.maxAcceleration, 'max_speed_change_mm_per_s': accelerationProfile.maxSpeedChange},
+        'duration_s': float(numpy.sum(duration)),
+    }
+    if metadataDuration:
+        estimate['metadata_duration_s'] = float(metadataDuration)
+        estimate['duration_to_metadata_duration_ratio'] = estimate['duration_s'] / float(metadataDuration)
+    estimate.update({
+        'commanded_duration_s': float(numpy.sum(commandedDuration)),
+        'feedrate_sensitivity_factor': feedrateSensitivityFactor,
+        'by_tag_class': byTagClass,
+        'by_feedrate': byFeedrate,
+        'layers': layers
+    })
+    return estimate
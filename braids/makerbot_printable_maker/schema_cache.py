@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import re
+import subprocess
+import tempfile
+
+import slice_cache
+
+
+# The config schema that miracle_grue reports (miracle_grue --config-schema) only changes when the MakerWare install changes, but
+# fetching it costs a miracle_grue process and the json-parsing of a large document.  A SchemaCache is a directory in which we keep
+# the schema of each slicer that we have seen, in pickled (i.e. pre-parsed, fast-loading) form.
+#
+# An entry is keyed by the slicer's identity (the resolved path, size, and modification time of the executable) together with the output of
+# miracle_grue --version-json.  So that a warm lookup needs no subprocess at all, we also remember the version reported by each
+# slicer identity, in a small json file alongside the entries; a slicer executable that has been replaced (or touched) has a new
+# identity, and so is asked for its version afresh.
+#
+# The cache can be seeded with schemas that we already have on disk (by default, the research/miracle_grue_<version>_config_schema.json
+# files that live alongside this script): on a miss, if the version reported by the slicer matches one of the seed schemas, we use that
+# seed rather than running miracle_grue --config-schema.
+class SchemaCache:
+    def __init__(self, directory, seedSchemaPaths=None):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.seedSchemaPaths = (getDefaultSeedSchemaPaths() if seedSchemaPaths is None else seedSchemaPaths)
+
+    # returns the config schema (a dict) of the miracle_grue executable at miraclegrueExecutablePath.
+    def getSchema(self, miraclegrueExecutablePath):
+        slicerIdentity = slice_cache.getSlicerIdentity(miraclegrueExecutablePath)
+        slicerVersion = self.getSlicerVersion(miraclegrueExecutablePath, slicerIdentity)
+
+        entryPath = self.directory.joinpath(computeSchemaCacheKey(slicerIdentity, slicerVersion) + ".pickle")
+        try:
+            with open(entryPath, 'rb') as entryFile:
+                return pickle.load(entryFile)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+        seedSchemaPath = self.seedSchemaPaths.get(parseVersionNumber(slicerVersion))
+        if seedSchemaPath:
+            schema = json.load(open(seedSchemaPath, 'r'))
+        else:
+            schema = getConfigSchema(miraclegrueExecutablePath)
+        self.writeAtomically(entryPath, pickle.dumps(schema, protocol=pickle.HIGHEST_PROTOCOL))
+        return schema
+
+    # returns the output of miracle_grue --version-json for the slicer having the given identity, running miracle_grue only
+    # if we have not already recorded the version for that identity.
+    def getSlicerVersion(self, miraclegrueExecutablePath, slicerIdentity):
+        versionPath = self.directory.joinpath(hashlib.sha256(getCanonicalJson(slicerIdentity).encode('utf-8')).hexdigest() + ".version.json")
+        try:
+            return json.load(open(versionPath, 'r'))['slicerVersion']
+        except (OSError, ValueError, KeyError):
+            pass
+        slicerVersion = slice_cache.getSlicerVersion(miraclegrueExecutablePath)
+        self.writeAtomically(versionPath, json.dumps({'slicerIdentity': slicerIdentity, 'slicerVersion': slicerVersion}, indent=4).encode('utf-8'))
+        return slicerVersion
+
+    # writes content (bytes) to a temporary file in the cache directory and then renames it into place, so that a concurrent
+    # reader never sees a half-written file.
+    def writeAtomically(self, path, content):
+        fileDescriptor, temporaryPath = tempfile.mkstemp(dir=self.directory, prefix=".incomplete-")
+        try:
+            with os.fdopen(fileDescriptor, 'wb') as temporaryFile:
+                temporaryFile.write(content)
+            os.replace(temporaryPath, path)
+        except OSError:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            raise
+
+
+def getCanonicalJson(x):
+    return json.dumps(x, sort_keys=True, separators=(',', ':'))
+
+def computeSchemaCacheKey(slicerIdentity, slicerVersion):
+    return hashlib.sha256(
+        (getCanonicalJson(slicerIdentity) + "\n" + str(slicerVersion)).encode('utf-8')
+    ).hexdigest()
+
+# returns the first dotted version number (e.g. "5.31.0") appearing in versionText (the output of miracle_grue --version-json), or None.
+def parseVersionNumber(versionText):
+    match = re.search(pattern='[0-9]+(\\.[0-9]+)+', string=str(versionText))
+    return (match.group(0) if match else None)
+
+# returns a dict mapping version number to the path of a schema file, for each of the miracle_grue_<version>_config_schema.json files in
+# the research folder.
+def getDefaultSeedSchemaPaths():
+    seedSchemaPaths = dict()
+    for path in pathlib.Path(__file__).resolve().parent.joinpath("research").glob("miracle_grue_*_config_schema.json"):
+        version = parseVersionNumber(path.name)
+        if version:
+            seedSchemaPaths[version] = path
+    return seedSchemaPaths
+
+# runs miracle_grue --config-schema and returns the (parsed) schema.
+def getConfigSchema(miraclegrueExecutablePath):
+    process = subprocess.run(
+        args=[
+            str(miraclegrueExecutablePath),
+            "--config-schema"
+        ],
+        capture_output = True
+    )
+    if process.returncode != 0:
+        raise RuntimeError("miracle_grue --config-schema failed with return code " + str(process.returncode) + ".")
+    return json.loads(process.stdout)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import artifact_staging
+
+
+# A SliceCache is a directory of previously-produced miracle_grue outputs (jsontoolpath, gcode, metadata, and log), keyed by
+# a hash of everything that determines those outputs:
+#   - the bytes of the model (.thing) file,
+#   - the canonical (sorted-key, compact) json serialization of the (transformed) miraclegrue config, and
+#   - the output of miracle_grue --version-json.
+# Thus, a change to the config file or to the transform that does not change the effective config does not cause a re-slice.
+#
+# Each entry is a subdirectory (named by the key) containing one file per artifact.  Entries are written into a temporary
+# directory and then renamed into place, so that a half-written entry is never visible.  The modification time of an entry's
+# directory is bumped on every hit, and, whenever an entry is added, the least-recently-used entries are evicted until the total
+# size of the cache is no more than maxSizeBytes.
+class SliceCache:
+    artifactNames = ("jsontoolpath", "gcode", "metadata", "log")
+
+    def __init__(self, directory, maxSizeBytes):
+        self.directory = pathlib.Path(directory)
+        self.maxSizeBytes = maxSizeBytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def getEntryPath(self, key):
+        return self.directory.joinpath(key)
+
+    # returns a dict mapping artifact name to the path of the cached artifact, or None if there is no entry for key.
+    def get(self, key):
+        entryPath = self.getEntryPath(key)
+        if not entryPath.is_dir():
+            return None
+        artifactPaths = {
+            name: entryPath.joinpath(name)
+            for name in self.artifactNames
+            if entryPath.joinpath(name).is_file()
+        }
+        now = time.time()
+        os.utime(entryPath, (now, now))
+        return artifactPaths
+
+    # artifactPaths is a dict mapping artifact name (one of artifactNames) to the path of a file to be copied into the cache.
+    def put(self, key, artifactPaths):
+        entryPath = self.getEntryPath(key)
+        if entryPath.is_dir():
+            return
+        temporaryEntryPath = pathlib.Path(tempfile.mkdtemp(dir=self.directory, prefix=".incomplete-"))
+        # mkdtemp() creates the directory accessible only by its owner; we want the cache to be shareable.
+        os.chmod(temporaryEntryPath, 0o755)
+        try:
+            for name, path in artifactPaths.items():
+                if name not in self.artifactNames:
+                    raise ValueError("unknown slice cache artifact name: " + str(name))
+                # (we link, rather than copy, where the filesystem allows, since neither the cache entries nor the staged artifacts are ever modified in place.)
+                artifact_staging.linkOrCopyFile(path, temporaryEntryPath.joinpath(name))
+            os.replace(temporaryEntryPath, entryPath)
+        except OSError:
+            shutil.rmtree(temporaryEntryPath, ignore_errors=True)
+            # another process might have put the same entry in the meantime, in which case we have nothing to do.
+            if not entryPath.is_dir():
+                raise
+        self.evict()
+
+    # returns a list of (lastUsedTime, size, entryPath) tuples, one per entry.
+    def getEntries(self):
+        entries = []
+        for entryPath in self.directory.iterdir():
+            if not entryPath.is_dir() or entryPath.name.startswith("."):
+                continue
+            size = sum(path.stat().st_size for path in entryPath.iterdir() if path.is_file())
+            entries.append((entryPath.stat().st_mtime, size, entryPath))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.getEntries(), key=lambda entry: entry[0])
+        totalSize = sum(size for (lastUsedTime, size, entryPath) in entries)
+        for (lastUsedTime, size, entryPath) in entries:
+            if totalSize <= self.maxSizeBytes:
+                break
+            shutil.rmtree(entryPath, ignore_errors=True)
+            totalSize -= size
+
+
+# returns the canonical serialization of a miraclegrue config, which is used both in computing the slice cache key
+# and for detecting that two configs are effectively identical.
+def getCanonicalConfigJson(miraclegrueConfig):
+    return json.dumps(miraclegrueConfig, sort_keys=True, separators=(',', ':'))
+
+
+def computeSliceCacheKey(modelFilePath, miraclegrueConfig, slicerVersion):
+    hasher = hashlib.sha256()
+    for part in (
+        open(modelFilePath, 'rb').read(),
+        getCanonicalConfigJson(miraclegrueConfig).encode('utf-8'),
+        str(slicerVersion).encode('utf-8')
+    ):
+        # prefix each part with its length so that the boundaries between the parts are unambiguous.
+        hasher.update(str(len(part)).encode('ascii') + b":")
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+# returns a dict that identifies the slicer executable (for the purposes of the schema cache, and of the memoization of getSlicerVersion()).
+def getSlicerIdentity(miraclegrueExecutablePath):
+    resolvedPath = pathlib.Path(miraclegrueExecutablePath).resolve()
+    stat = resolvedPath.stat()
+    return {
+        'path': str(resolvedPath),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+# the slicer versions that getSlicerVersion() has already obtained in this process, keyed by the (canonical json of the) identity of the executable,
+# so that we run miracle_grue --version-json once per slicer, rather than once per job.  A slicer executable that has been replaced (or
+# touched) has a new identity, and so is asked for its version afresh.
+slicerVersions = {}
+slicerVersionsLock = threading.Lock()
+
+# returns the output of miracle_grue --version-json, which identifies the slicer for the purposes of the slice cache.
+def getSlicerVersion(miraclegrueExecutablePath):
+    identityKey = json.dumps(getSlicerIdentity(miraclegrueExecutablePath), sort_keys=True)
+    # (we hold the lock while miracle_grue runs, so that concurrent jobs wait for the one process, rather than each starting their own.)
+    with slicerVersionsLock:
+        if identityKey not in slicerVersions:
+            slicerVersions[identityKey] = runSlicerVersion(miraclegrueExecutablePath)
+        return slicerVersions[identityKey]
+
+def runSlicerVersion(miraclegrueExecutablePath):
+    process = subprocess.run(
+        args=[
+            str(miraclegrueExecutablePath),
+            "--version-json"
+        ],
+        capture_output = True,
+        text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError("miracle_grue --version-json failed with return code " + str(process.returncode) + ".")
+    return process.stdout.strip()
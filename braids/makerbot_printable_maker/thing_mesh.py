@@ -0,0 +1,210 @@
+import collections
+import json
+import mmap
+import os
+import pathlib
+import re
+import struct
+import zipfile
+import numpy
+
+
+# A .thing file is a zip archive holding a manifest.json and one or more meshes (as STL files).  The manifest lists the "instances" of the
+# model, each of which places one of the meshes (its "object") on the build platform by way of a 4x4 "transformation" matrix, in mm.
+#
+# We read the (binary) STL of each instance without parsing it: the triangle records are viewed in place, as a numpy structured array
+# (see stlTriangleDtype), over the bytes of the archive member.  If the member is stored (uncompressed), the view is of the memory-mapped
+# .thing file itself; if it is deflated (as it is in the .thing files that MakerBot Print writes), we inflate it once, into a single
+# buffer, and view that.  Either way, no triangle is copied or parsed individually, and everything that we compute from the triangles
+# (see analyzeThing()) is computed with whole-array operations, so that a mesh of tens of thousands of triangles is analyzed in
+# milliseconds, i.e. well before there would be any point in handing it to the slicer.
+
+# the layout of a triangle record in a binary STL (which follows an 80-byte header and a uint32 triangle count).
+stlTriangleDtype = numpy.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attributeByteCount', '<u2')
+])
+stlHeaderSize = 84
+zipLocalFileHeaderStruct = struct.Struct("<4s5H3I2H")
+
+# the extent of the build volume of each kind of bot (as named by the "_bot" entry of the miraclegrue config), in mm.  The build volume is
+# centered on the origin in x and y, and extends upward from the platform (z = 0).
+BuildVolume = collections.namedtuple("BuildVolume", ["x", "y", "z"])
+buildVolumes = {
+    'replicator_5': BuildVolume(x=252.0, y=199.0, z=150.0),
+    'replicator_b': BuildVolume(x=295.0, y=195.0, z=165.0),
+    'z18_6': BuildVolume(x=300.0, y=305.0, z=457.0),
+}
+
+# (a model that extends beyond the build volume by no more than this, in mm, is taken to fit; the transformations that MakerBot Print
+# writes are only single-precision, so a model placed flush against the platform may end up a hair below it.)
+buildVolumeTolerance = 0.001
+
+# triangles whose area (in mm^2) is no more than this are counted as degenerate.
+degenerateTriangleArea = 1e-6
+
+
+# ThingInstance is one instance of a .thing: the name of its mesh within the archive, the triangles of the mesh (a numpy array of
+# stlTriangleDtype, in the mesh's own coordinates), and the transformation (a 4x4 numpy array) that places it on the platform.
+ThingInstance = collections.namedtuple("ThingInstance", ["name", "objectName", "triangles", "transformation"])
+
+
+# returns the triangles of the STL data in buffer (a bytes-like object) as a numpy array of stlTriangleDtype.
+# For a binary STL, the array is a view of buffer.  (We also accept an ASCII STL, which we have to parse, with the normals left as zero.)
+def getStlTriangles(buffer, name="STL"):
+    if len(buffer) >= stlHeaderSize:
+        triangleCount = struct.unpack_from("<I", buffer, 80)[0]
+        if len(buffer) == stlHeaderSize + triangleCount * stlTriangleDtype.itemsize:
+            return numpy.frombuffer(buffer, dtype=stlTriangleDtype, count=triangleCount, offset=stlHeaderSize)
+    if bytes(buffer[:5]).lower() == b"solid":
+        coordinates = re.findall(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)", bytes(buffer))
+        if len(coordinates) % 3 == 0:
+            triangles = numpy.zeros(len(coordinates) // 3, dtype=stlTriangleDtype)
+            triangles['vertices'] = numpy.array(coordinates, dtype=numpy.float32).reshape(-1, 3, 3)
+            return triangles
+    raise ValueError(name + " is neither a binary STL nor an ASCII STL.")
+
+# returns the data of the member of zipFile (an open zipfile.ZipFile, of the file at zipFilePath) having the given name, as a bytes-like object.
+# A stored member is returned as a memoryview of the memory-mapped file (which stays mapped for as long as anything refers to it).
+def getZipMemberBuffer(zipFile, zipFilePath, name):
+    info = zipFile.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        with open(zipFilePath, 'rb') as file:
+            mappedFile = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        localHeader = zipLocalFileHeaderStruct.unpack_from(mappedFile, info.header_offset)
+        # (the name and extra field of the local header need not match those of the central directory, so we take their lengths from the local header.)
+        dataOffset = info.header_offset + zipLocalFileHeaderStruct.size + localHeader[-2] + localHeader[-1]
+        return memoryview(mappedFile)[dataOffset:dataOffset + info.file_size]
+    return zipFile.read(name)
+
+# returns the list of the ThingInstances of the .thing file at thingFilePath.  Instances of the same mesh share its triangles.
+# (miracle_grue also accepts a bare STL file, which we take to be a single instance, placed as it is.)
+def loadThing(thingFilePath):
+    if not zipfile.is_zipfile(thingFilePath):
+        with open(thingFilePath, 'rb') as file:
+            mappedFile = (mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size else b"")
+        return [ThingInstance(name="instance1", objectName=pathlib.Path(thingFilePath).name, triangles=getStlTriangles(mappedFile, name=str(thingFilePath)), transformation=numpy.identity(4))]
+    instances = []
+    with zipfile.ZipFile(thingFilePath) as zipFile:
+        manifest = json.loads(zipFile.read("manifest.json"))
+        trianglesByObjectName = {}
+        for name, instance in sorted(manifest.get("instances", {}).items()):
+            objectName = instance["object"]
+            if objectName not in trianglesByObjectName:
+                trianglesByObjectName[objectName] = getStlTriangles(getZipMemberBuffer(zipFile, thingFilePath, objectName), name=objectName)
+            transformation = numpy.identity(4)
+            if instance.get("xform"):
+                transformation = numpy.array(manifest["transformations"][instance["xform"]]["matrix"], dtype=numpy.float64)
+            if instance.get("scale", "mm") != "mm":
+                raise ValueError("the instance " + name + " of " + str(thingFilePath) + " has units of " + str(instance["scale"]) + ", rather than mm.")
+            instances.append(ThingInstance(name=name, objectName=objectName, triangles=trianglesByObjectName[objectName], transformation=transformation))
+    if not instances:
+        raise ValueError(str(thingFilePath) + " has no instances.")
+    return instances
+
+# returns the vertices of the triangles of instance, in platform coordinates, as an (n, 3, 3) float64 array (triangle, vertex, axis).
+def getPlatformVertices(instance):
+    return instance.triangles['vertices'].astype(numpy.float64) @ instance.transformation[:3, :3].T + instance.transformation[:3, 3]
+
+# returns the vertices of triangles (a numpy array of stlTriangleDtype) as an (n, 3) int64 array of vertex ids (numbered from 0), identifying
+# coincident vertices (i.e. those having exactly the same coordinates) with one another.
+def getVertexIds(triangles):
+    # (adding 0.0 turns -0.0 into 0.0, so that vertices that differ only in the sign of a zero coordinate are identified.)
+    vertices = (triangles['vertices'] + numpy.float32(0.0)).reshape(-1, 3)
+    vertexIds = numpy.zeros(len(vertices), dtype=numpy.int64)
+    if len(vertices):
+        order = numpy.lexsort(vertices.T)
+        sortedVertices = vertices[order]
+        vertexIds[order[1:]] = numpy.cumsum(numpy.any(sortedVertices[1:] != sortedVertices[:-1], axis=1))
+    return vertexIds.reshape(-1, 3)
+
+# returns a boolean array that is true for each row of rows (a 2-dimensional integer array) that is equal to an earlier row.
+def getRepeatedRows(rows):
+    order = numpy.lexsort(rows.T)
+    sortedRows = rows[order]
+    repeated = numpy.zeros(len(rows), dtype=bool)
+    repeated[order[1:]] = numpy.all(sortedRows[1:] == sortedRows[:-1], axis=1)
+    return repeated
+
+def getBoundingBox(vertices):
+    minimum = vertices.reshape(-1, 3).min(axis=0)
+    maximum = vertices.reshape(-1, 3).max(axis=0)
+    return {
+        'x_min': float(minimum[0]), 'x_max': float(maximum[0]),
+        'y_min': float(minimum[1]), 'y_max': float(maximum[1]),
+        'z_min': float(minimum[2]), 'z_max': float(maximum[2]),
+    }
+
+# returns a dict describing the mesh of instance:
+#   triangle_count, bounding_box (in platform coordinates, in the same form as the bounding_box of the slicer's metadata),
+#   volume_mm3 (the signed volume enclosed by the mesh: negative if the triangles are wound inside out, and meaningless if the mesh is not closed),
+#   surface_area_mm2,
+#   degenerate_triangle_count (triangles having no area to speak of),
+#   duplicate_triangle_count (triangles having the same vertices as an earlier triangle, in whatever order),
+#   boundary_edge_count (edges belonging to only one triangle; a closed mesh has none), and
+#   non_manifold_edge_count (edges shared by more than two triangles).
+def analyzeInstance(instance):
+    vertices = getPlatformVertices(instance)
+    crossProducts = numpy.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+    areas = 0.5 * numpy.sqrt(numpy.einsum('ij,ij->i', crossProducts, crossProducts))
+    # (by the divergence theorem, the enclosed volume is the sum of the signed volumes of the tetrahedra that the triangles form with the origin.)
+    volume = numpy.einsum('ij,ij->i', vertices[:, 0], numpy.cross(vertices[:, 1], vertices[:, 2])).sum() / 6
+
+    vertexIds = numpy.sort(getVertexIds(instance.triangles), axis=1)
+    # (we identify each edge by the ids of its two vertices, lower first, combined into one integer.)
+    edges = numpy.concatenate([vertexIds[:, [0, 1]], vertexIds[:, [1, 2]], vertexIds[:, [0, 2]]])
+    _, edgeUseCounts = numpy.unique(edges[:, 0] * (int(vertexIds.max(initial=0)) + 1) + edges[:, 1], return_counts=True)
+
+    return {
+        'triangle_count': len(instance.triangles),
+        'bounding_box': (getBoundingBox(vertices) if len(vertices) else None),
+        'volume_mm3': float(volume),
+        'surface_area_mm2': float(areas.sum()),
+        'degenerate_triangle_count': int(numpy.count_nonzero(areas <= degenerateTriangleArea)),
+        'duplicate_triangle_count': int(numpy.count_nonzero(getRepeatedRows(vertexIds))),
+        'boundary_edge_count': int(numpy.count_nonzero(edgeUseCounts == 1)),
+        'non_manifold_edge_count': int(numpy.count_nonzero(edgeUseCounts > 2)),
+    }
+
+# returns a list of the problems (as strings) that would prevent the model having the given boundingBox from being printed within buildVolume.
+def getBuildVolumeProblems(boundingBox, buildVolume):
+    problems = []
+    for axis in ['x', 'y', 'z']:
+        size = boundingBox[axis + '_max'] - boundingBox[axis + '_min']
+        lowerLimit, upperLimit = ((0.0, buildVolume.z) if axis == 'z' else (-getattr(buildVolume, axis) / 2, getattr(buildVolume, axis) / 2))
+        if size > upperLimit - lowerLimit + buildVolumeTolerance:
+            problems.append("the model is " + format(size, ".2f") + " mm in " + axis + ", but the build volume is only " + format(upperLimit - lowerLimit, ".2f") + " mm.")
+        elif boundingBox[axis + '_min'] < lowerLimit - buildVolumeTolerance or boundingBox[axis + '_max'] > upperLimit + buildVolumeTolerance:
+            problems.append(
+                "the model spans " + format(boundingBox[axis + '_min'], ".2f") + " to " + format(boundingBox[axis + '_max'], ".2f") + " mm in " + axis
+                + ", which is outside the build volume (" + format(lowerLimit, ".2f") + " to " + format(upperLimit, ".2f") + " mm)."
+            )
+    return problems
+
+# returns a dict describing the model in the .thing file at thingFilePath: the analysis (see analyzeInstance()) of each of its instances
+# (under "instances"), the overall bounding box, triangle count, and volume, and, if botType is one of buildVolumes, the build volume
+# and a list of the problems that would prevent the model from being printed on that bot (under "problems", which is empty if there are none).
+# Raises ValueError if the file is not a readable .thing.
+def analyzeThing(thingFilePath, botType=None):
+    instanceAnalyses = {instance.name: analyzeInstance(instance) for instance in loadThing(thingFilePath)}
+    boundingBoxes = [instanceAnalysis['bounding_box'] for instanceAnalysis in instanceAnalyses.values() if instanceAnalysis['bounding_box']]
+    analysis = {
+        'triangle_count': sum(instanceAnalysis['triangle_count'] for instanceAnalysis in instanceAnalyses.values()),
+        'volume_mm3': sum(instanceAnalysis['volume_mm3'] for instanceAnalysis in instanceAnalyses.values()),
+        'bounding_box': (
+            {
+                key: (min if key.endswith('_min') else max)(boundingBox[key] for boundingBox in boundingBoxes)
+                for key in boundingBoxes[0]
+            } if boundingBoxes else None
+        ),
+        'instances': instanceAnalyses,
+        'bot_type': botType,
+        'build_volume': (buildVolumes[botType]._asdict() if botType in buildVolumes else None),
+        'problems': []
+    }
+    if not analysis['bounding_box']:
+        analysis['problems'].append("the model has no triangles.")
+    elif botType in buildVolumes:
+        analysis['problems'].extend(getBuildVolumeProblems(analysis['bounding_box'], buildVolumes[botType]))
+    return analysis
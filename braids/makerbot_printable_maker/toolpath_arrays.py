@@ -0,0 +1,261 @@
+import array
+import numpy
+import jsontoolpath
+
+
+# ToolpathArrays is a columnar ("struct of arrays") representation of a jsontoolpath.
+# In a jsontoolpath, the overwhelming majority of the commands are "move" commands, each of which, once parsed by json.load(),
+# becomes a handful of nested dicts and a list of tags, costing on the order of a kilobyte of memory per move.
+# Here, the move commands are stored as parallel numpy arrays (one element per move):
+#   x, y, z, a, feedrate    float64 (float64 rather than float32 so that the values survive the round trip
+#                           exactly, which is necessary in order for the generated gcode to match the gcode produced
+#                           by jsontoolpath.generatePreviewableGcode() character for character.)
+#   tagSetIds               uint16 index into tagSets, which is a list of the distinct (ordered) tuples of tags that occur in the toolpath.
+#   relativeFlags           uint8 bitmask of the axes (see relativeAxes) for which the move's metadata says "relative": true.
+#   moveCommandIndices      int64 position of each move within the original command stream.
+# All of the other commands (comments, set_toolhead_temperature, toggle_fan, fan_duty, ...), of which there are comparatively few,
+# are stored in a sparse table: otherCommandIndices (int64 position within the original command stream) and
+# otherCommands (the list of the corresponding command dicts, as they appeared in the jsontoolpath).
+# The arrays need not be contiguous (see binary_toolpath, which provides them as views of the records of a memory-mapped file).
+class ToolpathArrays:
+    relativeAxes = ('a', 'x', 'y', 'z')
+
+    # layers, if given, is what getLayers() would return (for a toolpath whose layers are already known, such as one loaded from a binarytoolpath file).
+    def __init__(self, x, y, z, a, feedrate, tagSetIds, tagSets, relativeFlags, moveCommandIndices, otherCommandIndices, otherCommands, layers=None):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.a = a
+        self.feedrate = feedrate
+        self.tagSetIds = tagSetIds
+        self.tagSets = tagSets
+        self.relativeFlags = relativeFlags
+        self.moveCommandIndices = moveCommandIndices
+        self.otherCommandIndices = otherCommandIndices
+        self.otherCommands = otherCommands
+        self.layers = layers
+
+    @property
+    def moveCount(self):
+        return len(self.x)
+
+    @property
+    def commandCount(self):
+        return len(self.moveCommandIndices) + len(self.otherCommandIndices)
+
+    @property
+    def nbytes(self):
+        return sum(
+            getattr(self, name).nbytes
+            for name in ('x', 'y', 'z', 'a', 'feedrate', 'tagSetIds', 'relativeFlags', 'moveCommandIndices', 'otherCommandIndices')
+        )
+
+    # returns a boolean array (one element per move) that is true for those moves that have the given tag.
+    def getMovesHavingTag(self, tag):
+        tagSetHasTag = numpy.array([tag in tagSet for tagSet in self.tagSets] or [False], dtype=bool)
+        return tagSetHasTag[self.tagSetIds]
+
+    # returns the comments, as a list of (commandIndex, comment) tuples.
+    def getComments(self):
+        return [
+            (int(commandIndex), command['parameters']['comment'])
+            for commandIndex, command in zip(self.otherCommandIndices, self.otherCommands)
+            if command and command['function'] == 'comment'
+        ]
+
+    # returns the command dict for the command at position commandIndex within the original command stream.
+    # This is meant for occasional random access -- iterating over the whole toolpath this way
+    # defeats the purpose of the columnar representation.
+    def getCommand(self, commandIndex):
+        i = numpy.searchsorted(self.otherCommandIndices, commandIndex)
+        if i < len(self.otherCommandIndices) and self.otherCommandIndices[i] == commandIndex:
+            return self.otherCommands[i]
+        j = numpy.searchsorted(self.moveCommandIndices, commandIndex)
+        if not (j < len(self.moveCommandIndices) and self.moveCommandIndices[j] == commandIndex):
+            raise IndexError("command index " + str(commandIndex) + " is out of range.")
+        return {
+            'function': 'move',
+            'metadata': {'relative': {axis: bool(int(self.relativeFlags[j]) & (1 << bitIndex)) for bitIndex, axis in enumerate(self.relativeAxes)}},
+            'parameters': {
+                'a': float(self.a[j]),
+                'feedrate': float(self.feedrate[j]),
+                'x': float(self.x[j]),
+                'y': float(self.y[j]),
+                'z': float(self.z[j])
+            },
+            'tags': list(self.tagSets[self.tagSetIds[j]])
+        }
+
+    # Detects layers the same way that jsontoolpath.generatePreviewableGcode() does: a new layer begins at each
+    # "Upper Position ..." comment whose value differs from that of the previous "Upper Position ..." comment.
+    # Returns a tuple (layerStartCommandIndices, upperPositions), both numpy arrays with one element per layer.
+    def getLayers(self):
+        if self.layers is not None:
+            return self.layers
+        upperPositionCommandIndices = []
+        upperPositions = []
+        for commandIndex, comment in self.getComments():
+            upperPosition = jsontoolpath.parseUpperPosition(comment)
+            if upperPosition is not None:
+                upperPositionCommandIndices.append(commandIndex)
+                upperPositions.append(upperPosition)
+        upperPositionCommandIndices = numpy.array(upperPositionCommandIndices, dtype=numpy.int64)
+        upperPositions = numpy.array(upperPositions, dtype=numpy.float64)
+        isNewLayer = numpy.ones(len(upperPositions), dtype=bool)
+        isNewLayer[1:] = upperPositions[1:] != upperPositions[:-1]
+        return (upperPositionCommandIndices[isNewLayer], upperPositions[isNewLayer])
+
+    # returns, for each move, the (1-based) number of the layer in which the move occurs, or 0 for moves that
+    # occur before the first layer.
+    def getLayerNumbersOfMoves(self):
+        layerStartCommandIndices, _ = self.getLayers()
+        return numpy.searchsorted(layerStartCommandIndices, self.moveCommandIndices, side='right')
+
+    # Computes summary statistics about the toolpath, in a handful of vectorized passes over the move arrays.
+    # The distances and durations are computed assuming that every move goes, in a straight line at the commanded feedrate,
+    # from the endpoint of the previous move (i.e. we ignore acceleration and we ignore the "relative" metadata, which, in practice,
+    # is always false in toolpaths produced by miracle_grue).
+    def getStatistics(self):
+        dx = numpy.diff(self.x, prepend=self.x[:1])
+        dy = numpy.diff(self.y, prepend=self.y[:1])
+        dz = numpy.diff(self.z, prepend=self.z[:1])
+        da = numpy.diff(self.a, prepend=self.a[:1])
+        distance = numpy.sqrt(dx*dx + dy*dy + dz*dz)
+        isExtruding = (da > 0) & (distance > 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            duration = numpy.where(self.feedrate > 0, numpy.maximum(distance, numpy.abs(da)) / self.feedrate, 0)
+        tagSetCounts = numpy.bincount(self.tagSetIds, minlength=len(self.tagSets))
+        tagCounts = {}
+        for tagSet, count in zip(self.tagSets, tagSetCounts.tolist()):
+            for tag in tagSet:
+                tagCounts[tag] = tagCounts.get(tag, 0) + count
+        layerStartCommandIndices, upperPositions = self.getLayers()
+        statistics = {
+            'command_count': self.commandCount,
+            'move_count': self.moveCount,
+            'layer_count': len(layerStartCommandIndices),
+            'tag_counts': dict(sorted(tagCounts.items())),
+            'extrusion_distance_mm': float(numpy.sum(numpy.clip(da, 0, None))),
+            'extruding_path_length_mm': float(numpy.sum(distance[isExtruding])),
+            'non_extruding_path_length_mm': float(numpy.sum(distance[~isExtruding])),
+            'commanded_duration_s': float(numpy.sum(duration)),
+        }
+        if numpy.any(isExtruding):
+            statistics['bounding_box'] = {
+                'x_min': float(numpy.min(self.x[isExtruding])), 'x_max': float(numpy.max(self.x[isExtruding])),
+                'y_min': float(numpy.min(self.y[isExtruding])), 'y_max': float(numpy.max(self.y[isExtruding])),
+                'z_min': float(numpy.min(self.z[isExtruding])), 'z_max': float(numpy.max(self.z[isExtruding]))
+            }
+        return statistics
+
+
+# builds a ToolpathArrays from a jsontoolpath.
+# inputJsontoolpathFile is a readable (text-mode) file-like object that is assumed to be a valid jsontoolpath file.
+# The toolpath is parsed incrementally (see jsontoolpath.iterateJsontoolpathItems()) and the move parameters are accumulated in
+# compact array.array buffers, so that at no point do we hold the whole toolpath in memory as python objects.
+def loadToolpathArrays(inputJsontoolpathFile, progressReportingCallback = None):
+    inputSize = jsontoolpath.getFileSize(inputJsontoolpathFile)
+    x = array.array('d'); y = array.array('d'); z = array.array('d'); a = array.array('d'); feedrate = array.array('d')
+    tagSetIds = array.array('H')
+    relativeFlags = array.array('B')
+    moveCommandIndices = array.array('q')
+    otherCommandIndices = array.array('q')
+    otherCommands = []
+    tagSets = []
+    tagSetIdsByTagSet = {}
+    relativeAxes = ToolpathArrays.relativeAxes
+    commandIndex = -1
+    for (startOffset, endOffset, item) in jsontoolpath.iterateJsontoolpathItems(inputJsontoolpathFile, withOffsets=True):
+        commandIndex += 1
+        command = item.get('command')
+        if command and command['function'] == 'move':
+            parameters = command['parameters']
+            x.append(parameters['x']); y.append(parameters['y']); z.append(parameters['z']); a.append(parameters['a']); feedrate.append(parameters['feedrate'])
+            tagSet = tuple(command['tags'])
+            tagSetId = tagSetIdsByTagSet.get(tagSet)
+            if tagSetId is None:
+                tagSetId = len(tagSets)
+                if tagSetId > 0xFFFF:
+                    raise ValueError("the toolpath contains more distinct sets of tags than can be represented by a uint16.")
+                tagSetIdsByTagSet[tagSet] = tagSetId
+                tagSets.append(tagSet)
+            tagSetIds.append(tagSetId)
+            relative = command['metadata'].get('relative', {})
+            relativeFlags.append(sum((1 << bitIndex) for bitIndex, axis in enumerate(relativeAxes) if relative.get(axis)))
+            moveCommandIndices.append(commandIndex)
+        else:
+            otherCommandIndices.append(commandIndex)
+            otherCommands.append(command)
+        if progressReportingCallback and inputSize: progressReportingCallback(min(1, endOffset/inputSize))
+    return ToolpathArrays(
+        x=numpy.frombuffer(x, dtype=numpy.float64),
+        y=numpy.frombuffer(y, dtype=numpy.float64),
+        z=numpy.frombuffer(z, dtype=numpy.float64),
+        a=numpy.frombuffer(a, dtype=numpy.float64),
+        feedrate=numpy.frombuffer(feedrate, dtype=numpy.float64),
+        tagSetIds=numpy.frombuffer(tagSetIds, dtype=numpy.uint16),
+        tagSets=tagSets,
+        relativeFlags=numpy.frombuffer(relativeFlags, dtype=numpy.uint8),
+        moveCommandIndices=numpy.frombuffer(moveCommandIndices, dtype=numpy.int64),
+        otherCommandIndices=numpy.frombuffer(otherCommandIndices, dtype=numpy.int64),
+        otherCommands=otherCommands
+    )
+
+
+# Writes the same Cura-previewable gcode that jsontoolpath.generatePreviewableGcode() would write, but working from a ToolpathArrays.
+# The ";TYPE:..." bookkeeping is done once per distinct tag set and then propagated to the moves with numpy, and the
+# "G1 ..." lines for each run of consecutive moves are formatted in one pass and written with a single write() call.
+def writePreviewableGcode(toolpathArrays, outputGcodeFile):
+    # noodleTypeNames is the list of the distinct noodleTypes implied by the tag sets in the toolpath, and
+    # noodleTypeIdOfTagSet[i] is the index, within noodleTypeNames, of the noodleType implied by toolpathArrays.tagSets[i],
+    # or -1 if that tag set does not imply a noodleType.
+    noodleTypesOfTagSets = [jsontoolpath.getNoodleTypeForTags(set(tagSet)) for tagSet in toolpathArrays.tagSets]
+    noodleTypeNames = sorted(set(noodleType for noodleType in noodleTypesOfTagSets if noodleType is not None))
+    noodleTypeIdOfTagSet = numpy.array(
+        [(noodleTypeNames.index(noodleType) if noodleType is not None else -1) for noodleType in noodleTypesOfTagSets] or [-1],
+        dtype=numpy.int64
+    )
+    noodleTypeIds = noodleTypeIdOfTagSet[toolpathArrays.tagSetIds]
+    # a move whose tags do not imply a noodleType inherits the noodleType of the most recent move whose tags do.
+    indexOfMostRecentTypedMove = numpy.maximum.accumulate(numpy.where(noodleTypeIds >= 0, numpy.arange(len(noodleTypeIds)), -1)) if len(noodleTypeIds) else noodleTypeIds
+    effectiveNoodleTypeIds = numpy.where(indexOfMostRecentTypedMove >= 0, noodleTypeIds[numpy.maximum(indexOfMostRecentTypedMove, 0)], -1)
+    isTypeChange = effectiveNoodleTypeIds != numpy.concatenate(([-1], effectiveNoodleTypeIds[:-1]))
+
+    x = toolpathArrays.x.tolist()
+    y = toolpathArrays.y.tolist()
+    z = toolpathArrays.z.tolist()
+    a = toolpathArrays.a.tolist()
+    f = (toolpathArrays.feedrate * 60).tolist()
+    typeChangeIndices = numpy.flatnonzero(isTypeChange)
+
+    def writeMoves(start, stop):
+        # split the run at the type changes
+        boundaries = sorted(set([start, stop] + typeChangeIndices[numpy.searchsorted(typeChangeIndices, start):numpy.searchsorted(typeChangeIndices, stop)].tolist()))
+        for segmentStart, segmentStop in zip(boundaries[:-1], boundaries[1:]):
+            if isTypeChange[segmentStart]:
+                outputGcodeFile.write(";TYPE:" + noodleTypeNames[effectiveNoodleTypeIds[segmentStart]] + "\n")
+            outputGcodeFile.write(
+                "".join(
+                    "G1 X{} Y{} Z{} E{} F{}\n".format(*values)
+                    for values in zip(x[segmentStart:segmentStop], y[segmentStart:segmentStop], z[segmentStart:segmentStop], a[segmentStart:segmentStop], f[segmentStart:segmentStop])
+                )
+            )
+
+    layerNumber = 0
+    lastUpperPosition = None
+    moveIndex = 0
+    moveCommandIndices = toolpathArrays.moveCommandIndices
+    for commandIndex, command in zip(toolpathArrays.otherCommandIndices.tolist(), toolpathArrays.otherCommands):
+        # emit all of the moves that precede this command.
+        nextMoveIndex = int(numpy.searchsorted(moveCommandIndices, commandIndex))
+        writeMoves(moveIndex, nextMoveIndex)
+        moveIndex = nextMoveIndex
+        if command and command['function'] == 'comment':
+            comment = command['parameters']['comment']
+            outputGcodeFile.write("; " + comment + "\n")
+            thisUpperPosition = jsontoolpath.parseUpperPosition(comment)
+            if thisUpperPosition is not None and thisUpperPosition != lastUpperPosition:
+                layerNumber += 1
+                outputGcodeFile.write(";LAYER:" + str(layerNumber) + "\n")
+                lastUpperPosition = thisUpperPosition
+    writeMoves(moveIndex, len(moveCommandIndices))
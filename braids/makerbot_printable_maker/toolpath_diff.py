@@ -0,0 +1,284 @@
+import difflib
+import hashlib
+import io
+import json
+import zipfile
+import numpy
+import binary_toolpath
+import makerbot_package
+import toolpath_arrays
+
+
+# Compares two toolpaths (typically, two builds of the same part, before and after a change to the config or its transform) layer by layer.
+#
+# Each layer (detected as in ToolpathArrays.getLayers(), with the commands that precede the first layer forming layer 0) is reduced to a
+# fingerprint: a hash of its command stream in which every coordinate and feedrate is quantized to a multiple of quantum (so that
+# differences in the last few bits of a float, which the slicer produces freely, do not count as changes).  The extruder position "a"
+# is cumulative, so a change in one layer would shift the "a" of every move after it; we therefore hash each move's change in "a"
+# (relative to the move before it) rather than "a" itself.  Tags are hashed by their text (not by their tag set id, which depends on the
+# order in which the tag sets happen to occur in the toolpath), and the other commands (comments, temperatures, ...) by their json.
+# (Values lying within a hair of a rounding boundary can still quantize differently in two toolpaths that are equal to within quantum,
+# in which case the layer is reported as changed, with a max_xy_deviation_mm of less than quantum.)
+#
+# We align the two sequences of layer fingerprints (as difflib does with lines, so that a layer inserted near the bottom does not make
+# every layer above it look different), and only for those pairs of layers whose fingerprints differ do we compare the commands
+# themselves (see getLayerDifference()).
+#
+# The fingerprints can be stored (see writeLayerFingerprints()) and used, in place of a toolpath, as the reference for a later comparison,
+# which then reports which layers changed, but not how.
+
+layerFingerprintsFormatVersion = 1
+defaultQuantum = 0.001
+
+# the number of examples of differing commands that we include in the report for each changed layer.
+exampleCount = 3
+
+# a record per move, holding the quantized values that we hash.
+moveRecordDtype = numpy.dtype([
+    ('x', '<i8'), ('y', '<i8'), ('z', '<i8'), ('deltaA', '<i8'), ('feedrate', '<i8'),
+    ('tags', '<u8'),
+    ('relativeFlags', 'u1')
+])
+
+
+# returns a ToolpathArrays for the toolpath at path, which may be a .makerbot file, a binarytoolpath file, or a jsontoolpath file.
+def loadToolpath(path):
+    with open(path, 'rb') as toolpathFile:
+        leadingBytes = toolpathFile.read(len(binary_toolpath.magic))
+    if leadingBytes == binary_toolpath.magic:
+        return binary_toolpath.loadToolpathArrays(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as makerbotFile:
+            with io.TextIOWrapper(makerbotFile.open(makerbot_package.jsontoolpathEntryName), encoding='utf-8') as inputJsontoolpathFile:
+                return toolpath_arrays.loadToolpathArrays(inputJsontoolpathFile)
+    with open(path, 'r') as inputJsontoolpathFile:
+        return toolpath_arrays.loadToolpathArrays(inputJsontoolpathFile)
+
+
+def getTagSetDigest(tagSet):
+    return int.from_bytes(hashlib.blake2b(json.dumps(list(tagSet)).encode('utf-8'), digest_size=8).digest(), 'little')
+
+def getOtherCommandKey(command):
+    return json.dumps(command, sort_keys=True).encode('utf-8')
+
+
+# The moves and other commands of a toolpath, divided into layers, in the form in which we hash and compare them.
+class LayeredToolpath:
+    def __init__(self, toolpathArrays, quantum):
+        self.toolpathArrays = toolpathArrays
+        self.quantum = quantum
+        layerStartCommandIndices, upperPositions = toolpathArrays.getLayers()
+        # layer i (for i >= 1) begins at command layerStartCommandIndices[i - 1], and layer 0 at command 0.
+        self.layerStartCommandIndices = numpy.concatenate([[0], layerStartCommandIndices]).astype(numpy.int64)
+        self.layerEndCommandIndices = numpy.append(self.layerStartCommandIndices[1:], toolpathArrays.commandCount)
+        self.upperPositions = [None] + [float(upperPosition) for upperPosition in upperPositions]
+        self.moveBounds = numpy.searchsorted(toolpathArrays.moveCommandIndices, self.layerStartCommandIndices)
+        self.moveBounds = numpy.append(self.moveBounds, toolpathArrays.moveCount)
+        self.otherBounds = numpy.searchsorted(toolpathArrays.otherCommandIndices, self.layerStartCommandIndices)
+        self.otherBounds = numpy.append(self.otherBounds, len(toolpathArrays.otherCommandIndices))
+
+        a = numpy.asarray(toolpathArrays.a, dtype=numpy.float64)
+        self.moveRecords = numpy.empty(toolpathArrays.moveCount, dtype=moveRecordDtype)
+        for name in ('x', 'y', 'z', 'feedrate'):
+            self.moveRecords[name] = numpy.rint(numpy.asarray(getattr(toolpathArrays, name), dtype=numpy.float64) / quantum)
+        self.moveRecords['deltaA'] = numpy.rint(numpy.diff(a, prepend=a[:1]) / quantum)
+        tagSetDigests = numpy.array([getTagSetDigest(tagSet) for tagSet in toolpathArrays.tagSets] or [0], dtype=numpy.uint64)
+        self.moveRecords['tags'] = tagSetDigests[toolpathArrays.tagSetIds]
+        self.moveRecords['relativeFlags'] = toolpathArrays.relativeFlags
+
+    # the layer numbers of the layers that have any commands (layer 0, the commands before the first layer, usually has none).
+    def getLayerNumbers(self):
+        return [
+            layerNumber for layerNumber in range(len(self.layerStartCommandIndices))
+            if self.layerEndCommandIndices[layerNumber] > self.layerStartCommandIndices[layerNumber]
+        ]
+
+    def getCommandCount(self, layerNumber):
+        return int(self.layerEndCommandIndices[layerNumber] - self.layerStartCommandIndices[layerNumber])
+
+    # returns the hash (as a hex string) of the commands of the layer.  The moves are hashed all at once, followed by the other commands,
+    # each with its position within the layer (so that moving a comment or a fan command from one place to another within the layer changes the hash).
+    def getLayerHash(self, layerNumber):
+        layerStart = self.layerStartCommandIndices[layerNumber]
+        moveStart, moveEnd = self.moveBounds[layerNumber], self.moveBounds[layerNumber + 1]
+        otherStart, otherEnd = self.otherBounds[layerNumber], self.otherBounds[layerNumber + 1]
+        layerHash = hashlib.blake2b(digest_size=16)
+        layerHash.update(numpy.ascontiguousarray(self.toolpathArrays.moveCommandIndices[moveStart:moveEnd] - layerStart, dtype='<i8').tobytes())
+        layerHash.update(self.moveRecords[moveStart:moveEnd].tobytes())
+        for otherIndex in range(otherStart, otherEnd):
+            layerHash.update(str(int(self.toolpathArrays.otherCommandIndices[otherIndex] - layerStart)).encode('ascii'))
+            layerHash.update(getOtherCommandKey(self.toolpathArrays.otherCommands[otherIndex]))
+        return layerHash.hexdigest()
+
+    # returns a list of (commandIndex, key) tuples, one per command of the layer, in order, where key is a bytes object that is equal for two
+    # commands exactly when they hash the same.
+    def getCommandKeys(self, layerNumber):
+        moveStart, moveEnd = self.moveBounds[layerNumber], self.moveBounds[layerNumber + 1]
+        otherStart, otherEnd = self.otherBounds[layerNumber], self.otherBounds[layerNumber + 1]
+        keys = [
+            (int(commandIndex), record.tobytes())
+            for commandIndex, record in zip(self.toolpathArrays.moveCommandIndices[moveStart:moveEnd], self.moveRecords[moveStart:moveEnd])
+        ]
+        keys.extend(
+            (int(self.toolpathArrays.otherCommandIndices[otherIndex]), getOtherCommandKey(self.toolpathArrays.otherCommands[otherIndex]))
+            for otherIndex in range(otherStart, otherEnd)
+        )
+        keys.sort(key=lambda commandIndexAndKey: commandIndexAndKey[0])
+        return keys
+
+    # returns the total extrusion (the sum of the increases in "a", in mm of filament) of the moves of the layer.
+    def getExtrusion(self, layerNumber):
+        moveStart, moveEnd = self.moveBounds[layerNumber], self.moveBounds[layerNumber + 1]
+        deltaA = self.moveRecords['deltaA'][moveStart:moveEnd]
+        return float(deltaA[deltaA > 0].sum()) * self.quantum
+
+    def getMoveCount(self, layerNumber):
+        return int(self.moveBounds[layerNumber + 1] - self.moveBounds[layerNumber])
+
+
+# returns the layer fingerprints of toolpathArrays: a json-able dict giving, for each layer, its number, its upperPosition, its number of commands, and its hash.
+def getLayerFingerprints(toolpathArrays, quantum=defaultQuantum):
+    return getLayerFingerprintsOfLayeredToolpath(LayeredToolpath(toolpathArrays, quantum))
+
+def getLayerFingerprintsOfLayeredToolpath(layeredToolpath):
+    return {
+        'formatVersion': layerFingerprintsFormatVersion,
+        'quantum': layeredToolpath.quantum,
+        'layers': [
+            {
+                'layer': layerNumber,
+                'upper_position': layeredToolpath.upperPositions[layerNumber],
+                'command_count': layeredToolpath.getCommandCount(layerNumber),
+                'hash': layeredToolpath.getLayerHash(layerNumber)
+            }
+            for layerNumber in layeredToolpath.getLayerNumbers()
+        ]
+    }
+
+def writeLayerFingerprints(layerFingerprints, outputFile):
+    json.dump(layerFingerprints, outputFile, indent=4)
+
+# returns true if the file at path is a layer fingerprints file (as written by writeLayerFingerprints()), rather than a toolpath.
+def isLayerFingerprintsFile(path):
+    with open(path, 'rb') as inputFile:
+        leadingBytes = inputFile.read(64).lstrip()
+    return leadingBytes.startswith(b'{') and b'"formatVersion"' in leadingBytes
+
+def readLayerFingerprints(inputFile):
+    layerFingerprints = json.load(inputFile)
+    if layerFingerprints.get('formatVersion') != layerFingerprintsFormatVersion:
+        raise ValueError("unsupported layer fingerprints format.")
+    return layerFingerprints
+
+
+# compares the commands of layer referenceLayerNumber of referenceToolpath with those of layer layerNumber of layeredToolpath (two LayeredToolpaths),
+# and returns a json-able dict describing the difference: the number of commands that are equal, inserted, deleted, and replaced (as aligned by
+# difflib), the change in the number of moves and in the extrusion, the greatest xy distance between corresponding moves that were replaced one
+# for one, and the first few differing commands.
+def getLayerDifference(referenceToolpath, referenceLayerNumber, layeredToolpath, layerNumber):
+    referenceKeys = referenceToolpath.getCommandKeys(referenceLayerNumber)
+    keys = layeredToolpath.getCommandKeys(layerNumber)
+    matcher = difflib.SequenceMatcher(None, [key for _, key in referenceKeys], [key for _, key in keys], autojunk=False)
+    commandCounts = {'equal': 0, 'inserted': 0, 'deleted': 0, 'replaced': 0}
+    maxXyDeviation = 0.0
+    examples = []
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if tag == 'equal':
+            commandCounts['equal'] += i2 - i1
+            continue
+        if tag == 'insert':
+            commandCounts['inserted'] += j2 - j1
+        elif tag == 'delete':
+            commandCounts['deleted'] += i2 - i1
+        else:
+            commandCounts['replaced'] += max(i2 - i1, j2 - j1)
+            if i2 - i1 == j2 - j1:
+                deviation = getXyDeviation(referenceToolpath.toolpathArrays, [commandIndex for commandIndex, _ in referenceKeys[i1:i2]], layeredToolpath.toolpathArrays, [commandIndex for commandIndex, _ in keys[j1:j2]])
+                maxXyDeviation = max(maxXyDeviation, deviation)
+        if len(examples) < exampleCount:
+            examples.append({
+                'reference_command_index': (referenceKeys[i1][0] if i1 < i2 else None),
+                'command_index': (keys[j1][0] if j1 < j2 else None),
+                'reference_command': (referenceToolpath.toolpathArrays.getCommand(referenceKeys[i1][0]) if i1 < i2 else None),
+                'command': (layeredToolpath.toolpathArrays.getCommand(keys[j1][0]) if j1 < j2 else None)
+            })
+    return {
+        'commands': commandCounts,
+        'move_count_change': layeredToolpath.getMoveCount(layerNumber) - referenceToolpath.getMoveCount(referenceLayerNumber),
+        'extrusion_change_mm': layeredToolpath.getExtrusion(layerNumber) - referenceToolpath.getExtrusion(referenceLayerNumber),
+        'max_xy_deviation_mm': maxXyDeviation,
+        'examples': examples
+    }
+
+# returns the greatest xy distance between the moves at referenceCommandIndices (within referenceArrays) and the corresponding moves at commandIndices
+# (within toolpathArrays), considering only those pairs of commands that are both moves.
+def getXyDeviation(referenceArrays, referenceCommandIndices, toolpathArrays, commandIndices):
+    def getMovePositions(arrays, commandIndices):
+        commandIndices = numpy.asarray(commandIndices, dtype=numpy.int64)
+        moveIndices = numpy.minimum(numpy.searchsorted(arrays.moveCommandIndices, commandIndices), max(arrays.moveCount - 1, 0))
+        isMove = (arrays.moveCount > 0) & (numpy.asarray(arrays.moveCommandIndices)[moveIndices] == commandIndices)
+        return isMove, numpy.asarray(arrays.x)[moveIndices], numpy.asarray(arrays.y)[moveIndices]
+    referenceIsMove, referenceX, referenceY = getMovePositions(referenceArrays, referenceCommandIndices)
+    isMove, x, y = getMovePositions(toolpathArrays, commandIndices)
+    bothMoves = referenceIsMove & isMove
+    if not bothMoves.any():
+        return 0.0
+    return float(numpy.hypot(x - referenceX, y - referenceY)[bothMoves].max())
+
+
+# compares toolpathArrays against a reference, which is either a ToolpathArrays or a layer fingerprints dict (as returned by getLayerFingerprints() or
+# readLayerFingerprints(), which must have been computed with the same quantum).  Returns a tuple (report, layerFingerprints), where report is a
+# json-able dict listing the layers that changed (with the details of each change, unless the reference is just fingerprints), were added, or were
+# removed, and layerFingerprints is the fingerprints of toolpathArrays (so that they can be stored for a later comparison).
+# progressReportingCallback, if given, is called with the completion ratio (a float) as the changed layers are compared.
+def compareToolpaths(reference, toolpathArrays, quantum=defaultQuantum, progressReportingCallback=None):
+    layeredToolpath = LayeredToolpath(toolpathArrays, quantum)
+    layerFingerprints = getLayerFingerprintsOfLayeredToolpath(layeredToolpath)
+    if isinstance(reference, dict):
+        if reference['quantum'] != quantum:
+            raise ValueError("the reference layer fingerprints were computed with a quantum of " + str(reference['quantum']) + ", rather than " + str(quantum) + ".")
+        referenceToolpath = None
+        referenceFingerprints = reference
+    else:
+        referenceToolpath = LayeredToolpath(reference, quantum)
+        referenceFingerprints = getLayerFingerprintsOfLayeredToolpath(referenceToolpath)
+
+    referenceLayers = referenceFingerprints['layers']
+    layers = layerFingerprints['layers']
+    matcher = difflib.SequenceMatcher(None, [layer['hash'] for layer in referenceLayers], [layer['hash'] for layer in layers], autojunk=False)
+    changedLayerPairs = []
+    addedLayers = []
+    removedLayers = []
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        pairCount = min(i2 - i1, j2 - j1)
+        changedLayerPairs.extend(zip(referenceLayers[i1:i1 + pairCount], layers[j1:j1 + pairCount]))
+        removedLayers.extend(referenceLayers[i1 + pairCount:i2])
+        addedLayers.extend(layers[j1 + pairCount:j2])
+
+    changedLayers = []
+    for pairIndex, (referenceLayer, layer) in enumerate(changedLayerPairs):
+        changedLayer = {
+            'layer': layer['layer'],
+            'upper_position': layer['upper_position'],
+            'reference_layer': referenceLayer['layer'],
+            'reference_upper_position': referenceLayer['upper_position'],
+            'command_count': layer['command_count'],
+            'reference_command_count': referenceLayer['command_count']
+        }
+        if referenceToolpath:
+            changedLayer.update(getLayerDifference(referenceToolpath, referenceLayer['layer'], layeredToolpath, layer['layer']))
+        changedLayers.append(changedLayer)
+        if progressReportingCallback: progressReportingCallback((pairIndex + 1) / len(changedLayerPairs))
+
+    report = {
+        'quantum': quantum,
+        'reference_layer_count': len(referenceLayers),
+        'layer_count': len(layers),
+        'unchanged_layer_count': sum(i2 - i1 for (tag, i1, i2, j1, j2) in matcher.get_opcodes() if tag == 'equal'),
+        'changed_layers': changedLayers,
+        'added_layers': [{'layer': layer['layer'], 'upper_position': layer['upper_position']} for layer in addedLayers],
+        'removed_layers': [{'reference_layer': layer['layer'], 'reference_upper_position': layer['upper_position']} for layer in removedLayers]
+    }
+    return report, layerFingerprints
@@ -0,0 +1,437 @@
+import collections
+import collections.abc
+import copy
+import json
+import operator
+import sys
+
+import jsondiff_by_makerbot
+
+
+# Rather than deep-copying the whole miraclegrue config before the transform runs (so that we can diff the before and after states), we hand the
+# transform a TrackedDict: a dict that wraps the config and records, in a MutationLog, every value that the transform sets or deletes,
+# along with the value that it replaced and the line of the transform file that made the change.  Reading through a TrackedDict returns
+# TrackedDicts (and TrackedLists) for nested containers, so that changes made deep within the config (e.g.
+# config['extruderProfiles'][0]['extrusionProfiles']['solid']['feedrate'] = 70) are recorded with their full path.
+# The underlying config is modified in place.  The only things we copy are the values that get replaced (which are usually scalars), and
+# the values that get assigned, so the cost of tracking the changes is proportional to the size of the changes, not to the size of the config.  The diff
+# report is then computed from the log, by comparing the original value at each changed path against the final value there.
+#
+# TrackedDict and TrackedList are subclasses of dict and list (so that the transform can treat the config as the dict that it is documented to be:
+# isinstance(config, dict), config.copy(), json.dumps(config), config['someList'] + [...], config |= {...}, and so on, all work).  Each keeps, as its own
+# (dict or list) content, a shallow copy of the container that it wraps, in which each nested container is replaced by its own TrackedDict or TrackedList,
+# and which it keeps in step with the container as it is modified.  That content is what the C code that reads dicts and lists directly (dict(config),
+# {**config}, list + list, ...) sees, so that what it hands back is tracked as well, rather than being a way around the log.  (So wrapping the config
+# wraps every container within it, once, which is still cheaper than a deep copy.)  There is at most one TrackedDict or TrackedList for each
+# container (see MutationLog.getWrapper()), so that a change made through one is seen through every reference that the transform holds.
+#
+# A value that is assigned into the config is copied (see getPlainCopy()), so that no two paths within the config share a container.  Otherwise, after
+# config['x'] = config['a'], a change made through config['x'] would silently change config['a'] as well, and the log would attribute it to x alone.
+# A change made through a TrackedDict or TrackedList that is no longer part of the config (because it has since been replaced, deleted, or popped)
+# does not change the config, and so is not recorded.
+
+ConfigMutation = collections.namedtuple("ConfigMutation", ["operation", "path", "oldValue", "newValue", "lineNumber"])
+# operation is either "set" or "delete".
+# path is a tuple of keys (and list indices), from the root of the config.
+# oldValue and newValue are snapshots of the value at path before and after the change (either of which may be an instance of Missing).
+# lineNumber is the line, within the transform file, of the statement that made the change (or None, if the change was not made by code in the transform file).
+
+Missing = jsondiff_by_makerbot.JSONDiff.Missing
+
+
+def snapshot(value):
+    return (copy.deepcopy(value) if isinstance(value, (dict, list)) else value)
+
+def wrap(value, path, mutationLog):
+    if isinstance(value, (dict, list)):
+        return mutationLog.getWrapper(value, tuple(path))
+    return value
+
+# returns a deep copy of value (which may be, or contain, TrackedDicts and TrackedLists) made of plain dicts and lists.
+def getPlainCopy(value):
+    if isinstance(value, (TrackedDict, TrackedList)):
+        value = value.data
+    if isinstance(value, dict):
+        return {key: getPlainCopy(x) for key, x in value.items()}
+    if isinstance(value, list):
+        return [getPlainCopy(x) for x in value]
+    return value
+
+# returns the underlying value of a TrackedDict or TrackedList.  A plain container (which the transform might have built out of values that it read from
+# the config, as in config['a'] = dict(config['b'])) is returned with any tracked values within it replaced (in place) by their underlying values.
+def unwrap(value):
+    if isinstance(value, (TrackedDict, TrackedList)):
+        return value.data
+    if isinstance(value, dict):
+        for key, x in value.items():
+            y = unwrap(x)
+            if y is not x:
+                value[key] = y
+    elif isinstance(value, list):
+        for i, x in enumerate(value):
+            y = unwrap(x)
+            if y is not x:
+                value[i] = y
+    return value
+
+# returns the value at path within x, or an instance of Missing if there is no such value.
+def getAtPath(x, path):
+    for key in path:
+        try:
+            x = x[key]
+        except (KeyError, IndexError, TypeError):
+            return Missing()
+    return x
+
+# sets (or, if value is an instance of Missing, deletes) the value at path within x.  Returns x (or, if path is empty, value).
+def setAtPath(x, path, value):
+    if len(path) == 0:
+        return value
+    container = getAtPath(x, path[:-1])
+    if isinstance(value, Missing):
+        del container[path[-1]]
+    else:
+        container[path[-1]] = value
+    return x
+
+# formats path in the same style as JSONDiff.flatten(), e.g. extruderProfiles[0].extrusionProfiles.solid.feedrate
+def formatPath(path):
+    formattedPath = ""
+    for key in path:
+        if isinstance(key, int):
+            formattedPath += "[%s]" % key
+        elif formattedPath:
+            formattedPath += "." + str(key)
+        else:
+            formattedPath = str(key)
+    return formattedPath
+
+def formatValue(value, trimSize):
+    if isinstance(value, Missing):
+        return "(nothing)"
+    valueString = json.dumps(value)
+    if len(valueString) > trimSize + len('...'):
+        valueString = valueString[:trimSize] + '...'
+    return valueString
+
+
+class MutationLog:
+    # root is the (underlying, unwrapped) config that is being tracked.
+    # sourceFileName is the file name under which the transform was compiled, which we look for on the stack in order to
+    # attribute each change to a line of the transform.
+    def __init__(self, root, sourceFileName=None):
+        self.root = root
+        self.sourceFileName = sourceFileName
+        self.mutations = []
+        # maps the id of each container that we have wrapped to its TrackedDict or TrackedList.
+        self.wrappers = dict()
+
+    def getTrackedRoot(self):
+        return wrap(self.root, (), self)
+
+    # returns the TrackedDict or TrackedList wrapping the container data, which is at path within the config.
+    def getWrapper(self, data, path):
+        wrapper = self.wrappers.get(id(data))
+        if wrapper is None or wrapper.data is not data or wrapper.path != path:
+            wrapper = (TrackedDict if isinstance(data, dict) else TrackedList)(data, path, self)
+            self.wrappers[id(data)] = wrapper
+        return wrapper
+
+    # returns true if wrapper (a TrackedDict or TrackedList) still wraps the container at its path within the config.
+    def isAttached(self, wrapper):
+        return getAtPath(self.root, wrapper.path) is wrapper.data
+
+    # after the elements of the list at listPath have been rearranged (by an insertion, a deletion, a sort, ...), updates the paths of the wrappers
+    # of the containers within it.  oldElementIds is the list of the ids of the elements of the list before the change, and elements is the list
+    # of the elements after it.
+    def relocateWithinList(self, listPath, oldElementIds, elements):
+        newIndexById = {id(element): index for index, element in enumerate(elements) if isinstance(element, (dict, list))}
+        for wrapper in self.wrappers.values():
+            path = wrapper.path
+            if len(path) <= len(listPath) or path[:len(listPath)] != listPath or not isinstance(path[len(listPath)], int):
+                continue
+            oldIndex = path[len(listPath)]
+            newIndex = (newIndexById.get(oldElementIds[oldIndex]) if oldIndex < len(oldElementIds) else None)
+            if newIndex is not None:
+                wrapper.path = listPath + (newIndex,) + path[len(listPath) + 1:]
+
+    def getCallerLineNumber(self):
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code.co_filename == self.sourceFileName:
+                return frame.f_lineno
+            frame = frame.f_back
+        return None
+
+    # records a change made through wrapper (the TrackedDict or TrackedList that was changed), unless wrapper is no longer part of the config.
+    # oldValue and newValue are expected to be snapshots (see snapshot()), because the caller is about to modify the originals.
+    def record(self, wrapper, operation, path, oldValue, newValue):
+        if self.isAttached(wrapper):
+            self.mutations.append(ConfigMutation(operation, tuple(path), oldValue, newValue, self.getCallerLineNumber()))
+
+    # returns a dict mapping path to the value that was at that path before any of the mutations, for the outermost
+    # paths that were changed (i.e. if both a and a.b were changed, we report only a, with the original value of a.b restored within it).
+    def getInitialValues(self):
+        initialValues = dict()
+        for mutation in self.mutations:
+            path = mutation.path
+            if any(path[:i] in initialValues for i in range(len(path) + 1)):
+                # the original value at path is already accounted for, within the original value of path or one of its ancestors.
+                continue
+            initialValue = mutation.oldValue
+            descendantPaths = [otherPath for otherPath in initialValues if otherPath[:len(path)] == path]
+            if descendantPaths:
+                # the snapshot that we took when path was changed reflects the earlier changes to its descendants, which we undo.
+                initialValue = copy.deepcopy(initialValue)
+                for descendantPath in descendantPaths:
+                    initialValue = setAtPath(initialValue, descendantPath[len(path):], initialValues.pop(descendantPath))
+            initialValues[path] = initialValue
+        return initialValues
+
+    # returns the config as it was before any of the mutations (this requires a deep copy of the whole config, so we do it only when we must).
+    def getInitialConfig(self):
+        initialConfig = copy.deepcopy(self.root)
+        for path, initialValue in self.getInitialValues().items():
+            initialConfig = setAtPath(initialConfig, path, initialValue)
+        return initialConfig
+
+    # returns a JSONDiff between the config before the mutations and finalConfig.
+    # Ordinarily, finalConfig is the tracked config itself (i.e. the transform modified the config that we gave it and returned it), in which case
+    # we need only compare the original and final values at each changed path.  If the transform returned some other object, then we fall
+    # back to reconstructing the initial config and diffing the whole thing.
+    def getDiff(self, finalConfig):
+        JSONDiff = jsondiff_by_makerbot.JSONDiff
+        if finalConfig is not self.root:
+            return JSONDiff(self.getInitialConfig(), finalConfig)
+        rootDiff = JSONDiff.make_unexpanded(finalConfig, finalConfig)
+        for path, initialValue in self.getInitialValues().items():
+            pathDiff = JSONDiff(initialValue, getAtPath(finalConfig, path))
+            if pathDiff.is_similar_value():
+                continue
+            # the ancestors of an outermost changed path were not themselves changed, so they are the same objects before and after.
+            diff = rootDiff
+            container = finalConfig
+            for key in path[:-1]:
+                container = container[key]
+                if key not in diff.dict_diff:
+                    diff.dict_diff[key] = JSONDiff.make_unexpanded(container, container)
+                diff = diff.dict_diff[key]
+            diff.dict_diff[path[-1]] = pathDiff
+        return rootDiff
+
+    # returns a report listing the mutations in the order in which they were made, one per line.
+    def getReport(self, trimSize=12):
+        return "\n".join(
+            "line {}: {} {}{} (was {})".format(
+                (mutation.lineNumber if mutation.lineNumber is not None else "?"),
+                mutation.operation,
+                formatPath(mutation.path),
+                (" = " + formatValue(mutation.newValue, trimSize) if mutation.operation == "set" else ""),
+                formatValue(mutation.oldValue, trimSize)
+            )
+            for mutation in self.mutations
+        )
+
+
+class TrackedDict(dict):
+    def __init__(self, data, path, mutationLog):
+        self.data = data
+        self.path = tuple(path)
+        self.mutationLog = mutationLog
+        dict.__init__(self, data)
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                dict.__setitem__(self, key, mutationLog.getWrapper(value, self.path + (key,)))
+
+    def __getitem__(self, key):
+        return wrap(self.data[key], self.path + (key,), self.mutationLog)
+
+    def __setitem__(self, key, value):
+        value = getPlainCopy(value)
+        self.mutationLog.record(self, "set", self.path + (key,), snapshot(self.data[key]) if key in self.data else Missing(), snapshot(value))
+        self.data[key] = value
+        dict.__setitem__(self, key, wrap(value, self.path + (key,), self.mutationLog))
+
+    def __delitem__(self, key):
+        oldValue = self.data[key]
+        self.mutationLog.record(self, "delete", self.path + (key,), snapshot(oldValue), Missing())
+        del self.data[key]
+        dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        return (self[key] if key in self.data else default)
+
+    def pop(self, key, *default):
+        if key not in self.data:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self.data:
+            raise KeyError("popitem(): dictionary is empty")
+        key = next(reversed(list(self.data)))
+        return (key, self.pop(key))
+
+    def setdefault(self, key, default=None):
+        if key not in self.data:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self.data):
+            del self[key]
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    # (as for a dict, the union is a new (plain) dict.)
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        union = self.copy()
+        union.update(other)
+        return union
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        union = dict(other)
+        union.update(self.copy())
+        return union
+
+    def items(self):
+        return collections.abc.ItemsView(self)
+
+    def values(self):
+        return collections.abc.ValuesView(self)
+
+    # a shallow copy, as for a dict: a new (plain) dict, whose values are those of this one (so that a change made within one of them is tracked).
+    def copy(self):
+        return {key: self[key] for key in self.data}
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.data, memo)
+
+
+# Inserting into (or deleting from) a list shifts the indices of the elements after that point, so we record any change to the structure of
+# a list (as opposed to the replacement of a single element) as a change to the list as a whole.
+class TrackedList(list):
+    def __init__(self, data, path, mutationLog):
+        self.data = data
+        self.path = tuple(path)
+        self.mutationLog = mutationLog
+        list.__init__(self, data)
+        for index, value in enumerate(data):
+            if isinstance(value, (dict, list)):
+                list.__setitem__(self, index, mutationLog.getWrapper(value, self.path + (index,)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                wrap(value, self.path + (i,), self.mutationLog)
+                for (i, value) in zip(range(*index.indices(len(self.data))), self.data[index])
+            ]
+        index = range(len(self.data))[index]
+        return wrap(self.data[index], self.path + (index,), self.mutationLog)
+
+    def __iter__(self):
+        for index in range(len(self.data)):
+            yield self[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [getPlainCopy(x) for x in value]
+            self.changeStructure(lambda: self.data.__setitem__(index, value))
+        else:
+            index = range(len(self.data))[index]
+            value = getPlainCopy(value)
+            self.mutationLog.record(self, "set", self.path + (index,), snapshot(self.data[index]), snapshot(value))
+            self.data[index] = value
+            list.__setitem__(self, index, wrap(value, self.path + (index,), self.mutationLog))
+
+    def __delitem__(self, index):
+        self.changeStructure(lambda: self.data.__delitem__(index))
+
+    # applies operation (a function of no arguments that rearranges self.data), and records the change as a change to the list as a whole.
+    def changeStructure(self, operation):
+        oldValue = snapshot(self.data)
+        oldElementIds = [id(element) for element in self.data]
+        operation()
+        self.mutationLog.record(self, "set", self.path, oldValue, snapshot(self.data))
+        self.mutationLog.relocateWithinList(self.path, oldElementIds, self.data)
+        # (the wrappers of the elements that were already in the list have followed them, above, so we reuse them here.)
+        list.__setitem__(self, slice(None), [wrap(value, self.path + (index,), self.mutationLog) for index, value in enumerate(self.data)])
+
+    def insert(self, index, value):
+        value = getPlainCopy(value)
+        self.changeStructure(lambda: self.data.insert(index, value))
+
+    def append(self, value):
+        self.insert(len(self.data), value)
+
+    def extend(self, values):
+        values = [getPlainCopy(x) for x in values]
+        self.changeStructure(lambda: self.data.extend(values))
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    # (the repeated elements are copies, as for any value assigned into the config, so that no two paths share a container.)
+    def __imul__(self, count):
+        count = operator.index(count)
+        if count <= 0:
+            self.clear()
+        else:
+            self.extend([value for _ in range(count - 1) for value in self.data])
+        return self
+
+    def pop(self, index=-1):
+        value = self[index]
+        del self[index]
+        return value
+
+    def remove(self, value):
+        del self[self.data.index(value)]
+
+    def clear(self):
+        self.changeStructure(self.data.clear)
+
+    def reverse(self):
+        self.changeStructure(self.data.reverse)
+
+    def sort(self, *args, **kwargs):
+        self.changeStructure(lambda: self.data.sort(*args, **kwargs))
+
+    # a shallow copy, as for a list: a new (plain) list, whose elements are those of this one.
+    def copy(self):
+        return list(self)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.data, memo)
+
+    def __add__(self, values):
+        return self.copy() + list(values)
+
+    def __radd__(self, values):
+        return list(values) + self.copy()
+
+    def __mul__(self, count):
+        return self.copy() * count
+
+    __rmul__ = __mul__
@@ -0,0 +1,299 @@
+import collections
+import json
+import math
+import numpy
+import jsontoolpath
+
+
+# Reorders the islands of each layer of a jsontoolpath so as to shorten the travel between them.
+#
+# miracle_grue prints a layer as a series of islands (a closed inset, a patch of infill, ...), going from one to the next by a
+# transition of the form:
+#     Retract (at the end of the island), Travel Move(s) (to the start of the next island), Restart or Long Restart (at the start of the next island)
+# We consider a run of islands to be reorderable if nothing but moves intervenes between them (so a comment, such as the header of a new
+# "Layer Section", or a fan command, is a barrier that no island crosses, which keeps the islands of each section, and hence of each feature
+# type, together and in their original sequence relative to the other sections), and if each of the islands is entered by a Restart and
+# left by a Retract (so that moving an island elsewhere never leaves the nozzle traveling unretracted).
+# Each island keeps its own direction, its own Restart and its own Retract; only the order in which the islands are visited, and
+# the travel moves between them, change.  We choose the order by a nearest-neighbor pass followed by 2-opt (see findShortTour()), and
+# rewrite the run only if the result is shorter than the original order.
+#
+# Moving an island changes the point in the toolpath at which its filament is extruded, so the (absolute) "a" values are re-based: every
+# move keeps the change in "a" that it originally had relative to the move before it.
+#
+# The travel times in the report are the commanded travel times (distance divided by the travel move's feedrate, ignoring acceleration).
+#
+# We stream the toolpath (see RetainingReader), holding in memory only the items of the run in progress (a run never crosses a barrier, so
+# it lies within one "Layer Section") and the chunk being parsed, rather than the whole file.
+
+Island = collections.namedtuple("Island", ["moves", "startPoint", "endPoint"])
+# moves is the list of the indices (within the run) of the moves of the island, from its Restart through its Retract.
+# startPoint and endPoint are the (x, y) positions at which the island starts and ends.
+
+travelTags = (["Travel Move"],)
+retractTags = (["Retract"],)
+restartTags = (["Restart"], ["Long Restart"])
+
+def getMoveKind(command):
+    tags = command['tags']
+    if tags in travelTags: return "travel"
+    if tags in retractTags: return "retract"
+    if tags in restartTags: return "restart"
+    return "body"
+
+def getPoint(command):
+    return (command['parameters']['x'], command['parameters']['y'])
+
+def getDistance(p, q):
+    return math.hypot(q[0] - p[0], q[1] - p[1])
+
+
+# returns the order (a list of indices into islands) that visits all of islands, starting from startPoint (and, if endPoint is not None, finishing
+# at endPoint) with as little travel as we can find: a nearest-neighbor tour improved by 2-opt.  The islands are asymmetric (each
+# is entered at its startPoint and left at its endPoint), so reversing a section of the tour changes the cost of the travel within that
+# section as well as at its ends, which we account for using the prefix sums of the forward and backward costs along the tour.
+def findShortTour(islands, startPoint, endPoint=None, maxPasses=50):
+    count = len(islands)
+    starts = numpy.array([island.startPoint for island in islands], dtype=numpy.float64)
+    ends = numpy.array([island.endPoint for island in islands], dtype=numpy.float64)
+    # cost[i, j] is the travel from the end of island i to the start of island j.  Index count stands for the fixed start (as the "end" of a
+    # virtual island before the tour) and for the fixed end (as the "start" of a virtual island after the tour).
+    allEnds = numpy.vstack([ends, [startPoint]])
+    allStarts = numpy.vstack([starts, [endPoint if endPoint is not None else (0, 0)]])
+    cost = numpy.hypot(allEnds[:, None, 0] - allStarts[None, :, 0], allEnds[:, None, 1] - allStarts[None, :, 1])
+    if endPoint is None:
+        cost[:, count] = 0
+
+    # nearest neighbor
+    tour = []
+    unvisited = numpy.ones(count, dtype=bool)
+    current = count
+    for i in range(count):
+        candidateCosts = numpy.where(unvisited, cost[current, :count], numpy.inf)
+        current = int(numpy.argmin(candidateCosts))
+        unvisited[current] = False
+        tour.append(current)
+
+    # 2-opt: reverse the section tour[i..j] if that shortens the whole.
+    for passNumber in range(maxPasses):
+        path = numpy.array([count] + tour + [count])
+        forwardCosts = cost[path[:-1], path[1:]]
+        backwardCosts = cost[path[1:], path[:-1]]
+        # cumulative sums, so that the forward (or backward) cost of the edges within path[a..b] is forwardSums[b] - forwardSums[a]
+        forwardSums = numpy.concatenate(([0], numpy.cumsum(forwardCosts)))
+        backwardSums = numpy.concatenate(([0], numpy.cumsum(backwardCosts)))
+        bestImprovement = 1e-9
+        bestMove = None
+        for a in range(1, count):
+            # the section is path[a..b] (path[0] and path[count + 1] being the fixed ends)
+            b = numpy.arange(a + 1, count + 1)
+            before = path[a - 1]
+            after = path[b + 1]
+            oldCost = forwardCosts[a - 1] + forwardCosts[b] + (forwardSums[b] - forwardSums[a])
+            newCost = cost[before, path[b]] + cost[path[a], after] + (backwardSums[b] - backwardSums[a])
+            improvements = oldCost - newCost
+            k = int(numpy.argmax(improvements))
+            if improvements[k] > bestImprovement:
+                bestImprovement = improvements[k]
+                bestMove = (a, int(b[k]))
+        if bestMove is None:
+            break
+        a, b = bestMove
+        # path[a..b] corresponds to tour[a - 1..b - 1]
+        tour[a - 1:b] = tour[a - 1:b][::-1]
+    return tour
+
+# returns the total travel distance (and time, given the travel feedrate of each transition) of visiting islands in the given order.
+def getTourTravel(islands, order, startPoint, endPoint, travelFeedrates):
+    distance = 0
+    duration = 0
+    point = startPoint
+    for k, index in enumerate(order + ([None] if endPoint is not None else [])):
+        nextPoint = (islands[index].startPoint if index is not None else endPoint)
+        legDistance = getDistance(point, nextPoint)
+        distance += legDistance
+        duration += (legDistance / travelFeedrates[k] if travelFeedrates[k] > 0 else 0)
+        if index is not None:
+            point = islands[index].endPoint
+    return (distance, duration)
+
+
+# optimizes one run of consecutive moves (commands is the list of their command dicts, and previousA and previousPoint are the "a" value
+# and the position of the move before the run, or None).
+# Returns (rewrittenCommands, travelSecondsBefore, travelSecondsAfter), where rewrittenCommands is None if we leave the run as it is.
+def optimizeRun(commands, previousA, previousPoint):
+    kinds = [getMoveKind(command) for command in commands]
+    # find the transitions: maximal runs of retract/travel/restart moves containing a travel move, of the form retract* travel+ restart*.
+    transitions = []
+    i = 0
+    while i < len(commands):
+        if kinds[i] == "body":
+            i += 1
+            continue
+        j = i
+        while j < len(commands) and kinds[j] != "body":
+            j += 1
+        section = kinds[i:j]
+        if "travel" in section:
+            retractCount = 0
+            while retractCount < len(section) and section[retractCount] == "retract": retractCount += 1
+            travelCount = 0
+            while retractCount + travelCount < len(section) and section[retractCount + travelCount] == "travel": travelCount += 1
+            if any(kind != "restart" for kind in section[retractCount + travelCount:]):
+                return (None, 0, 0)
+            transitions.append((i, i + retractCount, i + retractCount + travelCount, j))
+        i = j
+    # the islands that we can move are those between two transitions, entered by a restart and left by a retract.
+    if len(transitions) < 3:
+        return (None, 0, 0)
+    islands = []
+    for (previousTransition, nextTransition) in zip(transitions[:-1], transitions[1:]):
+        if previousTransition[2] == previousTransition[3] or nextTransition[0] == nextTransition[1]:
+            return (None, 0, 0)
+        moves = list(range(previousTransition[2], nextTransition[1]))
+        islands.append(Island(moves, getPoint(commands[moves[0]]), getPoint(commands[moves[-1]])))
+
+    firstTransition = transitions[0]
+    lastTransition = transitions[-1]
+    startPoint = (getPoint(commands[firstTransition[1] - 1]) if firstTransition[1] > 0 else previousPoint)
+    if startPoint is None:
+        return (None, 0, 0)
+    endPoint = getPoint(commands[lastTransition[2] - 1])
+    # the travel move of each transition, which we use as the template for the travel into (or, for the last, out of) each position of the tour.
+    travelTemplates = [commands[transition[2] - 1] for transition in transitions]
+    travelFeedrates = [template['parameters']['feedrate'] for template in travelTemplates]
+
+    originalOrder = list(range(len(islands)))
+    order = findShortTour(islands, startPoint, endPoint)
+    originalDistance, originalDuration = getTourTravel(islands, originalOrder, startPoint, endPoint, travelFeedrates)
+    distance, duration = getTourTravel(islands, order, startPoint, endPoint, travelFeedrates)
+    if order == originalOrder or duration >= originalDuration:
+        return (None, originalDuration, originalDuration)
+
+    # the change in "a" of each move, relative to the move before it (in the original order)
+    aValues = [command['parameters']['a'] for command in commands]
+    aDeltas = [aValues[0] - (previousA if previousA is not None else aValues[0])] + [aValues[k] - aValues[k - 1] for k in range(1, len(aValues))]
+
+    rewrittenCommands = []
+    a = (previousA if previousA is not None else aValues[0] - aDeltas[0])
+    def emit(command, aDelta, point=None):
+        nonlocal a
+        a += aDelta
+        command = dict(command)
+        command['parameters'] = dict(command['parameters'], a=a)
+        if point is not None:
+            command['parameters']['x'], command['parameters']['y'] = point
+        rewrittenCommands.append(command)
+
+    # everything up to the first travel move is unchanged (apart from "a", which is unchanged there too)
+    for k in range(0, firstTransition[1]):
+        emit(commands[k], aDeltas[k])
+    for position, index in enumerate(order):
+        island = islands[index]
+        emit(travelTemplates[position], 0, island.startPoint)
+        for k in island.moves:
+            emit(commands[k], aDeltas[k])
+    emit(travelTemplates[-1], 0, endPoint)
+    for k in range(lastTransition[2], len(commands)):
+        emit(commands[k], aDeltas[k])
+    return (rewrittenCommands, originalDuration, duration)
+
+
+# RetainingReader is a readable, text-mode file-like object over a binary file, for iterateJsontoolpathItems() to parse, that keeps the text that
+# it has read from keepOffset onwards, so that we can copy the items that we do not change byte for byte (by getText()) without holding the rest
+# of the file in memory.  We decode the file as latin-1, so that character offsets are byte offsets (see layer_index.openForIndexing()).
+# The text before keepOffset is discarded (at the next read(), so that moving keepOffset is cheap).
+class RetainingReader:
+    def __init__(self, binaryFile):
+        self.binaryFile = binaryFile
+        self.retainedText = ""
+        self.retainedOffset = 0 # the offset, within the file, of retainedText[0]
+        self.keepOffset = 0
+
+    def read(self, size=-1):
+        chunk = self.binaryFile.read(size).decode('latin-1')
+        self.retainedText = self.retainedText[self.keepOffset - self.retainedOffset:] + chunk
+        self.retainedOffset = self.keepOffset
+        return chunk
+
+    def getText(self, startOffset, endOffset):
+        return self.retainedText[startOffset - self.retainedOffset:endOffset - self.retainedOffset]
+
+    def getBytes(self, startOffset, endOffset):
+        return self.getText(startOffset, endOffset).encode('latin-1')
+
+    # returns the text from offset to the end of what we have read.
+    def getRemainingText(self, offset):
+        return self.retainedText[offset - self.retainedOffset:]
+
+
+# reads the jsontoolpath from inputJsontoolpathFile (a readable binary file-like object) and writes the optimized jsontoolpath to
+# outputJsontoolpathFile (a writable binary file-like object).  Items that we do not change are copied byte for byte.
+# Returns a report (a dict) giving the travel time saved in each layer (numbered as in the previewable gcode) and in total.
+def optimizeTravel(inputJsontoolpathFile, outputJsontoolpathFile, progressReportingCallback=None):
+    reader = RetainingReader(inputJsontoolpathFile)
+    fileSize = jsontoolpath.getFileSize(inputJsontoolpathFile)
+    state = jsontoolpath.PreviewableGcodeState()
+    layerReports = collections.OrderedDict()
+    run = [] # (startOffset, endOffset, command) for each move of the current run
+    previous = [None, None] # the "a" and the position of the move before the current run
+    isFirstItem = True
+
+    def getLayerReport():
+        if state.layerNumber not in layerReports:
+            layerReports[state.layerNumber] = {'layer': state.layerNumber, 'upper_position': state.lastUpperPosition, 'travel_s_before': 0.0, 'travel_s_after': 0.0}
+        return layerReports[state.layerNumber]
+
+    def writeItem(raw):
+        nonlocal isFirstItem
+        outputJsontoolpathFile.write((b"[" if isFirstItem else b",") + raw)
+        isFirstItem = False
+
+    def flushRun():
+        if not run:
+            return
+        commands = [command for (startOffset, endOffset, command) in run]
+        rewrittenCommands, before, after = optimizeRun(commands, previous[0], previous[1])
+        layerReport = getLayerReport()
+        layerReport['travel_s_before'] += before
+        layerReport['travel_s_after'] += after
+        if rewrittenCommands is None:
+            for (startOffset, endOffset, command) in run:
+                writeItem(reader.getBytes(startOffset, endOffset))
+        else:
+            # we keep the formatting of the items (e.g. '{\r\n"command" : ...\r\n}') and replace just the command.
+            raw = reader.getText(run[0][0], run[0][1])
+            prefix = raw[:raw.index('{', 1)].encode('latin-1')
+            suffix = raw[raw.rindex('}', 0, len(raw) - 1) + 1:].encode('latin-1')
+            for command in rewrittenCommands:
+                writeItem(prefix + json.dumps(command, separators=(',', ':')).encode('utf-8') + suffix)
+        previous[0] = commands[-1]['parameters']['a']
+        previous[1] = getPoint(commands[-1])
+        run.clear()
+
+    for (startOffset, endOffset, item) in jsontoolpath.iterateJsontoolpathItems(reader, withOffsets=True):
+        command = item.get('command')
+        if command and command['function'] == 'move' and list(item) == ['command']:
+            run.append((startOffset, endOffset, command))
+        else:
+            flushRun()
+            writeItem(reader.getBytes(startOffset, endOffset))
+            if command:
+                jsontoolpath.appendPreviewableGcode(command, state, [])
+        reader.keepOffset = (run[0][0] if run else endOffset)
+        if progressReportingCallback and fileSize: progressReportingCallback(min(1, endOffset/fileSize))
+    flushRun()
+    # (what follows the last item is the closing bracket, and whatever whitespace follows it.)
+    remainingText = reader.getRemainingText(reader.keepOffset)
+    outputJsontoolpathFile.write((b"[" if isFirstItem else b"") + b"]" + remainingText[remainingText.rindex("]") + 1:].encode('latin-1'))
+
+    layers = [
+        dict(layerReport, travel_s_saved=layerReport['travel_s_before'] - layerReport['travel_s_after'])
+        for layerReport in layerReports.values()
+    ]
+    return {
+        'travel_s_before': sum(layer['travel_s_before'] for layer in layers),
+        'travel_s_after': sum(layer['travel_s_after'] for layer in layers),
+        'travel_s_saved': sum(layer['travel_s_saved'] for layer in layers),
+        'layers': layers
+    }
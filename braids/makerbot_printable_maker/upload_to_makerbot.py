@@ -0,0 +1,187 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import pathlib
+import posixpath
+import re
+import threading
+import time
+import paramiko
+
+
+# Uploads files (typically .makerbot files) to a directory on the makerbot, over a single ssh connection, replacing the
+# one-pscp-process-per-file upload that the makefile used to do.
+#   - All of the transfers share one ssh connection (each worker thread opens its own sftp channel on it), so we pay for the
+#     connection setup (and the authentication) once per run rather than once per file, and up to --max_concurrent_uploads files are
+#     sent at once, with pipelined writes, so that the transfer is limited by the bandwidth of the link rather than by round trips.
+#   - We keep a manifest on the makerbot (uploadManifestName, in the destination directory) recording the sha256 of the content of each
+#     file that we have uploaded there.  A file whose content is already on the makerbot (under whatever name) is not uploaded again.
+#     (A file that was put there by some other means is unknown to the manifest, and so does not count.)
+#   - Each file is first written to a partial file named for its content hash, and renamed to its final name only once it is complete.
+#     If an upload is interrupted, the next attempt to upload the same content finds the partial file and resumes from its end.
+#     Partial files for content that we are not uploading this time (left behind by an upload that was interrupted and never resumed,
+#     typically because the file has since been rebuilt) are deleted, so that they do not accumulate on the makerbot.
+#   - Unlike pscp, which used PuTTY's own store of host keys (and authenticated with pageant), we check the host key of the makerbot
+#     against ~/.ssh/known_hosts and against --known_hosts_file (both in the OpenSSH format), and authenticate with the ssh agent
+#     (which, on Windows, is pageant) or with --key_file.  An unknown host key is rejected, unless --accept_unknown_host_key is given,
+#     in which case it is accepted and recorded in --known_hosts_file, so that it is checked on subsequent uploads.
+
+uploadManifestName = ".upload_manifest.json"
+uploadManifestFormatVersion = 1
+chunkSize = 1<<20
+partialNamePattern = re.compile(r"^\.([0-9a-f]{64})\.partial$")
+
+parser = argparse.ArgumentParser(description="Upload files to the makerbot over sftp, skipping those whose content is already there, and resuming interrupted uploads.")
+parser.add_argument("--input_file", action='append', required=True, help="a file to be uploaded.  May be given several times.")
+parser.add_argument("--host", action='store', nargs=1, required=True, help="the address of the makerbot.")
+parser.add_argument("--port", action='store', nargs=1, type=int, required=False, default=[22])
+parser.add_argument("--username", action='store', nargs=1, required=False, default=["root"])
+parser.add_argument("--key_file", action='store', nargs=1, required=False, help="the private key with which to authenticate.  By default, we use the ssh agent, and the keys in ~/.ssh.")
+parser.add_argument("--known_hosts_file", action='store', nargs=1, required=False, help="a file (in the OpenSSH known_hosts format) of host keys to accept, in addition to those in ~/.ssh/known_hosts.  With --accept_unknown_host_key, an unknown host key is recorded here.")
+parser.add_argument("--accept_unknown_host_key", action='store_true', required=False, help="if given, we connect even if the host key of the makerbot is not among the known hosts (and record it in --known_hosts_file, if given).")
+parser.add_argument("--destination_directory", action='store', nargs=1, required=True, help="the directory on the makerbot into which to upload the files (e.g. /home/usb_storage/).")
+parser.add_argument("--name_prefix", action='store', nargs=1, required=False, default=[""], help="a prefix (such as a timestamp) to be prepended to the name of each uploaded file.")
+parser.add_argument("--max_concurrent_uploads", action='store', nargs=1, type=int, required=False, default=[4], help="the number of files to send at once.  Default: 4.")
+args=parser.parse_args()
+
+
+def getContentHash(path):
+    contentHash = hashlib.sha256()
+    with open(path, 'rb') as inputFile:
+        while True:
+            chunk = inputFile.read(chunkSize)
+            if not chunk:
+                break
+            contentHash.update(chunk)
+    return contentHash.hexdigest()
+
+def getPartialName(contentHash):
+    return "." + contentHash + ".partial"
+
+# returns the manifest in the directory, as a dict of the form {'formatVersion': ..., 'files': {contentHash: {'name': ..., 'size': ...}, ...}}.
+def readUploadManifest(sftp, directory):
+    try:
+        with sftp.open(posixpath.join(directory, uploadManifestName), 'r') as manifestFile:
+            manifest = json.loads(manifestFile.read().decode('utf-8'))
+        if manifest.get('formatVersion') == uploadManifestFormatVersion:
+            return manifest
+    except FileNotFoundError:
+        pass
+    return {'formatVersion': uploadManifestFormatVersion, 'files': {}}
+
+# writes the manifest (to a temporary file, which we then rename into place, so that a half-written manifest is never visible).
+def writeUploadManifest(sftp, directory, manifest):
+    temporaryPath = posixpath.join(directory, uploadManifestName + ".tmp")
+    with sftp.open(temporaryPath, 'w') as manifestFile:
+        manifestFile.write(json.dumps(manifest, indent=4).encode('utf-8'))
+    sftp.posix_rename(temporaryPath, posixpath.join(directory, uploadManifestName))
+
+# uploads the file at localPath, whose size is size and whose content hash is contentHash, to remotePath, by way of a partial file in the same
+# directory (resuming from the end of the partial file, if there is one already).  Returns the number of bytes sent.
+def uploadFile(sftp, localPath, remotePath, contentHash, size):
+    partialPath = posixpath.join(posixpath.dirname(remotePath), getPartialName(contentHash))
+    try:
+        offset = sftp.stat(partialPath).st_size
+    except FileNotFoundError:
+        offset = 0
+    if offset > size:
+        offset = 0
+    with open(localPath, 'rb') as inputFile, sftp.open(partialPath, ('r+' if offset else 'w')) as remoteFile:
+        remoteFile.set_pipelined(True)
+        inputFile.seek(offset)
+        remoteFile.seek(offset)
+        while True:
+            chunk = inputFile.read(chunkSize)
+            if not chunk:
+                break
+            remoteFile.write(chunk)
+    remoteSize = sftp.stat(partialPath).st_size
+    if remoteSize != size:
+        raise IOError("after uploading " + str(localPath) + ", " + partialPath + " has " + str(remoteSize) + " bytes, rather than " + str(size) + ".")
+    sftp.posix_rename(partialPath, remotePath)
+    return size - offset
+
+
+startTime = time.perf_counter()
+localPaths = [pathlib.Path(inputFile).resolve() for inputFile in args.input_file]
+destinationDirectory = args.destination_directory[0]
+
+client = paramiko.SSHClient()
+client.load_system_host_keys()
+if args.known_hosts_file:
+    knownHostsPath = pathlib.Path(args.known_hosts_file[0])
+    if args.accept_unknown_host_key and not knownHostsPath.exists():
+        knownHostsPath.parent.mkdir(parents=True, exist_ok=True)
+        knownHostsPath.touch()
+    if knownHostsPath.exists():
+        # (loading the file, rather than merely reading it, is what makes paramiko save any newly accepted host key to it.)
+        client.load_host_keys(str(knownHostsPath))
+if args.accept_unknown_host_key:
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.max_concurrent_uploads[0])) as executor:
+    # we hash the files while we connect.
+    contentHashFutures = [executor.submit(getContentHash, localPath) for localPath in localPaths]
+    client.connect(args.host[0], port=args.port[0], username=args.username[0], key_filename=(args.key_file[0] if args.key_file else None))
+    transport = client.get_transport()
+    contentHashes = [future.result() for future in contentHashFutures]
+
+    # each thread gets its own sftp channel on the (one) connection.
+    threadState = threading.local()
+    def getSftp():
+        if not hasattr(threadState, 'sftp'):
+            threadState.sftp = paramiko.SFTPClient.from_transport(transport)
+        return threadState.sftp
+
+    sftp = paramiko.SFTPClient.from_transport(transport)
+    manifest = readUploadManifest(sftp, destinationDirectory)
+    remoteSizes = {attributes.filename: attributes.st_size for attributes in sftp.listdir_attr(destinationDirectory)}
+    # forget the files that have since been deleted from the makerbot (or replaced by something else).
+    manifest['files'] = {
+        contentHash: entry for contentHash, entry in manifest['files'].items()
+        if remoteSizes.get(entry['name']) == entry['size']
+    }
+
+    # delete the partial files of content that we are not about to upload (those of the content that we are uploading, we resume).
+    for name in remoteSizes:
+        match = partialNamePattern.match(name)
+        if match and match.group(1) not in contentHashes:
+            sftp.remove(posixpath.join(destinationDirectory, name))
+            print("deleted " + posixpath.join(destinationDirectory, name) + ", left behind by an interrupted upload of other content.")
+
+    manifestLock = threading.Lock()
+    def uploadAndRecord(localPath, contentHash, size):
+        name = args.name_prefix[0] + localPath.name
+        # the upload replaces whatever is at name, so we first forget the content that the manifest records there (which would otherwise,
+        # if the new file happened to have the same size, still appear to be on the makerbot).
+        with manifestLock:
+            replacedContentHashes = [otherContentHash for otherContentHash, entry in manifest['files'].items() if entry['name'] == name]
+            if replacedContentHashes:
+                for otherContentHash in replacedContentHashes:
+                    del manifest['files'][otherContentHash]
+                writeUploadManifest(getSftp(), destinationDirectory, manifest)
+        sentByteCount = uploadFile(getSftp(), localPath, posixpath.join(destinationDirectory, name), contentHash, size)
+        with manifestLock:
+            manifest['files'][contentHash] = {'name': name, 'size': size}
+            writeUploadManifest(getSftp(), destinationDirectory, manifest)
+        print("uploaded " + str(localPath) + " to " + args.host[0] + ":" + posixpath.join(destinationDirectory, name)
+            + ("" if sentByteCount == size else " (resuming an interrupted upload, from byte " + str(size - sentByteCount) + ")") + ".")
+        return sentByteCount
+
+    uploadFutures = []
+    scheduledContentHashes = set()
+    for localPath, contentHash in zip(localPaths, contentHashes):
+        existingEntry = manifest['files'].get(contentHash)
+        if existingEntry:
+            print("skipping " + str(localPath) + ", whose content is already on the makerbot, as " + posixpath.join(destinationDirectory, existingEntry['name']) + ".")
+        elif contentHash in scheduledContentHashes:
+            print("skipping " + str(localPath) + ", whose content is the same as that of another of the files being uploaded.")
+        else:
+            scheduledContentHashes.add(contentHash)
+            uploadFutures.append(executor.submit(uploadAndRecord, localPath, contentHash, localPath.stat().st_size))
+    sentByteCount = sum(future.result() for future in uploadFutures)
+client.close()
+
+duration = time.perf_counter() - startTime
+print("uploaded " + str(len(uploadFutures)) + " of " + str(len(localPaths)) + " files (" + format(sentByteCount / 1e6, ".1f") + " MB) in " + format(duration, ".1f") + " s"
+    + (" (" + format(sentByteCount / 1e6 / duration, ".1f") + " MB/s)" if sentByteCount else "") + ".")